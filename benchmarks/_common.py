@@ -0,0 +1,170 @@
+"""
+Shared helpers for the benchmark scripts
+
+Scripts are run from the repository root, e.g. `python benchmarks/async_vs_sync.py`;
+they put the fastapi directory on sys.path the same way uvicorn sees it.
+"""
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(REPO_ROOT, "fastapi")
+
+
+def use_api_path():
+    """Make the API modules importable (`import myapi`, `from services import ...`)"""
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+
+
+# Drugs the knowledge base knows nothing about, so regimens are not all hits
+UNLISTED_DRUGS = ("metformin", "levothyroxine", "amlodipine", "omeprazole", "sertraline", "albuterol")
+DOSES = ("", " 5mg", " 10mg daily", " 20mg", " 500mg twice daily")
+
+
+def drug_vocabulary() -> List[str]:
+    """Every drug named in DRUG_INTERACTIONS and DRUG_CATEGORIES, plus a few unlisted ones"""
+    use_api_path()
+    from services.drug_interaction_service import DRUG_CATEGORIES, DRUG_INTERACTIONS
+
+    names = set(DRUG_INTERACTIONS)
+    for partners in DRUG_INTERACTIONS.values():
+        names.update(partners)
+    for members in DRUG_CATEGORIES.values():
+        names.update(members)
+    return sorted(names) + list(UNLISTED_DRUGS)
+
+
+def random_regimen(rng: random.Random, vocabulary: List[str], size: int) -> str:
+    """Comma-separated list of size distinct drugs, some with doses, as patients write them"""
+    drugs = rng.sample(vocabulary, min(size, len(vocabulary)))
+    return ", ".join(drug + rng.choice(DOSES) for drug in drugs)
+
+
+FIRST_NAMES = ("Maria", "James", "Wei", "Fatima", "Olga", "David", "Aisha", "Carlos", "Mei", "John", "Priya", "Zoë")
+LAST_NAMES = ("Garcia", "Smith", "Chen", "Khan", "Ivanova", "Cohen", "Okafor", "Silva", "Tanaka", "Brown", "Patel", "Müller")
+NOTES = (
+    None, None, None,
+    "Prefers morning pickup",
+    "Requested generic where available",
+    "Caregiver collects prescriptions",
+    "Hard of hearing; counsel in person",
+    "Insurance prior authorization pending",
+)
+
+
+def random_intake(rng: random.Random, vocabulary: List[str], number: int) -> dict:
+    """IntakeCreate fields for a synthetic patient taking 1-4 new and 0-5 current drugs"""
+    current = rng.randint(0, 5)
+    return {
+        "patient_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {number}",
+        "patient_age": rng.randint(18, 95),
+        "patient_allergies": rng.choice([None, None, "penicillin", "sulfa"]),
+        "medications": random_regimen(rng, vocabulary, rng.randint(1, 4)),
+        "current_medications": random_regimen(rng, vocabulary, current) if current else None,
+        "notes": rng.choice(NOTES),
+    }
+
+
+def seed_intakes(db, count: int, seed: int = 0, batch: int = 5000, first_number: int = 0) -> List[int]:
+    """Insert count synthetic intakes, screened, through intake_service.create_intakes"""
+    use_api_path()
+    from schemas.intake import IntakeCreate
+    from services import intake_service
+    from services.drug_interaction_service import screen_intakes
+
+    rng = random.Random(seed)
+    vocabulary = drug_vocabulary()
+    ids = []
+    for start in range(0, count, batch):
+        items = [
+            IntakeCreate(**random_intake(rng, vocabulary, first_number + number))
+            for number in range(start, min(start + batch, count))
+        ]
+        screenings = screen_intakes([(item.medications, item.current_medications) for item in items])
+        ids.extend(intake_service.create_intakes(db, items, screenings))
+    return ids
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: Iterable[float], elapsed: Optional[float] = None) -> Dict[str, float]:
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    values = sorted(latencies)
+    summary = {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else None,
+        "p50_ms": round(percentile(values, 50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 95) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 3) if values else None,
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+    if elapsed:
+        summary["rps"] = round(len(values) / elapsed, 1)
+    return summary
+
+
+def best_of(repeat: int, fn: Callable[[], object]) -> float:
+    """Fastest of repeat timed calls of fn, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def write_report(report: dict, path: Optional[str] = None):
+    """Print the report as JSON, and also save it when a path is given"""
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args: List[str], port: int, env: Optional[dict] = None, timeout: float = 30) -> subprocess.Popen:
+    """Start a server subprocess and wait until /health answers"""
+    import httpx
+
+    proc = subprocess.Popen(args, cwd=API_DIR, env={**os.environ, **(env or {})})
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Server did not become healthy in time")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,155 @@
+"""
+Sync vs async request handling under concurrent create/list load
+
+Starts each variant under uvicorn against its own fresh SQLite file, drives it
+with a fixed number of concurrent clients, and reports requests/sec and latency
+percentiles per operation as JSON:
+
+    python benchmarks/async_vs_sync.py --requests 2000 --concurrency 32
+
+The "sync" variant serves the same service functions from plain `def` handlers
+with a blocking Session (the threadpool model); "async" is the real application.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from _common import free_port, git_revision, start_server, summarize, use_api_path, write_report
+
+MEDICATION_MIXES = [
+    ("warfarin, lisinopril", "aspirin"),
+    ("atorvastatin 20mg", "erythromycin"),
+    ("amoxicillin", None),
+    ("ibuprofen, naproxen", None),
+    ("lisinopril 10mg daily", "potassium, spironolactone"),
+]
+
+
+def build_sync_app():
+    """The intakes create/list endpoints served the threadpool way"""
+    from fastapi import Depends, FastAPI
+    from sqlalchemy.orm import Session
+
+    from database import SessionLocal, get_db, init_db
+    from schemas.intake import IntakeCreate, IntakeOut, IntakePage
+    from services import intake_service
+
+    init_db()
+    with SessionLocal() as db:
+        intake_service.ensure_statistics(db)
+
+    app = FastAPI()
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.post("/intakes", response_model=IntakeOut)
+    def create_intake(payload: IntakeCreate, db: Session = Depends(get_db)):
+        return intake_service.create_intake(db, payload)
+
+    @app.get("/intakes", response_model=IntakePage)
+    def list_intakes(limit: int = 50, db: Session = Depends(get_db)):
+        items, next_cursor = intake_service.list_intakes(db, limit=limit)
+        return {"items": items, "next_cursor": next_cursor}
+
+    return app
+
+
+def serve(variant: str, port: int):
+    import uvicorn
+
+    use_api_path()
+    if variant == "sync":
+        app = build_sync_app()
+    else:
+        from myapi import app
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+async def drive(base_url: str, requests: int, concurrency: int, create_ratio: float) -> dict:
+    import httpx
+
+    latencies = {"create": [], "list": []}
+    errors = 0
+    remaining = iter(range(requests))
+    rng = random.Random(42)
+
+    async def worker(client):
+        nonlocal errors
+        for i in remaining:
+            if rng.random() < create_ratio:
+                op = "create"
+                medications, current = rng.choice(MEDICATION_MIXES)
+                call = client.post("/intakes", json={
+                    "patient_name": f"Bench Patient {i}",
+                    "medications": medications,
+                    "current_medications": current,
+                })
+            else:
+                op = "list"
+                call = client.get("/intakes", params={"limit": 50})
+            start = time.perf_counter()
+            response = await call
+            latencies[op].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    total = sum(len(v) for v in latencies.values())
+    return {
+        "requests_per_sec": round(total / elapsed, 1),
+        "errors": errors,
+        "overall": summarize([x for v in latencies.values() for x in v]),
+        "create": summarize(latencies["create"]),
+        "list": summarize(latencies["list"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--create-ratio", type=float, default=0.3, help="Share of requests that create intakes")
+    parser.add_argument("--seed", type=int, default=500, help="Intakes created before measuring")
+    parser.add_argument("--variants", default="sync,async")
+    parser.add_argument("--output", help="Also write the JSON report here")
+    parser.add_argument("--serve", choices=["sync", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    report = {"benchmark": "async_vs_sync", "revision": git_revision(), "config": vars(args), "results": {}}
+    for variant in args.variants.split(","):
+        port = free_port()
+        db_dir = tempfile.mkdtemp(prefix=f"bench-{variant}-")
+        env = {"DATABASE_URL": f"sqlite:///{os.path.join(db_dir, 'bench.db')}"}
+        proc = start_server(
+            [sys.executable, os.path.abspath(__file__), "--serve", variant, "--port", str(port)], port, env
+        )
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            asyncio.run(drive(base_url, args.seed, args.concurrency, create_ratio=1.0))
+            report["results"][variant] = asyncio.run(
+                drive(base_url, args.requests, args.concurrency, args.create_ratio)
+            )
+        finally:
+            proc.terminate()
+            proc.wait()
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Throughput and latency of the API under a mixed workload
+
+Seeds a fresh SQLite file with synthetic intakes, then drives the application
+with concurrent clients issuing a weighted mix of operations, and reports
+requests/sec plus p50/p95/p99 latency per operation as JSON:
+
+    python benchmarks/load_test.py --seed-intakes 2000 --requests 5000 --concurrency 32
+    python benchmarks/load_test.py --target uvicorn --mix create=10,list=60,stats=30
+
+Operations:
+  create   POST /intakes with a random regimen
+  list     GET /intakes (a third of them filtered by status)
+  status   POST /intakes/{id}/status, walking intakes through the workflow
+  check    GET /intakes/{id}/check-interactions
+  stats    GET /intakes/stats/summary
+
+--target inprocess (the default) calls the ASGI app directly, measuring the
+application without network overhead; --target uvicorn starts a real server.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import tempfile
+import time
+
+from _common import (
+    drug_vocabulary, free_port, git_revision, random_intake, seed_intakes, start_server, summarize,
+    use_api_path, write_report,
+)
+
+DEFAULT_MIX = "create=15,list=35,status=20,check=15,stats=15"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Workload:
+    """Picks operations and builds their requests; intake state is tracked client-side"""
+
+    def __init__(self, intake_ids, seed: int):
+        from services.intake_service import ALLOWED_TRANSITIONS
+
+        self.transitions = ALLOWED_TRANSITIONS
+        self.rng = random.Random(seed)
+        self.vocabulary = drug_vocabulary()
+        self.intake_ids = list(intake_ids)
+        # Intakes that can still move, with their current status; an intake is
+        # taken out while its transition is in flight so no two clients race on it
+        self.movable = collections.deque((intake_id, "new") for intake_id in self.intake_ids)
+        self.created = 0
+
+    async def create(self, client):
+        self.created += 1
+        payload = random_intake(self.rng, self.vocabulary, len(self.intake_ids) + self.created)
+        response = await client.post("/intakes", json=payload)
+        if response.status_code == 200:
+            intake_id = response.json()["id"]
+            self.intake_ids.append(intake_id)
+            self.movable.append((intake_id, "new"))
+        return response
+
+    async def list(self, client):
+        params = {"limit": 50}
+        if self.rng.random() < 1 / 3:
+            params["status"] = self.rng.choice(list(self.transitions))
+        return await client.get("/intakes", params=params)
+
+    async def status(self, client):
+        if not self.movable:
+            return await self.stats(client)
+        intake_id, current = self.movable.popleft()
+        target = self.rng.choice(self.transitions[current])
+        response = await client.post(f"/intakes/{intake_id}/status", json={"status": target})
+        if response.status_code == 200:
+            current = target
+        if self.transitions[current]:
+            self.movable.append((intake_id, current))
+        return response
+
+    async def check(self, client):
+        return await client.get(f"/intakes/{self.rng.choice(self.intake_ids)}/check-interactions")
+
+    async def stats(self, client):
+        return await client.get("/intakes/stats/summary")
+
+
+OPERATIONS = ("create", "list", "status", "check", "stats")
+
+
+async def drive(client, workload: Workload, mix: dict, requests: int, concurrency: int) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = collections.Counter()
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            name = workload.rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            response = await getattr(workload, name)(client)
+            latencies[name].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "requests_per_sec": round(total / elapsed, 1),
+        "elapsed_s": round(elapsed, 3),
+        "errors": dict(errors),
+        "overall": summarize([x for values in latencies.values() for x in values]),
+        **{name: summarize(values, elapsed) for name, values in latencies.items()},
+    }
+
+
+async def run_inprocess(workload: Workload, args, mix: dict) -> dict:
+    import httpx
+    from myapi import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await drive(client, workload, mix, args.requests, args.concurrency)
+
+
+async def run_remote(workload: Workload, args, mix: dict, base_url: str) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        return await drive(client, workload, mix, args.requests, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--seed-intakes", type=int, default=1000, help="Intakes created before measuring")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Operation weights, e.g. list=3,stats=1")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (--target uvicorn)")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    db_dir = tempfile.mkdtemp(prefix="bench-load-")
+    database_url = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    use_api_path()
+    from database import SessionLocal, init_db
+
+    init_db()
+    with SessionLocal() as db:
+        intake_ids = seed_intakes(db, args.seed_intakes, seed=args.random_seed)
+    workload = Workload(intake_ids, args.random_seed)
+
+    report = {"benchmark": "load_test", "revision": git_revision(), "config": {**vars(args), "mix": mix}}
+    if args.target == "inprocess":
+        report["results"] = asyncio.run(run_inprocess(workload, args, mix))
+    else:
+        port = free_port()
+        proc = start_server(
+            [sys.executable, "-m", "uvicorn", "myapi:app", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            port, {"DATABASE_URL": database_url},
+        )
+        try:
+            report["results"] = asyncio.run(run_remote(workload, args, mix, f"http://127.0.0.1:{port}"))
+        finally:
+            proc.terminate()
+            proc.wait()
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Overload reproduction: dashboard reads flooding the API while staff record dispenses
+
+Seeds a SQLite file with synthetic intakes, then runs the same workload against
+a uvicorn server twice, with ADMISSION_CONTROL off and on. Many dashboard
+clients refresh list pages and the statistics summary back to back, while a
+few staff clients walk intakes through the workflow with POST .../status and
+POST .../dispense. The report has latency percentiles, 503s and client
+timeouts per client kind for each run, the server's own handling time per
+route (from GET /metrics) and its admission counters:
+
+    python benchmarks/overload.py
+    python benchmarks/overload.py --dashboard-clients 128 --duration 30 --workers 2
+
+Without admission control every request waits its turn in the database pool,
+so dispense latency grows with the number of dashboards. With it the dashboard
+reads are held to their class limit and shed with 503 when they cannot be
+served soon, and the writes keep a low latency. Shed clients wait for
+Retry-After before trying again, as the frontend does. On a machine with few
+cores the load generator competes with the server for CPU, which inflates the
+client-side latencies of both runs; the server timings are not affected.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from _common import free_port, git_revision, seed_intakes, start_server, summarize, use_api_path, write_report
+
+
+class Results:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.shed = collections.Counter()
+        self.timeouts = collections.Counter()
+        self.errors = collections.Counter()
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            kind: {
+                **summarize(self.latencies[kind], elapsed),
+                "shed": self.shed[kind],
+                "timeouts": self.timeouts[kind],
+                "errors": self.errors[kind],
+            }
+            for kind in ("dashboard", "staff")
+        }
+
+
+async def call(client, results: Results, kind: str, method: str, url: str, **kwargs):
+    """One request; returns the response, or None if it was shed, timed out or failed"""
+    import httpx
+
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.TimeoutException:
+        results.timeouts[kind] += 1
+        return None
+    if response.status_code == 503:
+        results.shed[kind] += 1
+        await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+        return None
+    if response.status_code >= 400:
+        results.errors[kind] += 1
+        return None
+    results.latencies[kind].append(time.perf_counter() - start)
+    return response
+
+
+async def dashboard(client, results: Results, rng: random.Random, deadline: float, page_size: int):
+    statuses = ["new", "triage", "ready_to_fill", "filled"]
+    while time.monotonic() < deadline:
+        params = {"limit": page_size}
+        if rng.random() < 0.5:
+            params["status"] = rng.choice(statuses)
+        await call(client, results, "dashboard", "GET", "/intakes", params=params)
+        await call(client, results, "dashboard", "GET", "/intakes/stats/summary")
+
+
+async def staff(client, results: Results, movable: collections.deque, transitions: dict, rng, deadline: float):
+    while time.monotonic() < deadline and movable:
+        intake_id, current = movable.popleft()
+        if current == "filled":
+            response = await call(client, results, "staff", "POST", f"/intakes/{intake_id}/dispense", json={"dispensed": "yes"})
+            target = "dispensed"
+        else:
+            target = rng.choice(transitions[current])
+            response = await call(client, results, "staff", "POST", f"/intakes/{intake_id}/status", json={"status": target})
+        if response is not None:
+            current = target
+        if transitions[current]:
+            movable.append((intake_id, current))
+
+
+DURATION_SERIES = re.compile(
+    r'^http_request_duration_seconds_(sum|count)\{method="([^"]+)",route="([^"]+)",status="([^"]+)"\} (\S+)$', re.M
+)
+
+
+def server_timings(metrics_text: str) -> dict:
+    """Count and mean handling time per method, route and status, from the server's /metrics"""
+    series = collections.defaultdict(dict)
+    for kind, method, route, status, value in DURATION_SERIES.findall(metrics_text):
+        series[f"{method} {route} {status}"][kind] = float(value)
+    return {
+        name: {"count": int(values["count"]), "mean_ms": round(values["sum"] / values["count"] * 1000, 3)}
+        for name, values in sorted(series.items()) if values.get("count")
+    }
+
+
+async def run(base_url: str, intake_ids, args) -> dict:
+    import httpx
+    from services.intake_service import ALLOWED_TRANSITIONS
+
+    rng = random.Random(args.random_seed)
+    movable = collections.deque((intake_id, "new") for intake_id in intake_ids)
+    results = Results()
+    clients = args.dashboard_clients + args.staff_clients
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(
+            *(dashboard(client, results, random.Random(rng.random()), deadline, args.page_size) for _ in range(args.dashboard_clients)),
+            *(staff(client, results, movable, ALLOWED_TRANSITIONS, random.Random(rng.random()), deadline)
+              for _ in range(args.staff_clients)),
+        )
+        elapsed = time.perf_counter() - started
+        admission = (await client.get("/intakes/stats/admission")).json()
+        timings = server_timings((await client.get("/metrics")).text)
+    return {"elapsed_s": round(elapsed, 3), **results.report(elapsed), "server": timings, "admission": admission}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed-intakes", type=int, default=2000, help="Intakes created before measuring")
+    parser.add_argument("--dashboard-clients", type=int, default=64, help="Clients refreshing lists and statistics")
+    parser.add_argument("--page-size", type=int, default=100, help="Intakes per list page the dashboards load")
+    parser.add_argument("--staff-clients", type=int, default=4, help="Clients changing status and dispensing")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds each run lasts")
+    parser.add_argument("--timeout", type=float, default=10, help="Client timeout per request in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--modes", default="off,on", help="Admission control settings to run, in order")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="bench-overload-")
+    template = os.path.join(db_dir, "seeded.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{template}"
+    use_api_path()
+    from database import SessionLocal, engine, init_db
+
+    init_db()
+    with SessionLocal() as db:
+        intake_ids = seed_intakes(db, args.seed_intakes, seed=args.random_seed)
+    engine.dispose()
+
+    report = {"benchmark": "overload", "revision": git_revision(), "config": vars(args), "results": {}}
+    for mode in args.modes.split(","):
+        # Every run starts from the same seeded database
+        path = os.path.join(db_dir, f"{mode}.db")
+        shutil.copyfile(template, path)
+        port = free_port()
+        proc = start_server(
+            [sys.executable, "-m", "uvicorn", "myapi:app", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            port, {"DATABASE_URL": f"sqlite:///{path}", "ADMISSION_CONTROL": "1" if mode == "on" else "0"},
+        )
+        try:
+            report["results"][mode] = asyncio.run(run(f"http://127.0.0.1:{port}", intake_ids, args))
+        finally:
+            proc.terminate()
+            proc.wait()
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Microbenchmarks for interaction screening and counseling point generation
+
+Times check_drug_interactions and generate_counseling_points on random
+regimens of increasing size, both cold (screening caches cleared before every
+call) and warm (every call a cache hit), reporting the median microseconds per
+call as JSON:
+
+    python benchmarks/screening.py --sizes 1,2,5,10,20 --regimens 200
+
+A regimen of size n is split into roughly half new and half current medications;
+sizes are capped at the vocabulary (every drug the knowledge base names, plus a
+few it does not).
+"""
+import argparse
+import random
+import statistics
+import time
+
+from _common import drug_vocabulary, git_revision, random_regimen, use_api_path, write_report
+
+
+def time_calls(calls, before=None) -> float:
+    """Median seconds per call; before() runs untimed ahead of each call"""
+    timings = []
+    for call in calls:
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def measure(size: int, regimens: int, rng: random.Random, vocabulary) -> dict:
+    from services import drug_interaction_service as screening
+
+    cases = []
+    for _ in range(regimens):
+        current = size // 2
+        medications = random_regimen(rng, vocabulary, size - current)
+        current_medications = random_regimen(rng, vocabulary, current) if current else None
+        interactions = screening.check_drug_interactions(medications, current_medications)
+        cases.append((medications, current_medications, interactions))
+
+    check = [lambda m=m, c=c: screening.check_drug_interactions(m, c) for m, c, _ in cases]
+    counsel = [lambda m=m, i=i: screening.generate_counseling_points(m, i) for m, _, i in cases]
+    result = {
+        "mean_interactions": round(sum(len(i) for _, _, i in cases) / len(cases), 2),
+        "check_cold_us": time_calls(check, screening.invalidate_screening_caches),
+        "counseling_cold_us": time_calls(counsel, screening.invalidate_screening_caches),
+    }
+    for calls in (check, counsel):
+        for call in calls:
+            call()
+    result["check_warm_us"] = time_calls(check)
+    result["counseling_warm_us"] = time_calls(counsel)
+    return {key: round(value * 1e6, 2) if key.endswith("_us") else value for key, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,2,5,10,20", help="Drugs per regimen")
+    parser.add_argument("--regimens", type=int, default=200, help="Random regimens timed per size")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    use_api_path()
+    rng = random.Random(args.random_seed)
+    vocabulary = drug_vocabulary()
+    report = {"benchmark": "screening", "revision": git_revision(), "config": vars(args), "results": {}}
+    for size in (int(size) for size in args.sizes.split(",")):
+        report["results"][str(size)] = measure(size, args.regimens, rng, vocabulary)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Full-text search latency against a LIKE '%term%' scan
+
+Seeds an SQLite file with synthetic intakes (1M by default; reuse one with
+--db to skip seeding next time), then times one 50-row page of
+search_service.search_intakes (FTS5, ranked, with snippets) and of the
+equivalent LIKE scan over the same columns, newest first, for a set of queries
+from common to unique. Reports latency percentiles per query as JSON:
+
+    python benchmarks/search.py --rows 1000000 --db /tmp/search-1m.db
+
+A LIKE scan stops as soon as it has a page of matches, so common terms are
+cheap for it; terms matching few or no rows make it read the whole table.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from _common import git_revision, seed_intakes, summarize, use_api_path, write_report
+
+
+def like_scan(db, query: str, limit: int):
+    from sqlalchemy import and_, or_, select
+
+    from database import Intake
+    from services.intake_service import SUMMARY_COLUMNS
+    from services.search_service import SEARCH_COLUMNS, search_terms
+
+    columns = [getattr(Intake, column) for column in SEARCH_COLUMNS]
+    statement = (
+        select(*SUMMARY_COLUMNS)
+        .where(and_(*(or_(*(column.like(f"%{term}%") for column in columns)) for term in search_terms(query))))
+        .order_by(Intake.created_at.desc(), Intake.id.desc())
+        .limit(limit)
+    )
+    return db.execute(statement).all()
+
+
+def measure(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = fn()
+        timings.append(time.perf_counter() - start)
+    return {"hits": len(rows), **summarize(timings)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Intakes in the database")
+    parser.add_argument("--db", help="SQLite file to use; seeded up to --rows if it has fewer")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query and method")
+    parser.add_argument("--limit", type=int, default=50, help="Page size")
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench-search-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(path)}"
+    use_api_path()
+    from sqlalchemy import func, select
+
+    from database import Intake, SessionLocal, init_db
+    from services import search_service
+
+    init_db()
+    queries = {
+        "common_drug": "warfarin",
+        "name_prefix": "garc",
+        "two_terms": "tanaka lisinopril",
+        "notes_word": "authorization",
+        # Seeded names end in a sequence number
+        "unique_patient": str(args.rows // 2),
+        "no_match": "zzzzzz",
+    }
+    report = {"benchmark": "search", "revision": git_revision(), "config": vars(args), "results": {}}
+    with SessionLocal() as db:
+        existing = db.scalar(select(func.count()).select_from(Intake))
+        started = time.perf_counter()
+        if existing < args.rows:
+            seed_intakes(db, args.rows - existing, seed=existing, first_number=existing)
+        report["seed_seconds"] = round(time.perf_counter() - started, 1)
+        report["rows"] = db.scalar(select(func.count()).select_from(Intake))
+
+        for label, query in queries.items():
+            report["results"][label] = {
+                "query": query,
+                "fts": measure(lambda: search_service.search_intakes(db, query, limit=args.limit)[0], args.repeat),
+                "like": measure(lambda: like_scan(db, query, args.limit), args.repeat),
+            }
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
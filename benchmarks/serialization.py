@@ -0,0 +1,60 @@
+"""
+Cost of encoding intake list pages, per row
+
+Seeds a fresh SQLite file, fetches pages of SUMMARY_COLUMNS rows of increasing
+size, and times the query and each LIST_SERIALIZER mode on them, reporting the
+best of --repeat runs in microseconds per row as JSON:
+
+    python benchmarks/serialization.py --sizes 100,1000,10000,100000
+
+Each mode's output is checked against the "model" encoding before timing.
+"""
+import argparse
+import os
+import tempfile
+
+from _common import best_of, git_revision, seed_intakes, use_api_path, write_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="Rows per page to measure")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the fastest is reported")
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    db_dir = tempfile.mkdtemp(prefix="bench-serialization-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    use_api_path()
+    from database import SessionLocal, init_db
+    from services import serialization
+    from services.intake_service import SUMMARY_COLUMNS, Intake
+
+    init_db()
+    report = {
+        "benchmark": "serialization",
+        "revision": git_revision(),
+        "config": vars(args),
+        "orjson": serialization.orjson is not None,
+        "results": {},
+    }
+    with SessionLocal() as db:
+        seed_intakes(db, max(sizes))
+        for size in sizes:
+            query = db.query(*SUMMARY_COLUMNS).order_by(Intake.id.desc()).limit(size)
+            rows = query.all()
+            expected = serialization.encode_intake_page(rows, None, "model")
+            result = {"query_us_per_row": round(best_of(args.repeat, query.all) / size * 1e6, 3)}
+            for mode in serialization.SERIALIZERS:
+                if serialization.encode_intake_page(rows, None, mode) != expected:
+                    raise SystemExit(f"{mode} output differs from model output at {size} rows")
+                elapsed = best_of(args.repeat, lambda: serialization.encode_intake_page(rows, None, mode))
+                result[f"{mode}_us_per_row"] = round(elapsed / size * 1e6, 3)
+            result["body_bytes"] = len(expected)
+            report["results"][str(size)] = result
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
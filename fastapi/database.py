@@ -1,23 +1,182 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, DateTime, Text, ForeignKey, Index, LargeBinary
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime, timezone
+import os
+import zlib
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./pharmacy.db"
+try:
+    import zstandard
+except ImportError:  # optional; only needed for ARCHIVE_COMPRESSION=zstd
+    zstandard = None
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Any SQLAlchemy URL; defaults to the local SQLite file
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pharmacy.db")
+if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
+    # Some hosts still hand out the scheme SQLAlchemy dropped
+    SQLALCHEMY_DATABASE_URL = "postgresql://" + SQLALCHEMY_DATABASE_URL[len("postgres://"):]
+
+# Connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Per-connection SQLite pragmas
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # Negative values are KiB (64 MiB)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+
+# Codec for the large text fields of archived intakes: "zlib", or "zstd" (needs the zstandard package)
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zlib")
+if ARCHIVE_COMPRESSION not in ("zlib", "zstd"):
+    raise ValueError("ARCHIVE_COMPRESSION must be one of zlib, zstd")
+if ARCHIVE_COMPRESSION == "zstd" and zstandard is None:
+    raise ValueError("ARCHIVE_COMPRESSION=zstd needs the zstandard package")
+
+
+# In-memory SQLite URLs are mapped to one named shared-cache database so the
+# sync and async engines see the same data
+SQLITE_SHARED_MEMORY_URL = "sqlite:///file:pharmacy_memdb?mode=memory&cache=shared&uri=true"
+
+
+def is_sqlite_memory(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+
+if is_sqlite_memory(SQLALCHEMY_DATABASE_URL):
+    SQLALCHEMY_DATABASE_URL = SQLITE_SHARED_MEMORY_URL
+
+
+def engine_options(url: str, use_async: bool = False) -> dict:
+    """create_engine / create_async_engine keyword arguments for the configured database"""
+    if make_url(url).get_backend_name() != "sqlite":
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+
+    connect_args = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    if not use_async:
+        connect_args["check_same_thread"] = False
+    if is_sqlite_memory(url):
+        # Every connection to :memory: is a separate database, so share one
+        return {"connect_args": connect_args, "poolclass": StaticPool}
+    return {
+        "connect_args": connect_args,
+        "poolclass": AsyncAdaptedQueuePool if use_async else QueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+
+
+def sqlite_pragmas(memory: bool = False) -> list:
+    pragmas = [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size = {SQLITE_CACHE_SIZE}",
+        f"PRAGMA temp_store = {SQLITE_TEMP_STORE}",
+    ]
+    if not memory:
+        pragmas = [
+            f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}",
+            f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+            f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}",
+        ] + pragmas
+    return pragmas
+
+
+def apply_sqlite_pragmas(target_engine):
+    """Run the pragma profile on every new DBAPI connection the engine opens"""
+    pragmas = sqlite_pragmas(memory=is_sqlite_memory(target_engine.url))
+
+    @event.listens_for(target_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL):
+    new_engine = create_engine(url, **engine_options(url))
+    if new_engine.dialect.name == "sqlite":
+        apply_sqlite_pragmas(new_engine)
+    return new_engine
+
+
+engine = create_db_engine()
+# Mutations return their rows via RETURNING, so nothing needs reloading after commit
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
 
+# First byte of a CompressedText value, naming how the rest is encoded
+_RAW, _ZLIB, _ZSTD = b"r", b"z", b"s"
+
+
+def compress_text(value: str) -> bytes:
+    data = value.encode("utf-8")
+    if ARCHIVE_COMPRESSION == "zstd":
+        packed = _ZSTD + zstandard.ZstdCompressor().compress(data)
+    else:
+        packed = _ZLIB + zlib.compress(data)
+    # Short values do not shrink; they are kept as they are
+    return packed if len(packed) <= len(data) else _RAW + data
+
+
+def decompress_text(value: bytes) -> str:
+    codec, data = value[:1], value[1:]
+    if codec == _ZLIB:
+        data = zlib.decompress(data)
+    elif codec == _ZSTD:
+        if zstandard is None:
+            raise ValueError("Archived text is zstd-compressed; install the zstandard package to read it")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec != _RAW:
+        raise ValueError(f"Unknown compression tag {codec!r}")
+    return data.decode("utf-8")
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text stored compressed in a binary column, read and written as str
+
+    Each value is tagged with its codec, so changing ARCHIVE_COMPRESSION
+    leaves values written under the old setting readable.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else decompress_text(bytes(value))
+
+
 class Intake(Base):
     __tablename__ = "intakes"
 
     id = Column(Integer, primary_key=True, index=True)
     patient_name = Column(String, index=True)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=True, index=True)
+    patient_date_of_birth = Column(Date, nullable=True)
     patient_age = Column(Integer, nullable=True)
     patient_allergies = Column(Text, nullable=True)
     medications = Column(Text)
@@ -30,10 +189,140 @@ class Intake(Base):
     assigned_to = Column(String, nullable=True)
     dispensed = Column(String, nullable=True)  # "yes", "no", or None
     dispensed_at = Column(DateTime, nullable=True)
+    # "pending" while queued for background screening, "failed" if that gave up
+    screening_status = Column(String, nullable=False, default="screened", server_default="screened")
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
+# Composite indexes matching the queue's access paths (see migrations.py for existing databases)
+Index("ix_intakes_created_at_id", Intake.created_at.desc(), Intake.id.desc())
+Index("ix_intakes_status_created_at", Intake.status, Intake.created_at.desc(), Intake.id.desc())
+Index("ix_intakes_assigned_to_status_created_at", Intake.assigned_to, Intake.status, Intake.created_at)
+Index(
+    "ix_intakes_dispensed_yes",
+    Intake.dispensed,
+    sqlite_where=Intake.dispensed == "yes",
+    postgresql_where=Intake.dispensed == "yes",
+)
+
+
+class IntakeArchive(Base):
+    """
+    An intake moved out of intakes by services/archive_service.py, with the same id
+
+    The list card columns are kept as they are; the large text fields are
+    stored compressed.
+    """
+    __tablename__ = "intakes_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    patient_name = Column(String)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=True, index=True)
+    patient_date_of_birth = Column(Date, nullable=True)
+    patient_age = Column(Integer, nullable=True)
+    patient_allergies = Column(Text, nullable=True)
+    medications = Column(Text)
+    current_medications = Column(Text, nullable=True)
+    notes = Column(CompressedText, nullable=True)
+    counseling_points = Column(CompressedText, nullable=True)
+    pharmacist_notes = Column(CompressedText, nullable=True)
+    drug_interactions = Column(CompressedText, nullable=True)
+    status = Column(String)
+    assigned_to = Column(String, nullable=True)
+    dispensed = Column(String, nullable=True)
+    dispensed_at = Column(DateTime, nullable=True)
+    screening_status = Column(String, nullable=False, default="screened")
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+Index("ix_intakes_archive_created_at_id", IntakeArchive.created_at.desc(), IntakeArchive.id.desc())
+Index("ix_intakes_archive_status_created_at", IntakeArchive.status, IntakeArchive.created_at.desc(), IntakeArchive.id.desc())
+
+
+class IntakeInteraction(Base):
+    """One row per detected interaction, mirroring Intake.drug_interactions in queryable form"""
+    __tablename__ = "intake_interactions"
+
+    id = Column(Integer, primary_key=True)
+    # No foreign key: rows stay when their intake moves to intakes_archive
+    intake_id = Column(Integer, nullable=False, index=True)
+    drug1 = Column(String, nullable=False)
+    drug2 = Column(String, nullable=False, index=True)  # drug1 is covered by the composite index
+    severity = Column(String, nullable=False, index=True)
+    description = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_intake_interactions_drug1_drug2", "drug1", "drug2"),
+    )
+
+
+class Patient(Base):
+    """A patient across intakes, matched on name and date of birth or linked by id"""
+    __tablename__ = "patients"
+
+    id = Column(Integer, primary_key=True)
+    name_key = Column(String, nullable=False, unique=True)  # Lower-cased, whitespace-collapsed name|date of birth
+    name = Column(String, nullable=False)
+    date_of_birth = Column(Date, nullable=True)
+    allergies = Column(Text, nullable=True)  # From the latest intake that listed any
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
 
+class PatientMedication(Base):
+    """
+    One drug on a patient's active medication profile, kept in step by patient_service
+
+    state is "reported" (listed as a current medication on the patient's latest
+    intake that listed any), "pending" (prescribed on an intake not yet
+    dispensed) or "dispensed". Retired rows (their intake was archived, or
+    completed without being dispensed) no longer count for screening but stay
+    for recalls.
+    """
+    __tablename__ = "patient_medications"
+
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False, index=True)
+    intake_id = Column(Integer, nullable=False, index=True)  # In intakes or intakes_archive
+    drug = Column(String, nullable=False)  # Normalized drug name
+    state = Column(String, nullable=False)
+    recorded_at = Column(DateTime, nullable=True)  # When the intake was created
+    retired_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Drug recalls: patients on a drug, in id order, without touching the table
+        Index("ix_patient_medications_drug_patient_id_state", "drug", "patient_id", "state"),
+    )
+
+
+class ScreeningJob(Base):
+    """An intake waiting for background screening (see services/screening_queue.py)"""
+    __tablename__ = "screening_jobs"
+
+    id = Column(Integer, primary_key=True)
+    intake_id = Column(Integer, ForeignKey("intakes.id"), nullable=False, unique=True)
+    status = Column(String, nullable=False, default="queued")  # "queued", "running" or "failed"
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_expires_at = Column(DateTime, nullable=True)  # A running job past this is claimed again
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ix_screening_jobs_status_id", "status", "id"),
+    )
+
+
+class IntakeCounter(Base):
+    """Running totals behind the statistics summary, kept in step by intake_service"""
+    __tablename__ = "intake_counters"
+
+    name = Column(String, primary_key=True)  # e.g. "total", "status:new", "assignee:alice", "day:2024-01-31"
+    value = Column(Integer, nullable=False, default=0)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -42,5 +331,66 @@ def get_db():
         db.close()
 
 
+# Async drivers used when the configured URL names only the backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+_async_state = {"engine": None, "sessionmaker": None}
+
+
+def async_database_url(url: str = SQLALCHEMY_DATABASE_URL) -> str:
+    """The configured URL with an asyncio driver swapped in (an explicit async driver is kept)"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if parsed.drivername == backend or parsed.get_driver_name() in ("pysqlite", "psycopg2"):
+        if backend in ASYNC_DRIVERS:
+            parsed = parsed.set(drivername=ASYNC_DRIVERS[backend])
+    return parsed.render_as_string(hide_password=False)
+
+
+def create_async_db_engine(url: str = SQLALCHEMY_DATABASE_URL):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    new_engine = create_async_engine(async_database_url(url), **engine_options(url, use_async=True))
+    if new_engine.dialect.name == "sqlite":
+        apply_sqlite_pragmas(new_engine.sync_engine)
+    return new_engine
+
+
+def get_async_engine():
+    """The shared async engine, created on first use so the async driver stays optional for sync callers"""
+    if _async_state["engine"] is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        _async_state["engine"] = create_async_db_engine()
+        _async_state["sessionmaker"] = async_sessionmaker(
+            bind=_async_state["engine"], autoflush=False, expire_on_commit=False
+        )
+    return _async_state["engine"]
+
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _async_state["sessionmaker"]()
+
+
+async def dispose_async_engine():
+    """Close pooled async connections (called on application shutdown)"""
+    if _async_state["engine"] is not None:
+        await _async_state["engine"].dispose()
+        _async_state["engine"] = _async_state["sessionmaker"] = None
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def init_db():
+    """Create missing tables, then bring existing databases up to date"""
+    from migrations import run_migrations
+
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
@@ -0,0 +1,117 @@
+"""
+Maintenance commands
+
+Run from the fastapi directory, e.g.:
+    python manage.py build-interaction-kb --source formulary.csv interactions.kb
+"""
+import argparse
+import sys
+
+
+def build_interaction_kb(args):
+    from services import drug_interaction_service
+    from services.interaction_kb import compile_knowledge_base, load_source
+
+    if args.source:
+        interactions, categories, category_interactions = load_source(args.source)
+    else:
+        interactions = drug_interaction_service.DRUG_INTERACTIONS
+        categories = drug_interaction_service.DRUG_CATEGORIES
+        category_interactions = drug_interaction_service.CATEGORY_INTERACTIONS
+    result = compile_knowledge_base(interactions, categories, category_interactions, args.output)
+    print(f"✓ Wrote {args.output}: {result['drugs']} drugs, {result['pairs']} pairs, "
+          f"{result['rules']} category rules, {result['bytes']} bytes")
+
+
+def migrate(args):
+    from database import SessionLocal, init_db
+    from migrations import MIGRATIONS, SchemaMigration
+
+    init_db()
+    with SessionLocal() as db:
+        applied = {version for (version,) in db.query(SchemaMigration.version)}
+    for version, name, _ in MIGRATIONS:
+        print(f"{'✓' if version in applied else '✗'} {version:>3} {name}")
+
+
+def rebuild_search_index(args):
+    from database import SessionLocal, init_db
+    from services import search_service
+
+    init_db()
+    with SessionLocal() as db:
+        if not search_service.has_search_index(db):
+            print("✗ Full-text search needs SQLite; other databases search by substring scan")
+            return 1
+        indexed = search_service.rebuild_search_index(db)
+    print(f"✓ Rebuilt the search index over {indexed} intakes")
+
+
+def rebuild_patient_profiles(args):
+    from database import SessionLocal, init_db
+    from services import patient_service
+
+    init_db()
+    with SessionLocal() as db:
+        processed = patient_service.rebuild_profiles(db, batch_size=args.batch_size)
+    print(f"✓ Rebuilt patient medication profiles from {processed} intakes")
+
+
+def archive_intakes(args):
+    from database import SessionLocal, init_db
+    from services import archive_service
+
+    init_db()
+    options = {
+        name: value
+        for name, value in (("older_than_days", args.older_than_days), ("batch_size", args.batch_size))
+        if value is not None
+    }
+    with SessionLocal() as db:
+        archived = archive_service.archive_intakes(db, max_batches=args.max_batches, **options)
+    print(f"✓ Archived {archived} intakes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pharmacy workflow maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    kb = commands.add_parser(
+        "build-interaction-kb",
+        help="Compile an interaction source (JSON or CSV) into the mmap knowledge base format",
+    )
+    kb.add_argument("output", help="Path of the compiled file; replaced atomically")
+    kb.add_argument("--source", help="JSON or CSV source; defaults to the built-in tables")
+    kb.set_defaults(func=build_interaction_kb)
+
+    migrate_cmd = commands.add_parser("migrate", help="Create missing tables and apply pending schema migrations")
+    migrate_cmd.set_defaults(func=migrate)
+
+    search_cmd = commands.add_parser(
+        "rebuild-search-index", help="Re-index every intake for GET /intakes/search (SQLite FTS5)"
+    )
+    search_cmd.set_defaults(func=rebuild_search_index)
+
+    profiles_cmd = commands.add_parser(
+        "rebuild-patient-profiles", help="Re-link intakes to patients and re-derive every medication profile"
+    )
+    profiles_cmd.add_argument("--batch-size", type=int, default=1000, help="Intakes per transaction")
+    profiles_cmd.set_defaults(func=rebuild_patient_profiles)
+
+    archive_cmd = commands.add_parser(
+        "archive-intakes",
+        help="Move intakes in a terminal status to intakes_archive once unchanged for the retention period",
+    )
+    archive_cmd.add_argument(
+        "--older-than-days", type=float, default=None, help="Retention period; defaults to ARCHIVE_AFTER_DAYS"
+    )
+    archive_cmd.add_argument("--batch-size", type=int, default=None, help="Intakes per transaction; defaults to ARCHIVE_BATCH_SIZE")
+    archive_cmd.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches")
+    archive_cmd.set_defaults(func=archive_intakes)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
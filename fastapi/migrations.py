@@ -0,0 +1,161 @@
+"""
+Schema Migrations
+Ordered, idempotent upgrade steps for databases created by older versions
+
+Base.metadata.create_all only creates tables that do not exist yet, so new
+indexes, columns and data backfills on existing tables are applied here.
+Each applied step is recorded in schema_migrations and never runs twice.
+Steps must be safe to re-run, since two workers starting together may race.
+"""
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+from sqlalchemy import Column, DateTime, Integer, String, delete, inspect, literal, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import Base, Intake, IntakeArchive, IntakeInteraction, Patient, PatientMedication, SessionLocal
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+def create_missing_indexes(db: Session, model, *index_names: str):
+    """
+    Create the named indexes declared on the model's table that the database lacks
+
+    Steps name their indexes explicitly: an index declared later on a column a
+    later step adds must not be created before that column exists.
+    """
+    bind = db.connection()
+    indexes = {index.name: index for index in model.__table__.indexes}
+    for name in index_names:
+        indexes[name].create(bind=bind, checkfirst=True)
+
+
+def add_missing_columns(db: Session, model, *column_names: str):
+    """ALTER TABLE ... ADD COLUMN for declared columns the existing table lacks"""
+    bind = db.connection()
+    table = model.__table__
+    existing = {c["name"] for c in inspect(bind).get_columns(table.name)}
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        column_type = column.type.compile(dialect=bind.dialect)
+        default = ""
+        if column.server_default is not None:
+            arg = column.server_default.arg
+            if isinstance(arg, str):
+                arg = literal(arg).compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})
+            default = f" DEFAULT {arg}"
+        bind.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {name} {column_type}{default}')
+
+
+def drop_foreign_keys(db: Session, table_name: str, referred_table: str):
+    """Drop the foreign keys from table_name to referred_table (SQLite cannot, but does not enforce them either)"""
+    bind = db.connection()
+    if bind.dialect.name == "sqlite":
+        return
+    for foreign_key in inspect(bind).get_foreign_keys(table_name):
+        if foreign_key["referred_table"] == referred_table and foreign_key.get("name"):
+            bind.exec_driver_sql(f'ALTER TABLE {table_name} DROP CONSTRAINT {foreign_key["name"]}')
+
+
+def _intake_indexes(db: Session):
+    create_missing_indexes(
+        db, Intake,
+        "ix_intakes_created_at_id", "ix_intakes_status_created_at",
+        "ix_intakes_assigned_to_status_created_at", "ix_intakes_dispensed_yes",
+    )
+    create_missing_indexes(
+        db, IntakeInteraction,
+        "ix_intake_interactions_intake_id", "ix_intake_interactions_drug2",
+        "ix_intake_interactions_severity", "ix_intake_interactions_drug1_drug2",
+    )
+
+
+def _backfill_intake_interactions(db: Session):
+    from services import intake_service
+    intake_service.backfill_interactions(db)
+
+
+def _intake_search_index(db: Session):
+    from services import search_service
+    search_service.ensure_search_index(db)
+    if search_service.has_search_index(db):
+        # Index the rows that predate the triggers
+        db.execute(text("INSERT INTO intakes_fts(intakes_fts) VALUES ('rebuild')"))
+
+
+def _patient_profiles(db: Session):
+    # Profiles are derived by _patient_identity, once the columns it reads exist
+    add_missing_columns(db, Intake, "patient_id")
+    create_missing_indexes(db, Intake, "ix_intakes_patient_id")
+    create_missing_indexes(
+        db, PatientMedication,
+        "ix_patient_medications_patient_id", "ix_patient_medications_intake_id",
+        "ix_patient_medications_drug_patient_id_state",
+    )
+
+
+def _intake_screening_status(db: Session):
+    add_missing_columns(db, Intake, "screening_status")
+
+
+def _intakes_archive(db: Session):
+    # intakes_archive itself is created by create_all; interaction and profile
+    # rows stay behind when their intake is archived
+    drop_foreign_keys(db, "intake_interactions", "intakes")
+    drop_foreign_keys(db, "patient_medications", "intakes")
+
+
+def _patient_identity(db: Session):
+    from services import patient_service
+    add_missing_columns(db, Intake, "patient_date_of_birth")
+    add_missing_columns(db, IntakeArchive, "patient_date_of_birth")
+    add_missing_columns(db, Patient, "date_of_birth")
+    add_missing_columns(db, PatientMedication, "recorded_at", "retired_at")
+    # Patients matched on the name alone may be several people; no intake has a
+    # date of birth yet, so every intake starts unlinked and profiles start over
+    db.execute(update(Intake).values(patient_id=None, updated_at=Intake.updated_at))
+    db.execute(update(IntakeArchive).values(patient_id=None, updated_at=IntakeArchive.updated_at))
+    db.execute(delete(PatientMedication))
+    db.execute(delete(Patient))
+    patient_service.rebuild_profiles(db)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Session], None]]] = [
+    (1, "intake_query_indexes", _intake_indexes),
+    (2, "backfill_intake_interactions", _backfill_intake_interactions),
+    (3, "intake_search_index", _intake_search_index),
+    (4, "patient_profiles", _patient_profiles),
+    (5, "intake_screening_status", _intake_screening_status),
+    (6, "intakes_archive", _intakes_archive),
+    (7, "patient_identity", _patient_identity),
+]
+
+
+def run_migrations(engine) -> List[str]:
+    """Apply pending migrations in order; returns the names of those applied"""
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    applied = []
+    with SessionLocal(bind=engine) as db:
+        done = {version for (version,) in db.query(SchemaMigration.version)}
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            migrate(db)
+            db.add(SchemaMigration(version=version, name=name))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker recorded it first; the step is idempotent
+                db.rollback()
+                continue
+            applied.append(name)
+    return applied
@@ -2,22 +2,51 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from routers.intakes import router as intakes_router
-from database import init_db
+from routers.patients import router as patients_router
+from database import init_db, dispose_async_engine, SessionLocal
+from services import admission, bulk_intake_service, intake_service, metrics, query_inspector, screening_queue
+from services.archive_service import archiver
+from services.screening_worker import worker as screening_worker
+from services.event_bus import bus
 import os
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup - initialize database (fast operation)
+    # Startup - initialize database; a failed migration stops the server rather than
+    # serving against a half-upgraded schema
+    init_db()
+    with SessionLocal() as db:
+        intake_service.ensure_statistics(db)
+    print("✓ Database initialized")
     try:
-        init_db()
-        print("✓ Database initialized")
+        await bus.start()
     except Exception as e:
-        print(f"⚠ Database initialization warning: {e}")
+        print(f"⚠ Event bus unavailable, events stay in this process: {e}")
+    metrics.start_profiler()
+    # Also drains jobs left queued by an earlier run in background mode
+    try:
+        with SessionLocal() as db:
+            pending_jobs = screening_queue.queue_depth(db, 1)
+        if screening_queue.SCREENING_MODE == "background" or pending_jobs:
+            screening_worker.start()
+            print("✓ Background screening worker started")
+    except Exception as e:
+        print(f"⚠ Background screening worker not started: {e}")
+    if archiver.enabled:
+        archiver.start()
+        print("✓ Archiving completed intakes during ARCHIVE_WINDOW")
     yield
-    # Shutdown (if needed)
+    # Shutdown - stop the event relay, profiler, archiver, screening worker and bulk screening
+    # processes, release pooled async connections
+    await bus.stop()
+    metrics.stop_profiler()
+    await archiver.stop()
+    await screening_worker.stop()
+    bulk_intake_service.shutdown_screening_pool()
+    await dispose_async_engine()
 
 
 app = FastAPI(
@@ -27,6 +56,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Innermost, so shed requests still get CORS headers and show up in the metrics
+if admission.ADMISSION_CONTROL:
+    app.add_middleware(admission.AdmissionMiddleware)
+
 # Enable CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -36,11 +69,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Development aid: per-request statement counts and N+1 warnings
+if query_inspector.QUERY_INSPECTOR:
+    app.add_middleware(query_inspector.QueryInspectorMiddleware)
+
+# Outermost, so the timings include CORS handling
+app.add_middleware(metrics.MetricsMiddleware)
+
 @app.get("/health")
 def health_check():
     return {"status": "ok", "message": "Pharmacy Workflow API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request latency, per-request query counts and DB time, stage timings and admission control (Prometheus text format)"""
+    return PlainTextResponse(metrics.render() + admission.controller.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(intakes_router)
+app.include_router(patients_router)
 
 # Serve frontend static files (for hosting)
 frontend_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend")
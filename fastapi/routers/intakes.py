@@ -1,46 +1,241 @@
-from schemas.intake_actions import StatusUpdate, AssignUser
-from fastapi import APIRouter, HTTPException, Depends, Query
-from sqlalchemy.orm import Session
+from datetime import datetime, timezone
+from schemas.intake_actions import (
+    StatusUpdate, AssignUser, BatchInteractionCheck, BulkStatusUpdate, BulkAssign, BulkResult
+)
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas.intake import (
-    IntakeCreate, IntakeOut, 
+    IntakeCreate, IntakeOut, IntakePage, IntakeSearchPage,
     CounselingPointsUpdate, PharmacistNotesUpdate, DispenseUpdate
 )
-from services import intake_service
-from database import get_db
+from services import (
+    admission, async_intake_service, bulk_intake_service, intake_service, drug_interaction_service, event_bus, response_cache,
+    serialization,
+)
+from database import get_async_db
 
 router = APIRouter(prefix="/intakes", tags=["intakes"])
 
 
+class RequestStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for bodies produced while the request body is still being read
+
+    The stock class listens for disconnects by consuming receive(), which would
+    swallow the request body; here the body iterator reads it instead, and a
+    disconnect surfaces there as ClientDisconnect.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": response_cache.CACHE_CONTROL})
+
+
+def set_validators(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = response_cache.CACHE_CONTROL
+
+
 @router.post("", response_model=IntakeOut)
-def create_intake(payload: IntakeCreate, db: Session = Depends(get_db)):
+async def create_intake(payload: IntakeCreate, db: AsyncSession = Depends(get_async_db)):
     try:
-        return intake_service.create_intake(db, payload)
+        return await async_intake_service.create_intake(db, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating intake: {str(e)}")
 
 
-@router.get("", response_model=list[IntakeOut])
-def list_intakes(
+@router.post(
+    ":bulk",
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/x-ndjson": {"schema": IntakeCreate.model_json_schema()}},
+    }},
+)
+async def bulk_create_intakes(
+    request: Request,
+    chunk_size: int = Query(bulk_intake_service.BULK_CHUNK_SIZE, ge=1, le=5000, description="Intakes per transaction"),
+):
+    """
+    Create intakes from an NDJSON body, one IntakeCreate per line
+
+    Streams back one NDJSON line per input line: {"line": n, "id": ...} or {"line": n, "error": ...}.
+    """
+    return RequestStreamingResponse(
+        bulk_intake_service.ingest_ndjson(request.stream(), chunk_size=chunk_size),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/status:bulk", response_model=BulkResult, response_model_exclude_none=True)
+async def change_status_bulk(payload: BulkStatusUpdate, db: AsyncSession = Depends(get_async_db)):
+    """
+    Move many intakes to one status in a single transaction
+
+    Intakes whose current status does not allow the move are left as they
+    are; each id gets its own outcome.
+    """
+    try:
+        results = await async_intake_service.update_status_bulk(db, payload.ids, payload.status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"updated": sum(result["outcome"] == "updated" for result in results), "results": results}
+
+
+@router.post("/assign:bulk", response_model=BulkResult, response_model_exclude_none=True)
+async def assign_intakes_bulk(payload: BulkAssign, db: AsyncSession = Depends(get_async_db)):
+    """Assign many intakes to one staff member in a single transaction"""
+    results = await async_intake_service.assign_intakes(db, payload.ids, payload.user)
+    return {"updated": sum(result["outcome"] == "updated" for result in results), "results": results}
+
+
+@router.get("", response_model=IntakePage)
+async def list_intakes(
     status: str = Query(None, description="Filter by status"),
     assigned_to: str = Query(None, description="Filter by assigned user"),
-    db: Session = Depends(get_db)
+    limit: int = Query(intake_service.DEFAULT_PAGE_SIZE, ge=1, le=intake_service.MAX_PAGE_SIZE, description="Page size"),
+    cursor: str = Query(None, description="next_cursor from the previous page"),
+    severity: str = Query(None, description="Only intakes with an interaction of this severity"),
+    drug: str = Query(None, description="Only intakes with an interaction involving this drug"),
+    include_archived: bool = Query(False, description="Also list intakes moved to the archive"),
+    if_none_match: str = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    params = (status, assigned_to, limit, cursor, severity, drug, include_archived)
+    version = await async_intake_service.get_data_version(db)
+    etag = response_cache.make_etag("intakes", version, params)
+    if response_cache.etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    body = response_cache.list_responses.get((params, version))
+    if body is None:
+        try:
+            items, next_cursor = await async_intake_service.list_intakes(
+                db, status=status, assigned_to=assigned_to, limit=limit, cursor=cursor,
+                severity=severity, drug=drug, include_archived=include_archived,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Encoding a full page is CPU work; keep it off the event loop
+        body = await async_intake_service.off_loop(serialization.encode_intake_page, items, next_cursor)
+        response_cache.list_responses.put((params, version), body)
+    response = Response(content=body, media_type="application/json")
+    set_validators(response, etag)
+    return response
+
+
+# Declared before the /{intake_id} routes so "search" and "stats" are never parsed as ids
+@router.get("/search", response_model=IntakeSearchPage)
+async def search_intakes(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find in names, medications and notes"),
+    status: str = Query(None, description="Only intakes with this status"),
+    limit: int = Query(intake_service.DEFAULT_PAGE_SIZE, ge=1, le=intake_service.MAX_PAGE_SIZE, description="Page size"),
+    cursor: str = Query(None, description="next_cursor from the previous page"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    intakes = intake_service.list_intakes(db, status=status, assigned_to=assigned_to)
-    return intakes
+    """
+    Intakes containing every word of q (as a word prefix), best match first
+
+    Each hit carries a snippet of the best-matching field with the matched
+    words wrapped in <mark></mark>.
+    """
+    try:
+        items, next_cursor = await async_intake_service.search_intakes(
+            db, q, status=status, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/stats/summary")
+async def get_statistics(response: Response, if_none_match: str = Header(None), db: AsyncSession = Depends(get_async_db)):
+    # The per-day window moves at midnight even when nothing is written
+    version = await async_intake_service.get_data_version(db)
+    etag = response_cache.make_etag("stats", version, datetime.now(timezone.utc).date().isoformat())
+    if response_cache.etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    set_validators(response, etag)
+    return await async_intake_service.get_statistics(db)
+
+
+@router.get("/stats/screening")
+async def get_screening_queue_statistics(db: AsyncSession = Depends(get_async_db)):
+    """Screening mode and background screening jobs queued, running and failed"""
+    return await async_intake_service.get_screening_queue_statistics(db)
+
+
+@router.get("/stats/cache")
+async def get_cache_statistics():
+    """Hit/miss/eviction counters for the screening caches and the list response cache"""
+    return {
+        **drug_interaction_service.screening_cache_stats(),
+        response_cache.list_responses.name: response_cache.list_responses.stats(),
+    }
+
+
+@router.get("/stats/admission")
+async def get_admission_statistics():
+    """Requests in flight, queued, admitted and shed per route class"""
+    return admission.controller.statistics()
+
+
+@router.get("/events")
+async def stream_events(last_event_id: str = Header(None)):
+    """
+    Server-sent events for every committed intake change
+
+    Each event's data is JSON with a type (created, created_bulk, status_changed,
+    status_changed_bulk, assigned, assigned_bulk, dispensed, updated, screened,
+    screened_bulk, screening_failed, archived), the changed intake's list card
+    where there is one, and the statistics counter deltas applied.
+    Reconnecting clients send Last-Event-ID and are sent what they missed.
+    """
+    return StreamingResponse(
+        event_bus.sse_stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/check-interactions:batch")
+async def check_interactions_batch(payload: BatchInteractionCheck, db: AsyncSession = Depends(get_async_db)):
+    return await async_intake_service.check_interactions_batch(
+        db,
+        status=payload.status,
+        ids=payload.ids,
+        created_after=payload.created_after,
+        chunk_size=payload.chunk_size,
+    )
 
 
 @router.get("/{intake_id}", response_model=IntakeOut)
-def get_intake(intake_id: int, db: Session = Depends(get_db)):
-    intake = intake_service.get_intake_by_id(db, intake_id)
+async def get_intake(
+    intake_id: int, response: Response, if_none_match: str = Header(None), db: AsyncSession = Depends(get_async_db)
+):
+    intake = await async_intake_service.get_intake_by_id(db, intake_id)
     if not intake:
         raise HTTPException(status_code=404, detail="Intake not found")
+    # Every write sets updated_at, and archiving keeps it but sets archived_at,
+    # so together they identify the representation
+    etag = response_cache.make_etag("intake", intake.id, intake.updated_at, getattr(intake, "archived_at", None))
+    if response_cache.etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    set_validators(response, etag)
     return intake
 
 
 @router.post("/{intake_id}/status", response_model=IntakeOut)
-def change_status(intake_id: int, payload: StatusUpdate, db: Session = Depends(get_db)):
+async def change_status(intake_id: int, payload: StatusUpdate, db: AsyncSession = Depends(get_async_db)):
     try:
-        intake = intake_service.update_status(db, intake_id, payload.status)
+        intake = await async_intake_service.update_status(db, intake_id, payload.status)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -50,45 +245,52 @@ def change_status(intake_id: int, payload: StatusUpdate, db: Session = Depends(g
 
 
 @router.post("/{intake_id}/assign", response_model=IntakeOut)
-def assign_intake(intake_id: int, payload: AssignUser, db: Session = Depends(get_db)):
-    intake = intake_service.assign_intake(db, intake_id, payload.user)
+async def assign_intake(intake_id: int, payload: AssignUser, db: AsyncSession = Depends(get_async_db)):
+    intake = await async_intake_service.assign_intake(db, intake_id, payload.user)
     if not intake:
         raise HTTPException(status_code=404, detail="Intake not found")
     return intake
 
 
 @router.post("/{intake_id}/counseling", response_model=IntakeOut)
-def update_counseling_points(intake_id: int, payload: CounselingPointsUpdate, db: Session = Depends(get_db)):
-    intake = intake_service.update_counseling_points(db, intake_id, payload.counseling_points)
+async def update_counseling_points(intake_id: int, payload: CounselingPointsUpdate, db: AsyncSession = Depends(get_async_db)):
+    intake = await async_intake_service.update_counseling_points(db, intake_id, payload.counseling_points)
     if not intake:
         raise HTTPException(status_code=404, detail="Intake not found")
     return intake
 
 
 @router.post("/{intake_id}/pharmacist-notes", response_model=IntakeOut)
-def update_pharmacist_notes(intake_id: int, payload: PharmacistNotesUpdate, db: Session = Depends(get_db)):
-    intake = intake_service.update_pharmacist_notes(db, intake_id, payload.pharmacist_notes)
+async def update_pharmacist_notes(intake_id: int, payload: PharmacistNotesUpdate, db: AsyncSession = Depends(get_async_db)):
+    intake = await async_intake_service.update_pharmacist_notes(db, intake_id, payload.pharmacist_notes)
     if not intake:
         raise HTTPException(status_code=404, detail="Intake not found")
     return intake
 
 
 @router.post("/{intake_id}/dispense", response_model=IntakeOut)
-def dispense_medication(intake_id: int, payload: DispenseUpdate, db: Session = Depends(get_db)):
-    intake = intake_service.dispense_medication(db, intake_id, payload.dispensed)
+async def dispense_medication(intake_id: int, payload: DispenseUpdate, db: AsyncSession = Depends(get_async_db)):
+    intake = await async_intake_service.dispense_medication(db, intake_id, payload.dispensed)
     if not intake:
         raise HTTPException(status_code=404, detail="Intake not found")
     return intake
 
 
-@router.get("/{intake_id}/check-interactions")
-def check_interactions(intake_id: int, db: Session = Depends(get_db)):
-    result = intake_service.check_interactions_for_intake(db, intake_id)
+@router.get("/{intake_id}/screening")
+async def get_screening_status(intake_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Background screening progress: screening_status is pending until the worker
+    has written interactions and counseling points, or failed once it gave up
+    """
+    result = await async_intake_service.get_screening_status(db, intake_id)
     if not result:
         raise HTTPException(status_code=404, detail="Intake not found")
     return result
 
 
-@router.get("/stats/summary")
-def get_statistics(db: Session = Depends(get_db)):
-    return intake_service.get_statistics(db)
\ No newline at end of file
+@router.get("/{intake_id}/check-interactions")
+async def check_interactions(intake_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await async_intake_service.check_interactions_for_intake(db, intake_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Intake not found")
+    return result
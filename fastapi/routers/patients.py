@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas.patient import PatientOut, RecallPage
+from services import async_intake_service, patient_service
+from database import get_async_db
+
+router = APIRouter(prefix="/patients", tags=["patients"])
+
+
+@router.get("", response_model=RecallPage)
+async def patients_on_drug(
+    drug: str = Query(..., min_length=1, description="Drug name, e.g. of a recalled product"),
+    state: str = Query(None, description="Only profile entries in this state (reported, pending or dispensed)"),
+    limit: int = Query(patient_service.RECALL_PAGE_SIZE, ge=1, le=patient_service.MAX_RECALL_PAGE_SIZE, description="Page size"),
+    cursor: str = Query(None, description="next_cursor from the previous page"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Patients with drug on their medication profile, with the intakes that put it there"""
+    try:
+        items, next_cursor = await async_intake_service.patients_on_drug(
+            db, drug, state=state, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/{patient_id}", response_model=PatientOut)
+async def get_patient(patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    patient = await async_intake_service.get_patient(db, patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return patient
@@ -1,18 +1,33 @@
-from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, computed_field
+from typing import Optional, List
+from datetime import date, datetime
+import json
 
 class IntakeCreate(BaseModel):
     patient_name: str
+    patient_id: Optional[int] = None  # Link to a known patient; otherwise matched on name and date of birth
+    patient_date_of_birth: Optional[date] = None
     patient_age: Optional[int] = None
     patient_allergies: Optional[str] = None
     medications: str
     current_medications: Optional[str] = None
     notes: Optional[str] = None
 
+class InteractionOut(BaseModel):
+    drug1: str
+    drug2: str
+    severity: str
+    description: Optional[str] = None
+    source_intake_id: Optional[int] = None  # Set when the other drug comes from another intake of the patient
+
+    class Config:
+        from_attributes = True
+
 class IntakeOut(BaseModel):
     id: int
     patient_name: str
+    patient_id: Optional[int] = None
+    patient_date_of_birth: Optional[date] = None
     patient_age: Optional[int] = None
     patient_allergies: Optional[str] = None
     medications: str
@@ -20,7 +35,40 @@ class IntakeOut(BaseModel):
     notes: Optional[str] = None
     counseling_points: Optional[str] = None
     pharmacist_notes: Optional[str] = None
-    drug_interactions: Optional[str] = None
+    drug_interactions: Optional[str] = None  # JSON string, kept for existing clients
+    screening_status: str = "screened"  # "screened", "pending" (queued for background screening) or "failed"
+    status: str
+    assigned_to: Optional[str] = None
+    dispensed: Optional[str] = None
+    dispensed_at: Optional[datetime] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    archived_at: Optional[datetime] = None  # Set once moved to the archive, after which the intake is read-only
+
+    @computed_field
+    @property
+    def interactions(self) -> List[InteractionOut]:
+        """drug_interactions decoded, so clients need not parse it themselves"""
+        if not self.drug_interactions:
+            return []
+        try:
+            return [InteractionOut(**i) for i in json.loads(self.drug_interactions)]
+        except (ValueError, TypeError):
+            return []
+
+    class Config:
+        from_attributes = True
+
+class IntakeSummary(BaseModel):
+    """Lightweight projection used by the queue list cards"""
+    id: int
+    patient_name: str
+    patient_age: Optional[int] = None
+    patient_allergies: Optional[str] = None
+    medications: str
+    current_medications: Optional[str] = None
+    interaction_severity: Optional[str] = None  # Highest severity found, if any
+    screening_status: str = "screened"  # "pending" until background screening fills in interactions
     status: str
     assigned_to: Optional[str] = None
     dispensed: Optional[str] = None
@@ -31,6 +79,18 @@ class IntakeOut(BaseModel):
     class Config:
         from_attributes = True
 
+class IntakePage(BaseModel):
+    items: List[IntakeSummary]
+    next_cursor: Optional[str] = None  # Opaque; pass back as ?cursor= for the next page
+
+class IntakeSearchHit(IntakeSummary):
+    rank: Optional[float] = None  # bm25 score, lower is a better match
+    snippet: Optional[str] = None  # Best-matching fragment, matched terms wrapped in <mark></mark>
+
+class IntakeSearchPage(BaseModel):
+    items: List[IntakeSearchHit]
+    next_cursor: Optional[str] = None
+
 class CounselingPointsUpdate(BaseModel):
     counseling_points: str
 
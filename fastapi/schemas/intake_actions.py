@@ -1,7 +1,35 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from datetime import datetime
 
 class StatusUpdate(BaseModel):
     status: str
 
 class AssignUser(BaseModel):
-    user: str
\ No newline at end of file
+    user: str
+
+class BatchInteractionCheck(BaseModel):
+    """Which intakes to re-screen; filters are combined, an empty body re-screens everything"""
+    status: Optional[str] = None
+    ids: Optional[List[int]] = None
+    created_after: Optional[datetime] = None
+    chunk_size: int = Field(500, ge=1, le=5000)
+
+class BulkStatusUpdate(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=1000)
+    status: str
+
+class BulkAssign(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=1000)
+    user: str
+
+class BulkOutcome(BaseModel):
+    id: int
+    outcome: str  # "updated", "invalid_transition" or "not_found"
+    status: Optional[str] = None  # The new status, or the current one when the transition is invalid
+    assigned_to: Optional[str] = None
+    detail: Optional[str] = None
+
+class BulkResult(BaseModel):
+    updated: int
+    results: List[BulkOutcome]
@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+from typing import Optional, List
+from datetime import date, datetime
+
+class ProfileMedication(BaseModel):
+    drug: str
+    state: str  # "reported", "pending" or "dispensed"
+    intake_id: int
+    retired: bool = False  # No longer screened against: the intake was archived or completed undispensed
+
+class PatientOut(BaseModel):
+    id: int
+    name: str
+    date_of_birth: Optional[date] = None
+    allergies: Optional[str] = None
+    medications: List[ProfileMedication]  # The medication profile, retired entries included
+    intake_ids: List[int]  # Newest first
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+class RecallSource(BaseModel):
+    intake_id: int
+    state: str
+
+class RecallPatient(BaseModel):
+    id: int
+    name: str
+    allergies: Optional[str] = None
+    intakes: List[RecallSource]  # Intakes that put the drug on the profile
+
+class RecallPage(BaseModel):
+    items: List[RecallPatient]
+    next_cursor: Optional[str] = None
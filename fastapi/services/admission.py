@@ -0,0 +1,282 @@
+"""
+Admission Control
+Per-route-class concurrency limits with bounded, priority-ordered wait queues
+
+Requests are sorted into classes by method and path before routing:
+
+  critical   writes to intakes (create, status, assign, dispense, notes, the bulk status/assign calls)
+  read       single intakes, search, patients
+  bulk       NDJSON imports and batch re-screening
+  dashboard  list pages and the statistics the dashboard refreshes
+
+Each class may have ADMISSION_LIMITS requests in flight, and all of them
+together ADMISSION_MAX_CONCURRENCY. Keeping the class limits of the others
+below the total reserves headroom for critical writes. A request that finds no
+room waits in its class queue, and a freed slot goes to the waiting class with
+the highest priority (the order above). When the queue is full
+(ADMISSION_QUEUE_SIZES) or the wait exceeds ADMISSION_MAX_WAIT_MS, the request
+is shed with 503 and Retry-After, so the dashboard's reads fail fast instead of
+making every request slower. The health check, metrics, the event stream and
+the frontend's static files are never limited.
+
+Limits apply per process; with several uvicorn workers each has its own.
+Off unless ADMISSION_CONTROL is set.
+"""
+from collections import deque
+from typing import Deque, Dict, Optional
+import asyncio
+import json
+import os
+import time
+
+from services import metrics
+
+# 1 turns admission control on
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "0").lower() in ("1", "true", "yes")
+# Requests in flight across all classes; about what the database connection pool can serve at once
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+# Requests in flight per class
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "critical=16,read=8,bulk=2,dashboard=4")
+# Requests waiting per class beyond which new ones are shed at once
+ADMISSION_QUEUE_SIZES = os.getenv("ADMISSION_QUEUE_SIZES", "critical=200,read=50,bulk=4,dashboard=20")
+# Longest wait for a slot per class before the request is shed
+ADMISSION_MAX_WAIT_MS = os.getenv("ADMISSION_MAX_WAIT_MS", "critical=5000,read=2000,bulk=1000,dashboard=500")
+# Retry-After sent with shed responses
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+# Highest priority first
+ROUTE_CLASSES = ("critical", "read", "bulk", "dashboard")
+SHED_REASONS = ("queue_full", "timeout")
+
+# Never limited: probes, monitoring and the long-lived event stream
+EXEMPT_PATHS = frozenset({"/health", "/metrics", "/intakes/events", "/intakes/stats/admission"})
+BULK_PATHS = frozenset({"/intakes:bulk", "/intakes/check-interactions:batch"})
+API_PREFIXES = ("/intakes", "/patients")
+
+QUEUE_WAIT = metrics.Histogram(
+    "admission_queue_wait_seconds", "Time requests waited for a slot before being admitted",
+    ("route_class",), metrics.LATENCY_BUCKETS,
+)
+
+
+def parse_class_settings(text: str, name: str) -> Dict[str, float]:
+    """Per-class values from a spec like "critical=16,read=8"; every class must be given"""
+    settings = {}
+    for part in text.split(","):
+        route_class, _, value = part.partition("=")
+        route_class = route_class.strip()
+        if route_class not in ROUTE_CLASSES:
+            raise ValueError(f"{name}: unknown route class '{route_class}', choose from {', '.join(ROUTE_CLASSES)}")
+        try:
+            settings[route_class] = float(value)
+        except ValueError as e:
+            raise ValueError(f"{name}: invalid value for {route_class}: '{value}'") from e
+    missing = [route_class for route_class in ROUTE_CLASSES if route_class not in settings]
+    if missing:
+        raise ValueError(f"{name}: no value for {', '.join(missing)}")
+    return settings
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Route class of a request, or None if it is not limited"""
+    if path in EXEMPT_PATHS or not path.startswith(API_PREFIXES):
+        return None
+    if method in ("GET", "HEAD"):
+        if path == "/intakes" or path.startswith("/intakes/stats/"):
+            return "dashboard"
+        return "read"
+    if method == "OPTIONS":
+        return None
+    if path in BULK_PATHS:
+        return "bulk"
+    return "critical"
+
+
+class RouteClass:
+    __slots__ = ("name", "limit", "queue_size", "max_wait", "in_flight", "waiting", "admitted", "shed")
+
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed = dict.fromkeys(SHED_REASONS, 0)
+
+
+class AdmissionController:
+    """
+    Slots and wait queues for every route class
+
+    Only ever used from the event loop, so no locking is needed.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        limits: str = ADMISSION_LIMITS,
+        queue_sizes: str = ADMISSION_QUEUE_SIZES,
+        max_wait_ms: str = ADMISSION_MAX_WAIT_MS,
+    ):
+        limits = parse_class_settings(limits, "ADMISSION_LIMITS")
+        queue_sizes = parse_class_settings(queue_sizes, "ADMISSION_QUEUE_SIZES")
+        max_wait_ms = parse_class_settings(max_wait_ms, "ADMISSION_MAX_WAIT_MS")
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.classes = {
+            name: RouteClass(name, int(limits[name]), int(queue_sizes[name]), max_wait_ms[name] / 1000)
+            for name in ROUTE_CLASSES
+        }
+
+    def _has_room(self, route_class: RouteClass) -> bool:
+        return route_class.in_flight < route_class.limit and self.in_flight < self.max_concurrency
+
+    def _admit(self, route_class: RouteClass):
+        route_class.in_flight += 1
+        route_class.admitted += 1
+        self.in_flight += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiting requests, highest priority class first"""
+        for route_class in self.classes.values():
+            while route_class.waiting and self._has_room(route_class):
+                waiter = route_class.waiting.popleft()
+                if waiter.done():
+                    # Its request gave up
+                    continue
+                self._admit(route_class)
+                waiter.set_result(None)
+            if self.in_flight >= self.max_concurrency:
+                return
+
+    async def acquire(self, name: str) -> Optional[str]:
+        """Wait for a slot; returns None once admitted, or why the request is shed"""
+        route_class = self.classes[name]
+        # Queued requests of the class go first; other classes only wait when there is no room
+        if not route_class.waiting and self._has_room(route_class):
+            self._admit(route_class)
+            return None
+        if len(route_class.waiting) >= route_class.queue_size:
+            route_class.shed["queue_full"] += 1
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiting.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, route_class.max_wait)
+        except asyncio.TimeoutError:
+            # The slot may have been granted just as the wait ran out
+            if not waiter.done() or waiter.cancelled():
+                self._forget(route_class, waiter)
+                route_class.shed["timeout"] += 1
+                return "timeout"
+        except BaseException:
+            # The client went away while waiting
+            if waiter.done() and not waiter.cancelled():
+                self.release(name)
+            else:
+                self._forget(route_class, waiter)
+            raise
+        QUEUE_WAIT.observe(time.perf_counter() - start, name)
+        return None
+
+    def _forget(self, route_class: RouteClass, waiter: asyncio.Future):
+        try:
+            route_class.waiting.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, name: str):
+        self.classes[name].in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def statistics(self) -> dict:
+        return {
+            "enabled": ADMISSION_CONTROL,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "classes": {
+                name: {
+                    "limit": route_class.limit,
+                    "in_flight": route_class.in_flight,
+                    "queued": len(route_class.waiting),
+                    "queue_size": route_class.queue_size,
+                    "max_wait_ms": round(route_class.max_wait * 1000),
+                    "admitted": route_class.admitted,
+                    "shed": dict(route_class.shed),
+                }
+                for name, route_class in self.classes.items()
+            },
+        }
+
+    def render(self) -> str:
+        """Slots, queue depths and shed counts in the Prometheus text exposition format"""
+        lines = [
+            "# HELP admission_in_flight Requests being handled per route class",
+            "# TYPE admission_in_flight gauge",
+            *(f'admission_in_flight{{route_class="{name}"}} {c.in_flight}' for name, c in self.classes.items()),
+            "# HELP admission_queue_depth Requests waiting for a slot per route class",
+            "# TYPE admission_queue_depth gauge",
+            *(f'admission_queue_depth{{route_class="{name}"}} {len(c.waiting)}' for name, c in self.classes.items()),
+            "# HELP admission_admitted_total Requests admitted per route class",
+            "# TYPE admission_admitted_total counter",
+            *(f'admission_admitted_total{{route_class="{name}"}} {c.admitted}' for name, c in self.classes.items()),
+            "# HELP admission_shed_total Requests answered 503 per route class and reason",
+            "# TYPE admission_shed_total counter",
+            *(
+                f'admission_shed_total{{route_class="{name}",reason="{reason}"}} {count}'
+                for name, c in self.classes.items() for reason, count in c.shed.items()
+            ),
+            *QUEUE_WAIT.render(),
+        ]
+        return "\n".join(lines) + "\n"
+
+
+controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware that holds each limited request to a slot of its route class
+
+    The slot is held until the response body has been sent. Shed requests are
+    answered without reading their body.
+    """
+
+    def __init__(self, app, admission: AdmissionController = controller):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        reason = await self.admission.acquire(route_class)
+        if reason is not None:
+            await self._shed(send, route_class, reason)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release(route_class)
+
+    async def _shed(self, send, route_class: str, reason: str):
+        body = json.dumps({
+            "detail": "Server is busy, retry later",
+            "route_class": route_class,
+            "reason": reason,
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(ADMISSION_RETRY_AFTER_SECONDS).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
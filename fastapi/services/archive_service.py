@@ -0,0 +1,183 @@
+"""
+Archive Service
+Moves finished intakes out of the hot intakes table into intakes_archive
+
+Intakes in a terminal status (one ALLOWED_TRANSITIONS lets nothing follow)
+that have not changed for ARCHIVE_AFTER_DAYS are moved in batches of
+ARCHIVE_BATCH_SIZE, one transaction each, keeping their ids. The archive
+stores notes, counseling points, pharmacist notes and interactions compressed
+(see database.CompressedText), so the open queue stays small while the
+history stays readable: GET /intakes/{id} reads through to the archive and
+GET /intakes?include_archived=true merges it into the list.
+
+Archived intakes are read-only and leave the search index; their interaction
+rows and patient profile entries stay, retired so they no longer count when
+screening the patient's new intakes, and so do the statistics counters.
+Archiving runs from `python manage.py archive-intakes` (e.g. nightly from
+cron) or, with ARCHIVE_WINDOW set, from a task in the API process that only
+works inside that daily UTC window.
+"""
+from datetime import datetime, time as day_time, timedelta, timezone
+from typing import Callable, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from database import Intake, IntakeArchive, SessionLocal
+from services import intake_service, patient_service, response_cache, screening_queue, stats_service
+from services.event_bus import bus
+
+logger = logging.getLogger(__name__)
+
+# Terminal intakes unchanged for this long are archived
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+# Intakes moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# Pause between batches, leaving the write lock to live traffic
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv("ARCHIVE_BATCH_PAUSE_SECONDS", "0.1"))
+# Daily UTC window, e.g. "02:00-05:00", in which the API process archives; empty leaves it to cron
+ARCHIVE_WINDOW = os.getenv("ARCHIVE_WINDOW", "")
+# How often the in-process archiver checks whether the window is open
+ARCHIVE_CHECK_SECONDS = float(os.getenv("ARCHIVE_CHECK_SECONDS", "300"))
+
+_ARCHIVED_COLUMNS = [column.name for column in IntakeArchive.__table__.columns if column.name != "archived_at"]
+
+
+def parse_window(window: str) -> Tuple[day_time, day_time]:
+    """Start and end of a daily window like "02:00-05:00"; it may wrap past midnight"""
+    try:
+        start, end = (day_time.fromisoformat(part.strip()) for part in window.split("-"))
+    except ValueError as e:
+        raise ValueError(f"Invalid archive window '{window}', expected HH:MM-HH:MM") from e
+    return start, end
+
+
+def in_window(window: Tuple[day_time, day_time], now: Optional[datetime] = None) -> bool:
+    start, end = window
+    moment = (now or datetime.now(timezone.utc)).time()
+    if start <= end:
+        return start <= moment < end
+    return moment >= start or moment < end
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Move up to batch_size terminal intakes last updated before cutoff; returns how many moved
+
+    The rows are taken with one DELETE ... RETURNING, so an edit racing the
+    move either lands before it, and is archived, or finds the intake gone.
+    Their screening jobs, failed ones included, are dropped before it, as
+    they still reference the intakes. The newest intake always stays.
+    """
+    eligible = and_(
+        Intake.status.in_(intake_service.TERMINAL_STATUSES),
+        Intake.updated_at < cutoff,
+        # SQLite numbers new rows after the highest id left in the table, so
+        # keeping the newest intake stops new intakes reusing archived ids
+        Intake.id < select(func.max(Intake.id)).scalar_subquery(),
+    )
+    candidates = list(db.scalars(select(Intake.id).where(eligible).order_by(Intake.id).limit(batch_size)))
+    if not candidates:
+        db.rollback()
+        return 0
+    screening_queue.discard(db, candidates)
+    moved = db.execute(
+        delete(Intake)
+        .where(Intake.id.in_(candidates), eligible)
+        .returning(*(getattr(Intake, name) for name in _ARCHIVED_COLUMNS))
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not moved:
+        db.rollback()
+        return 0
+    now = datetime.now(timezone.utc)
+    db.execute(insert(IntakeArchive), [{**row._asdict(), "archived_at": now} for row in moved])
+    ids = [row.id for row in moved]
+    patient_service.retire_intakes(db, ids)
+    # Lists change; the statistics still count archived intakes
+    stats_service.record_change(db)
+    db.commit()
+    response_cache.invalidate()
+    bus.publish({"type": "archived", "ids": ids, "counters": {}})
+    return len(ids)
+
+
+def archive_intakes(
+    db: Session,
+    older_than_days: float = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    max_batches: Optional[int] = None,
+    pause_seconds: float = ARCHIVE_BATCH_PAUSE_SECONDS,
+    keep_going: Callable[[], bool] = lambda: True,
+) -> int:
+    """
+    Archive eligible intakes batch by batch until none are left; returns how many moved
+
+    Stops early after max_batches, or once keep_going() is false.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(db, cutoff, batch_size)
+        archived += moved
+        batches += 1
+        if moved < batch_size or not keep_going():
+            break
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return archived
+
+
+class Archiver:
+    """Archives from the API process while ARCHIVE_WINDOW is open"""
+
+    def __init__(self, window: str = ARCHIVE_WINDOW, check_seconds: float = ARCHIVE_CHECK_SECONDS):
+        self.window = parse_window(window) if window else None
+        self.check_seconds = check_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.window is not None
+
+    def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _keep_going(self) -> bool:
+        return not self._stopping and in_window(self.window)
+
+    def _archive(self) -> int:
+        with SessionLocal() as db:
+            return archive_intakes(db, keep_going=self._keep_going)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if in_window(self.window):
+                try:
+                    archived = await loop.run_in_executor(None, self._archive)
+                    if archived:
+                        logger.info("Archived %d intakes", archived)
+                except Exception:
+                    logger.exception("Archiving failed")
+            await asyncio.sleep(self.check_seconds)
+
+
+archiver = Archiver()
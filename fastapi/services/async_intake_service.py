@@ -0,0 +1,145 @@
+"""
+Async Intake Service
+asyncio versions of intake_service for use with an AsyncSession
+
+Each function runs the corresponding intake_service function on the
+AsyncSession's connection through run_sync, so the business rules live in
+one place and database I/O is awaited instead of blocking a threadpool slot.
+
+run_sync executes on the event loop's thread, so anything CPU-heavy (screening
+new intakes, batch re-screens) is split: the reads and writes go through
+run_sync and the screening in between runs in the default executor, keeping
+the loop free for the health check and the event stream.
+"""
+from datetime import datetime
+from functools import partial
+from typing import List, Optional, Tuple
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Intake
+from schemas.intake import IntakeCreate
+from services import intake_service, patient_service, search_service
+
+
+async def off_loop(func, *args, **kwargs):
+    """Run CPU-bound work in the default executor instead of on the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+async def create_intake(db: AsyncSession, data: IntakeCreate) -> Intake:
+    patient, queued = await db.run_sync(intake_service.prepare_intake, data)
+    screening = None if queued else await off_loop(intake_service.screen_intake, data, patient.profile)
+    return await db.run_sync(intake_service.persist_intake, data, patient, screening)
+
+
+async def create_intakes(db: AsyncSession, items: List[IntakeCreate], screenings: list) -> List[int]:
+    return await db.run_sync(intake_service.create_intakes, items, screenings)
+
+
+async def list_intakes(db: AsyncSession, **filters) -> Tuple[list, Optional[str]]:
+    return await db.run_sync(lambda session: intake_service.list_intakes(session, **filters))
+
+
+async def search_intakes(db: AsyncSession, query: str, **options) -> Tuple[list, Optional[str]]:
+    return await db.run_sync(lambda session: search_service.search_intakes(session, query, **options))
+
+
+async def get_intake_by_id(db: AsyncSession, intake_id: int) -> Optional[Intake]:
+    return await db.run_sync(intake_service.get_intake_by_id, intake_id)
+
+
+async def update_status(db: AsyncSession, intake_id: int, new_status: str) -> Optional[Intake]:
+    return await db.run_sync(intake_service.update_status, intake_id, new_status)
+
+
+async def assign_intake(db: AsyncSession, intake_id: int, user: str) -> Optional[Intake]:
+    return await db.run_sync(intake_service.assign_intake, intake_id, user)
+
+
+async def update_status_bulk(db: AsyncSession, intake_ids: List[int], new_status: str) -> List[dict]:
+    return await db.run_sync(intake_service.update_status_bulk, intake_ids, new_status)
+
+
+async def assign_intakes(db: AsyncSession, intake_ids: List[int], user: str) -> List[dict]:
+    return await db.run_sync(intake_service.assign_intakes, intake_ids, user)
+
+
+async def update_counseling_points(db: AsyncSession, intake_id: int, counseling_points: str) -> Optional[Intake]:
+    return await db.run_sync(intake_service.update_counseling_points, intake_id, counseling_points)
+
+
+async def update_pharmacist_notes(db: AsyncSession, intake_id: int, pharmacist_notes: str) -> Optional[Intake]:
+    return await db.run_sync(intake_service.update_pharmacist_notes, intake_id, pharmacist_notes)
+
+
+async def dispense_medication(db: AsyncSession, intake_id: int, dispensed: str) -> Optional[Intake]:
+    return await db.run_sync(intake_service.dispense_medication, intake_id, dispensed)
+
+
+async def check_interactions_for_intake(db: AsyncSession, intake_id: int) -> Optional[dict]:
+    inputs = await db.run_sync(intake_service.read_screening_inputs, intake_id)
+    if inputs is None:
+        return None
+    interactions, counseling_points = await off_loop(intake_service.rescreen, *inputs, intake_id)
+    return await db.run_sync(intake_service.write_rescreen, intake_id, interactions, counseling_points)
+
+
+async def check_interactions_batch(
+    db: AsyncSession,
+    status: Optional[str] = None,
+    ids: Optional[List[int]] = None,
+    created_after: Optional[datetime] = None,
+    chunk_size: int = 500,
+) -> dict:
+    result = {"scanned": 0, "updated": 0, "severity_changed": []}
+    last_id = 0
+    while True:
+        rows, profiles = await db.run_sync(
+            intake_service.read_batch_chunk, status, ids, created_after, last_id, chunk_size
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        changes = await off_loop(intake_service.rescreen_chunk, rows, profiles)
+        await db.run_sync(intake_service.write_batch_chunk, rows, changes)
+        intake_service.add_batch_chunk(result, rows, changes)
+    return result
+
+
+async def get_statistics(db: AsyncSession) -> dict:
+    return await db.run_sync(intake_service.get_statistics)
+
+
+async def get_data_version(db: AsyncSession) -> int:
+    return await db.run_sync(intake_service.get_data_version)
+
+
+async def get_patient(db: AsyncSession, patient_id: int) -> Optional[dict]:
+    return await db.run_sync(patient_service.get_patient, patient_id)
+
+
+async def patients_on_drug(db: AsyncSession, drug: str, **options) -> Tuple[list, Optional[str]]:
+    return await db.run_sync(lambda session: patient_service.patients_on_drug(session, drug, **options))
+
+
+async def claim_screening_jobs(db: AsyncSession, limit: int) -> Tuple[list, list]:
+    return await db.run_sync(intake_service.claim_screening_jobs, limit)
+
+
+async def save_screenings(db: AsyncSession, jobs: list, screenings: list) -> int:
+    return await db.run_sync(intake_service.save_screenings, jobs, screenings)
+
+
+async def release_screening_jobs(db: AsyncSession, jobs: list, error: str) -> List[int]:
+    return await db.run_sync(intake_service.release_screening_jobs, jobs, error)
+
+
+async def get_screening_status(db: AsyncSession, intake_id: int) -> Optional[dict]:
+    return await db.run_sync(intake_service.get_screening_status, intake_id)
+
+
+async def get_screening_queue_statistics(db: AsyncSession) -> dict:
+    return await db.run_sync(intake_service.get_screening_queue_statistics)
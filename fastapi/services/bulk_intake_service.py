@@ -0,0 +1,196 @@
+"""
+Bulk Intake Service
+Streams NDJSON intake feeds into the database chunk by chunk
+
+Lines are parsed as they arrive, valid intakes are screened across a process
+pool and inserted BULK_CHUNK_SIZE at a time, and a result line is produced for
+every input line. At most one chunk is held in memory, so memory use does not
+grow with the size of the upload.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+from pydantic import ValidationError
+
+from database import AsyncSessionLocal
+from schemas.intake import IntakeCreate
+from services import async_intake_service
+from services.drug_interaction_service import screen_intakes
+
+logger = logging.getLogger(__name__)
+
+# Intakes screened and inserted per transaction
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+# Screening processes; 0 screens in a thread of this process instead
+BULK_SCREENING_WORKERS = int(os.getenv("BULK_SCREENING_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Longer lines are rejected without being buffered
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(1024 * 1024)))
+
+_pool_state = {"pool": None}
+_pool_lock = threading.Lock()
+
+
+def get_screening_pool() -> Optional[ProcessPoolExecutor]:
+    """The shared screening pool, started on first use (None when BULK_SCREENING_WORKERS is 0)"""
+    if BULK_SCREENING_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool_state["pool"] is None:
+            # spawn rather than fork: the server process has threads and open connections
+            _pool_state["pool"] = ProcessPoolExecutor(
+                max_workers=BULK_SCREENING_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool_state["pool"]
+
+
+def shutdown_screening_pool():
+    """Stop the worker processes (called on application shutdown)"""
+    with _pool_lock:
+        pool, _pool_state["pool"] = _pool_state["pool"], None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = BULK_MAX_LINE_BYTES):
+    """
+    Yield (line_number, line) for each newline-terminated line of a byte stream
+
+    Only the current partial line is buffered. A line longer than max_line_bytes
+    is yielded as a LineTooLong instance and the rest of it is skipped.
+    """
+    buffer = bytearray()
+    line_number = 0
+    skipping = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            piece = chunk[start:] if end < 0 else chunk[start:end]
+            if not skipping:
+                buffer += piece
+                if len(buffer) > max_line_bytes:
+                    skipping = True
+                    buffer.clear()
+            if end < 0:
+                break
+            line_number += 1
+            if skipping:
+                yield line_number, LineTooLong(f"Line exceeds {max_line_bytes} bytes")
+            else:
+                yield line_number, bytes(buffer)
+            buffer.clear()
+            skipping = False
+            start = end + 1
+    if buffer or skipping:
+        line_number += 1
+        yield line_number, LineTooLong(f"Line exceeds {max_line_bytes} bytes") if skipping else bytes(buffer)
+
+
+def _result(line_number: int, **fields) -> bytes:
+    return json.dumps({"line": line_number, **fields}).encode("utf-8") + b"\n"
+
+
+async def screen_medication_lists(medication_lists: List[Tuple[str, Optional[str]]]) -> List[Tuple[List[dict], str]]:
+    """
+    screen_intakes over (medications, current_medications) pairs, split evenly across the pool's workers
+
+    If a worker process dies the pool is replaced before BrokenProcessPool is
+    re-raised, so the next call starts from a healthy pool.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_screening_pool()
+    if pool is None:
+        return await loop.run_in_executor(None, screen_intakes, medication_lists)
+    size = -(-len(medication_lists) // BULK_SCREENING_WORKERS)
+    try:
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(pool, screen_intakes, medication_lists[i:i + size])
+            for i in range(0, len(medication_lists), size)
+        ))
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    return [screening for part in parts for screening in part]
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    with _pool_lock:
+        if _pool_state["pool"] is pool:
+            _pool_state["pool"] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _screen(items: List[IntakeCreate]) -> List[Tuple[List[dict], str]]:
+    """Screen a chunk of intakes"""
+    return await screen_medication_lists([(item.medications, item.current_medications) for item in items])
+
+
+# Per-line error for intakes that could not be stored; the cause is logged, not returned
+INSERT_ERROR = "Error creating intake"
+
+
+async def _insert_chunk(db, pending: List[Tuple[int, IntakeCreate]]) -> AsyncIterator[bytes]:
+    """
+    Screen and insert a chunk in one transaction, yielding a result per line
+
+    If the chunk fails as a whole it is retried one intake at a time, so a single
+    bad row costs only its own line.
+    """
+    items = [item for _, item in pending]
+    try:
+        screenings = await _screen(items)
+        ids = await async_intake_service.create_intakes(db, items, screenings)
+    except Exception:
+        logger.exception("Bulk chunk of %d intakes failed", len(items))
+        await db.rollback()
+        if len(pending) == 1:
+            yield _result(pending[0][0], error=INSERT_ERROR)
+            return
+        for single in pending:
+            async for result in _insert_chunk(db, [single]):
+                yield result
+        return
+    for (line_number, _), intake_id in zip(pending, ids):
+        yield _result(line_number, id=intake_id)
+
+
+async def ingest_ndjson(chunks: AsyncIterator[bytes], chunk_size: int = BULK_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Create intakes from an NDJSON byte stream, yielding one NDJSON result per input line
+
+    Results are {"line": n, "id": id} or {"line": n, "error": ...}. Invalid lines
+    are reported as soon as they are read and valid ones once their chunk is
+    committed, so results are not necessarily in line order. Blank lines are skipped.
+    """
+    pending: List[Tuple[int, IntakeCreate]] = []
+    async with AsyncSessionLocal() as db:
+        async for line_number, line in iter_lines(chunks):
+            if isinstance(line, LineTooLong):
+                yield _result(line_number, error=str(line))
+                continue
+            if not line.strip():
+                continue
+            try:
+                pending.append((line_number, IntakeCreate.model_validate_json(line)))
+            except ValidationError as e:
+                yield _result(line_number, error=e.errors(include_url=False, include_context=False, include_input=False))
+                continue
+            if len(pending) >= chunk_size:
+                async for result in _insert_chunk(db, pending):
+                    yield result
+                pending = []
+        if pending:
+            async for result in _insert_chunk(db, pending):
+                yield result
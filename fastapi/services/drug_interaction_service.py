@@ -2,8 +2,24 @@
 Drug Interaction Checking Service
 Provides basic drug interaction checking functionality
 """
-from typing import List, Dict
-import re
+from typing import Iterable, List, Dict, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from services.medication_parser import MedicationMatcher, MedicationToken
+from services.screening_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Optional compiled knowledge base (see services/interaction_kb.py); the tables
+# below are used when it is not configured or cannot be opened
+INTERACTION_KB_PATH = os.getenv("INTERACTION_KB_PATH")
+# Seconds between checks for a replaced knowledge base file
+INTERACTION_KB_RELOAD_INTERVAL = float(os.getenv("INTERACTION_KB_RELOAD_INTERVAL", "5"))
+# Entries kept per screening cache (0 disables caching)
+SCREENING_CACHE_SIZE = int(os.getenv("SCREENING_CACHE_SIZE", "1024"))
 
 # Common drug interaction database (simplified for demo)
 # In production, this would connect to a comprehensive drug database API
@@ -45,113 +61,354 @@ DRUG_CATEGORIES = {
 }
 
 
+# Severity ranks, most severe first
+SEVERITIES = ("Major", "Moderate", "Minor")
+
+# Same-category pairs that are an interaction in their own right
+CATEGORY_INTERACTIONS = {
+    "nsaids": "Moderate: Multiple NSAIDs may increase GI bleeding risk.",
+}
+
+
 def normalize_drug_name(drug: str) -> str:
     """Normalize drug name for comparison"""
     return drug.lower().strip()
 
 
-def check_drug_interactions(new_medications: str, current_medications: str = None) -> List[Dict]:
+def parse_severity(description: str) -> str:
+    """Derive the severity label from a 'Severity: text' description"""
+    label = description.split(":", 1)[0].strip()
+    return label if label in SEVERITIES else "Moderate"
+
+
+class InteractionIndex:
     """
-    Check for drug interactions between new medications and current medications
-    
-    Returns list of interaction warnings
+    Immutable lookup structure compiled once from the interaction tables
+
+    Drug names are interned to small integer ids, each drug carries a bitset of
+    its categories, and every ordered pair with a known interaction maps to a
+    pre-parsed (severity, description) entry, so a pairwise check is a couple
+    of dict lookups with no string parsing.
+    """
+
+    def __init__(self, interactions: Dict[str, Dict[str, str]], categories: Dict[str, List[str]],
+                 category_interactions: Dict[str, str]):
+        self._ids: Dict[str, int] = {}
+        for drug, others in interactions.items():
+            self._intern(drug)
+            for other in others:
+                self._intern(other)
+
+        category_bits = {category: 1 << bit for bit, category in enumerate(categories)}
+        self._categories: Dict[int, int] = {}
+        for category, drugs in categories.items():
+            for drug in drugs:
+                drug_id = self._intern(drug)
+                self._categories[drug_id] = self._categories.get(drug_id, 0) | category_bits[category]
+
+        # Category rules as (bitmask, entry); a pair matches when both drugs share the bit
+        self._category_rules: Tuple[Tuple[int, Tuple[str, str]], ...] = tuple(
+            (category_bits[category], (parse_severity(description), description))
+            for category, description in category_interactions.items()
+            if category in category_bits
+        )
+
+        # Forward entries win over reverse ones, matching the original lookup order
+        self._pairs: Dict[Tuple[int, int], Tuple[str, str]] = {}
+        for drug, others in interactions.items():
+            for other, description in others.items():
+                self._pairs[(self._ids[drug], self._ids[other])] = (parse_severity(description), description)
+        for drug, others in interactions.items():
+            for other, description in others.items():
+                self._pairs.setdefault((self._ids[other], self._ids[drug]), (parse_severity(description), description))
+
+    def _intern(self, drug: str) -> int:
+        drug = normalize_drug_name(drug)
+        return self._ids.setdefault(drug, len(self._ids))
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def drug_names(self) -> Iterable[str]:
+        return iter(self._ids)
+
+    def drug_id(self, drug: str) -> Optional[int]:
+        """Interned id for a normalized drug name, or None if it is not in the tables"""
+        return self._ids.get(drug)
+
+    def lookup_ids(self, id1: int, id2: int) -> Optional[Tuple[str, str]]:
+        """(severity, description) for two interned drugs, or None"""
+        entry = self._pairs.get((id1, id2))
+        if entry is not None or id1 == id2:
+            return entry
+        shared = self._categories.get(id1, 0) & self._categories.get(id2, 0)
+        if shared:
+            for mask, rule in self._category_rules:
+                if shared & mask:
+                    return rule
+        return None
+
+    def lookup(self, drug1: str, drug2: str) -> Optional[Tuple[str, str]]:
+        """(severity, description) for two normalized drug names, or None"""
+        id1 = self._ids.get(drug1)
+        if id1 is None:
+            return None
+        id2 = self._ids.get(drug2)
+        if id2 is None:
+            return None
+        return self.lookup_ids(id1, id2)
+
+
+INTERACTION_INDEX = InteractionIndex(DRUG_INTERACTIONS, DRUG_CATEGORIES, CATEGORY_INTERACTIONS)
+
+_kb_lock = threading.Lock()
+_kb_state = {"index": None, "matcher": None, "checked_at": 0.0}
+
+
+def _open_knowledge_base(path: str):
+    from services.interaction_kb import MappedInteractionIndex
+    try:
+        return MappedInteractionIndex(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not open interaction knowledge base %s: %s", path, e)
+        return None
+
+
+def reload_interaction_index(force: bool = False):
     """
+    Re-open the knowledge base if its file has been replaced since it was mapped
+
+    Returns the index now in use. Lookups already running keep the old mapping
+    until they finish; it is unmapped once nothing references it.
+    """
+    if not INTERACTION_KB_PATH:
+        return INTERACTION_INDEX
+    from services.interaction_kb import file_signature
+    with _kb_lock:
+        current = _kb_state["index"]
+        _kb_state["checked_at"] = time.monotonic()
+        signature = file_signature(INTERACTION_KB_PATH)
+        if force or current is None or (signature is not None and signature != current.signature):
+            replacement = _open_knowledge_base(INTERACTION_KB_PATH)
+            if replacement is not None:
+                _kb_state["matcher"] = build_medication_matcher(replacement)
+                _kb_state["index"] = current = replacement
+                invalidate_screening_caches()
+                logger.info("Loaded interaction knowledge base %s (%d pairs)", INTERACTION_KB_PATH, len(replacement))
+    return current or INTERACTION_INDEX
+
+
+def get_interaction_index():
+    """The active interaction index: the mapped knowledge base if configured, else the built-in tables"""
+    if not INTERACTION_KB_PATH:
+        return INTERACTION_INDEX
+    index = _kb_state["index"]
+    if index is None or time.monotonic() - _kb_state["checked_at"] >= INTERACTION_KB_RELOAD_INTERVAL:
+        index = reload_interaction_index()
+    return index
+
+
+INTERACTION_FIELDS = ("drug1", "drug2", "severity", "description")
+
+# Results are cached as tuples so callers can never mutate a shared entry
+_interaction_cache = LRUCache("drug_interactions", SCREENING_CACHE_SIZE)
+_counseling_cache = LRUCache("counseling_points", SCREENING_CACHE_SIZE)
+# Drug names per medication text: one intake's lists are read by screening,
+# counseling and the patient profile in turn
+_drug_cache = LRUCache("medication_drugs", SCREENING_CACHE_SIZE)
+
+
+def invalidate_screening_caches():
+    """Drop cached screening results; call whenever the interaction or counseling rules change"""
+    _interaction_cache.clear()
+    _counseling_cache.clear()
+    _drug_cache.clear()
+
+
+def screening_cache_stats() -> Dict[str, Dict]:
+    return {cache.name: cache.stats() for cache in (_interaction_cache, _counseling_cache, _drug_cache)}
+
+
+def get_medication_matcher() -> MedicationMatcher:
+    """The matcher over the active index's drug names, rebuilt whenever the knowledge base is reloaded"""
+    if not INTERACTION_KB_PATH:
+        return MEDICATION_MATCHER
+    get_interaction_index()
+    return _kb_state["matcher"] or MEDICATION_MATCHER
+
+
+def parse_medications(medications: Optional[str]) -> List[MedicationToken]:
+    """Structured (drug, dose, frequency) tokens for a free-text medication list"""
+    return get_medication_matcher().tokenize(medications)
+
+
+def _drugs(medications: str) -> Tuple[str, ...]:
+    return _drug_cache.get_or_compute(
+        medications, lambda: tuple(token.drug for token in parse_medications(medications))
+    )
+
+
+def medication_drugs(medications: Optional[str]) -> Tuple[str, ...]:
+    """Normalized drug names in a free-text medication list, in order of appearance"""
+    return _drugs(medications) if medications else ()
+
+
+def _screen_pairs(pairs) -> Tuple[Tuple[str, str, str, str], ...]:
+    """Look up each (drug1, drug2) pair and return (drug1, drug2, severity, description) hits"""
+    index = get_interaction_index()
+    ids = {}
+
+    def resolve(med):
+        if med not in ids:
+            ids[med] = index.drug_id(med)
+        return ids[med]
+
     interactions = []
-    
-    # Parse medications (split by comma, semicolon, or newline)
-    new_meds = [normalize_drug_name(m) for m in re.split(r'[,;\n]', new_medications) if m.strip()]
-    
-    if not current_medications:
+    for med1, med2 in pairs:
+        id1, id2 = resolve(med1), resolve(med2)
+        if id1 is None or id2 is None:
+            continue
+        entry = index.lookup_ids(id1, id2)
+        if entry:
+            interactions.append((med1, med2, entry[0], entry[1]))
+    return tuple(interactions)
+
+
+def _screen_medications(new_meds: Tuple[str, ...], current_meds: Optional[Tuple[str, ...]]):
+    if current_meds is None:
         # Check interactions within new medications themselves
-        for i, med1 in enumerate(new_meds):
-            for med2 in new_meds[i+1:]:
-                interaction = find_interaction(med1, med2)
-                if interaction:
-                    interactions.append({
-                        "drug1": med1,
-                        "drug2": med2,
-                        "severity": interaction["severity"],
-                        "description": interaction["description"]
-                    })
-        return interactions
-    
-    # Parse current medications
-    current_meds = [normalize_drug_name(m) for m in re.split(r'[,;\n]', current_medications) if m.strip()]
-    
+        return _screen_pairs(
+            (med1, med2) for i, med1 in enumerate(new_meds) for med2 in new_meds[i+1:]
+        )
     # Check interactions between new and current medications
-    for new_med in new_meds:
-        for current_med in current_meds:
-            interaction = find_interaction(new_med, current_med)
-            if interaction:
-                interactions.append({
-                    "drug1": new_med,
-                    "drug2": current_med,
-                    "severity": interaction["severity"],
-                    "description": interaction["description"]
-                })
+    return _screen_pairs(
+        (new_med, current_med) for new_med in new_meds for current_med in current_meds
+    )
+
+
+def check_drug_interactions(new_medications: str, current_medications: str = None) -> List[Dict]:
+    """
+    Check for drug interactions between new medications and current medications
     
-    return interactions
+    Returns list of interaction warnings
+    """
+    new_meds = _drugs(new_medications)
+    current_meds = _drugs(current_medications) if current_medications else None
+    hits = _interaction_cache.get_or_compute(
+        (new_meds, current_meds), lambda: _screen_medications(new_meds, current_meds)
+    )
+    return [dict(zip(INTERACTION_FIELDS, hit)) for hit in hits]
+
+
+def check_profile_interactions(new_medications: str, profile: Dict[str, int]) -> List[Dict]:
+    """
+    Check new medications against a patient's stored medication profile
+
+    profile maps normalized drug names to the intake that put each on the
+    profile; every warning carries that intake as source_intake_id. Profile
+    drugs are already parsed, so this is id lookups only.
+    """
+    new_meds = tuple(dict.fromkeys(_drugs(new_medications)))
+    others = [drug for drug in profile if drug not in new_meds]
+    hits = _screen_pairs((new_med, other) for new_med in new_meds for other in others)
+    return [
+        {**dict(zip(INTERACTION_FIELDS, hit)), "source_intake_id": profile[hit[1]]}
+        for hit in hits
+    ]
 
 
 def find_interaction(drug1: str, drug2: str) -> Dict:
     """Find interaction between two drugs"""
-    drug1_norm = normalize_drug_name(drug1)
-    drug2_norm = normalize_drug_name(drug2)
-    
-    # Direct lookup
-    if drug1_norm in DRUG_INTERACTIONS:
-        if drug2_norm in DRUG_INTERACTIONS[drug1_norm]:
-            description = DRUG_INTERACTIONS[drug1_norm][drug2_norm]
-            severity = "Major" if "Major:" in description else "Moderate"
-            return {"severity": severity, "description": description}
-    
-    # Reverse lookup
-    if drug2_norm in DRUG_INTERACTIONS:
-        if drug1_norm in DRUG_INTERACTIONS[drug2_norm]:
-            description = DRUG_INTERACTIONS[drug2_norm][drug1_norm]
-            severity = "Major" if "Major:" in description else "Moderate"
-            return {"severity": severity, "description": description}
-    
-    # Category-based checking
-    for category, drugs in DRUG_CATEGORIES.items():
-        if drug1_norm in drugs and drug2_norm in drugs and drug1_norm != drug2_norm:
-            if category == "nsaids":
-                return {
-                    "severity": "Moderate",
-                    "description": "Moderate: Multiple NSAIDs may increase GI bleeding risk."
-                }
-    
-    return None
+    entry = get_interaction_index().lookup(normalize_drug_name(drug1), normalize_drug_name(drug2))
+    if entry is None:
+        return None
+    return {"severity": entry[0], "description": entry[1]}
+
+
+# Counseling points and the drug or class names that trigger them; names match inside
+# longer words too ("statin" in "pravastatin"), except short ones like "ace"
+COUNSELING_RULES = (
+    (
+        ("warfarin",),
+        (
+            "• Take at the same time each day",
+            "• Avoid sudden changes in diet (especially vitamin K-rich foods)",
+            "• Report any unusual bleeding or bruising immediately",
+            "• Regular INR monitoring required",
+        ),
+    ),
+    (
+        ("antibiotic", "antibiotics", "amoxicillin", "azithromycin", "penicillin"),
+        (
+            "• Complete the full course even if you feel better",
+            "• Take with food to reduce stomach upset",
+            "• May reduce effectiveness of birth control pills",
+        ),
+    ),
+    (
+        ("statin", "statins", *DRUG_CATEGORIES["statins"]),
+        (
+            "• Take in the evening for best results",
+            "• Report any muscle pain or weakness",
+            "• Limit alcohol consumption",
+            "• Avoid grapefruit juice",
+        ),
+    ),
+    (
+        ("ace", "ace inhibitor", "ace inhibitors", *DRUG_CATEGORIES["ace_inhibitors"]),
+        (
+            "• May cause dry cough (usually harmless)",
+            "• Monitor blood pressure regularly",
+            "• Stay hydrated",
+        ),
+    ),
+)
+
+DEFAULT_COUNSELING_POINTS = (
+    "• Take medication as directed by your healthcare provider",
+    "• Do not stop taking without consulting your doctor",
+    "• Store medications in a cool, dry place",
+)
+
+def build_medication_matcher(index) -> MedicationMatcher:
+    """
+    One matcher over every drug and class name of an interaction index and the
+    counseling terms, shared by interaction checking and counseling so both
+    read medication text the same way
+    """
+    return MedicationMatcher([*index.drug_names()] + [term for terms, _ in COUNSELING_RULES for term in terms])
+
+
+# Over the built-in tables; a knowledge base gets its own when it is loaded
+MEDICATION_MATCHER = build_medication_matcher(INTERACTION_INDEX)
+COUNSELING_MATCHER = MedicationMatcher(term for terms, _ in COUNSELING_RULES for term in terms)
+# Counseling names shorter than this only match as whole words
+COUNSELING_WHOLE_WORD_BELOW = 4
 
 
 def generate_counseling_points(medications: str, interactions: List[Dict] = None) -> str:
-    """Generate counseling points based on medications and interactions"""
+    """
+    Generate counseling points based on medications and interactions
+
+    Cached on the counseling names found plus a fingerprint of the interactions,
+    since the same regimens come up over and over.
+    """
+    terms = tuple(sorted(
+        COUNSELING_MATCHER.find_substrings((medications or "").lower(), COUNSELING_WHOLE_WORD_BELOW)
+    ))
+    fingerprint = tuple((i["drug1"], i["drug2"], i["description"]) for i in interactions or ())
+    return _counseling_cache.get_or_compute(
+        (terms, fingerprint), lambda: _build_counseling_points(terms, interactions)
+    )
+
+
+def _build_counseling_points(terms: Tuple[str, ...], interactions: List[Dict] = None) -> str:
     points = []
     
-    meds_lower = medications.lower()
-    
     # General counseling points
-    if "warfarin" in meds_lower:
-        points.append("• Take at the same time each day")
-        points.append("• Avoid sudden changes in diet (especially vitamin K-rich foods)")
-        points.append("• Report any unusual bleeding or bruising immediately")
-        points.append("• Regular INR monitoring required")
-    
-    if "antibiotic" in meds_lower or any(ab in meds_lower for ab in ["amoxicillin", "azithromycin", "penicillin"]):
-        points.append("• Complete the full course even if you feel better")
-        points.append("• Take with food to reduce stomach upset")
-        points.append("• May reduce effectiveness of birth control pills")
-    
-    if "statin" in meds_lower or any(s in meds_lower for s in ["atorvastatin", "simvastatin"]):
-        points.append("• Take in the evening for best results")
-        points.append("• Report any muscle pain or weakness")
-        points.append("• Limit alcohol consumption")
-        points.append("• Avoid grapefruit juice")
-    
-    if "ace" in meds_lower or "lisinopril" in meds_lower:
-        points.append("• May cause dry cough (usually harmless)")
-        points.append("• Monitor blood pressure regularly")
-        points.append("• Stay hydrated")
+    for rule_terms, rule_points in COUNSELING_RULES:
+        if any(term in rule_terms for term in terms):
+            points.extend(rule_points)
     
     # Add interaction-specific counseling
     if interactions:
@@ -160,8 +417,20 @@ def generate_counseling_points(medications: str, interactions: List[Dict] = None
             points.append(f"• {interaction['drug1']} + {interaction['drug2']}: {interaction['description']}")
     
     if not points:
-        points.append("• Take medication as directed by your healthcare provider")
-        points.append("• Do not stop taking without consulting your doctor")
-        points.append("• Store medications in a cool, dry place")
+        points.extend(DEFAULT_COUNSELING_POINTS)
     
     return "\n".join(points)
+
+
+def screen_intakes(medication_lists: List[Tuple[str, Optional[str]]]) -> List[Tuple[List[Dict], str]]:
+    """
+    Interactions and counseling points for many (medications, current_medications) pairs
+
+    Used by bulk ingestion, which runs it in worker processes; this module has no
+    database imports, so workers stay light.
+    """
+    results = []
+    for medications, current_medications in medication_lists:
+        interactions = check_drug_interactions(medications, current_medications)
+        results.append((interactions, generate_counseling_points(medications, interactions)))
+    return results
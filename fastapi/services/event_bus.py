@@ -0,0 +1,272 @@
+"""
+Event Bus
+In-process pub/sub for intake change events, streamed to browsers over SSE
+
+publish() may be called from any thread once the change is committed; every
+subscriber gets the event on its own event loop. With EVENT_BUS_URL set to a
+redis:// URL, events travel through a Redis channel instead, so subscribers on
+every worker process see changes made by any of them. They are sent from a
+background task, so a slow or unreachable Redis never holds up a write.
+
+Each process numbers the events it delivers and keeps the most recent ones, so
+a client reconnecting with Last-Event-ID is sent what it missed; when that is
+no longer possible it is sent a resync event instead.
+"""
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Empty keeps events in this process; redis://host:6379/0 shares them between workers
+EVENT_BUS_URL = os.getenv("EVENT_BUS_URL", "")
+EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "intake-events")
+# Events buffered per subscriber; a subscriber that falls further behind is told to resync
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+# Comment lines sent on idle streams so proxies keep them open
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+# Recent events kept for clients resuming with Last-Event-ID
+EVENT_REPLAY_SIZE = int(os.getenv("EVENT_REPLAY_SIZE", "1000"))
+# Streams are closed after this long (clients resume seamlessly); bounds how long shutdown waits on them
+EVENT_STREAM_MAX_SECONDS = float(os.getenv("EVENT_STREAM_MAX_SECONDS", "300"))
+# Events waiting to be sent to Redis; beyond this new ones are dropped rather than held in memory
+EVENT_PUBLISH_QUEUE_SIZE = int(os.getenv("EVENT_PUBLISH_QUEUE_SIZE", "10000"))
+# Longest a single publish to Redis may take before the event is dropped
+EVENT_PUBLISH_TIMEOUT_SECONDS = float(os.getenv("EVENT_PUBLISH_TIMEOUT_SECONDS", "1"))
+
+# Delivered in place of events a slow subscriber missed
+RESYNC = None
+
+
+class Subscription:
+    """One subscriber's bounded queue of (event id, serialized event) pairs"""
+
+    def __init__(self, maxsize: int):
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[Tuple[str, Optional[str]]]" = asyncio.Queue(maxsize)
+
+    def put(self, event_id: str, message: Optional[str]):
+        """Runs on the subscriber's loop"""
+        try:
+            self.queue.put_nowait((event_id, message))
+        except asyncio.QueueFull:
+            # Too far behind to catch up event by event
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((event_id, RESYNC))
+
+    async def get(self) -> Tuple[str, Optional[str]]:
+        return await self.queue.get()
+
+
+class RedisBackend:
+    """
+    Relays events through a Redis pub/sub channel (needs the redis package)
+
+    publish() only queues the message, so committed writes never wait on
+    Redis; a task on the application's event loop sends them in order, each
+    within EVENT_PUBLISH_TIMEOUT_SECONDS. Events that time out, fail or find
+    the queue full are logged and dropped.
+    """
+
+    def __init__(self, url: str, channel: str, dispatch):
+        import redis.asyncio
+
+        self.channel = channel
+        self._dispatch = dispatch
+        self._publisher = redis.asyncio.Redis.from_url(url)
+        self._subscriber = redis.asyncio.Redis.from_url(url)
+        self._loop = asyncio.get_running_loop()
+        self._outbox: "asyncio.Queue[str]" = asyncio.Queue(EVENT_PUBLISH_QUEUE_SIZE)
+        self._tasks = []
+
+    def publish(self, message: str):
+        """Queue a message for Redis; safe to call from any thread"""
+        self._loop.call_soon_threadsafe(self._enqueue, message)
+
+    def _enqueue(self, message: str):
+        try:
+            self._outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning("Event bus publish queue is full; dropping an event")
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._send()), asyncio.create_task(self._listen())]
+
+    async def _send(self):
+        while True:
+            message = await self._outbox.get()
+            try:
+                await asyncio.wait_for(self._publisher.publish(self.channel, message), EVENT_PUBLISH_TIMEOUT_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logger.warning("Publishing an event to Redis timed out; dropping it")
+            except Exception:
+                logger.exception("Could not publish an event to Redis; dropping it")
+            finally:
+                self._outbox.task_done()
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self._subscriber.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self._dispatch(message["data"].decode("utf-8"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the event bus subscription; reconnecting")
+                await asyncio.sleep(1)
+
+    async def stop(self):
+        # Give events committed just before shutdown a chance to go out
+        try:
+            await asyncio.wait_for(self._outbox.join(), EVENT_PUBLISH_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d unpublished events on shutdown", self._outbox.qsize())
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self._subscriber.aclose()
+        await self._publisher.aclose()
+
+
+class EventBus:
+    def __init__(self, replay_size: int = EVENT_REPLAY_SIZE):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._backend = None
+        # Event ids are "<epoch>-<seq>"; a new epoch per process means ids from
+        # another worker or a previous run are never mistaken for ours
+        self._epoch = uuid.uuid4().hex[:12]
+        self._seq = 0
+        self._history = deque(maxlen=replay_size)
+
+    def publish(self, event: dict):
+        """Send an event to every subscriber; failures are logged, never raised"""
+        message = json.dumps(event, default=str)
+        try:
+            if self._backend is not None:
+                self._backend.publish(message)
+            else:
+                self.dispatch(message)
+        except Exception:
+            logger.exception("Could not publish %s event", event.get("type"))
+
+    def _event_id(self, seq: int) -> str:
+        return f"{self._epoch}-{seq}"
+
+    def dispatch(self, message: str):
+        """Number a serialized event and hand it to the subscribers in this process"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._history.append((seq, message))
+            subscribers = list(self._subscribers)
+        event_id = self._event_id(seq)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event_id, message)
+            except RuntimeError:
+                # Loop already closed; its subscription is on the way out
+                pass
+
+    def _missed(self, last_event_id: str) -> Optional[list]:
+        """Events after last_event_id, or None if they are no longer all available"""
+        epoch, _, seq = last_event_id.rpartition("-")
+        if epoch != self._epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._history[0][0] if self._history else self._seq + 1
+        if seq < oldest - 1 or seq > self._seq:
+            return None
+        return [(self._event_id(s), message) for s, message in self._history if s > seq]
+
+    @asynccontextmanager
+    async def subscribe(self, last_event_id: Optional[str] = None) -> AsyncIterator[Subscription]:
+        """
+        Register a subscriber for events dispatched from now on
+
+        With last_event_id, the events it missed are queued first, or a resync
+        marker if some of them are gone.
+        """
+        subscription = Subscription(EVENT_QUEUE_SIZE)
+        with self._lock:
+            if last_event_id:
+                missed = self._missed(last_event_id)
+                if missed is None:
+                    subscription.put(self._event_id(self._seq), RESYNC)
+                else:
+                    for event_id, message in missed:
+                        subscription.put(event_id, message)
+            self._subscribers.add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscription)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    async def start(self, url: str = EVENT_BUS_URL):
+        """Connect the configured backend (called on application startup)"""
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            self._backend = RedisBackend(url, EVENT_BUS_CHANNEL, self.dispatch)
+            await self._backend.start()
+        elif url:
+            raise ValueError(f"Unsupported EVENT_BUS_URL: {url}")
+
+    async def stop(self):
+        backend, self._backend = self._backend, None
+        if backend is not None:
+            await backend.stop()
+
+
+bus = EventBus()
+
+
+async def sse_stream(
+    last_event_id: Optional[str] = None,
+    event_bus: EventBus = bus,
+    heartbeat: float = EVENT_HEARTBEAT_SECONDS,
+    max_seconds: float = EVENT_STREAM_MAX_SECONDS,
+) -> AsyncIterator[str]:
+    """
+    Server-sent event stream of one subscription
+
+    Each event is a default "message" whose data is the event JSON. A "resync"
+    event means some events were lost and the client should reload. The stream
+    ends after max_seconds; browsers reconnect and resume from Last-Event-ID.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_seconds
+    async with event_bus.subscribe(last_event_id) as subscription:
+        # Sent straight away so the client sees the stream open
+        yield "retry: 3000\n\n"
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event_id, message = await asyncio.wait_for(subscription.get(), min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if message is RESYNC:
+                yield f"id: {event_id}\nevent: resync\ndata: {{}}\n\n"
+            else:
+                yield f"id: {event_id}\ndata: {message}\n\n"
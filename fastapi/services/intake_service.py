@@ -1,11 +1,18 @@
+from collections import deque
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import NamedTuple, Optional, List, Tuple, Union
+from sqlalchemy import and_, bindparam, case, delete, func, insert, or_, select, union_all, update
 from sqlalchemy.orm import Session
+import base64
 import json
 
-from schemas.intake import IntakeCreate
-from database import Intake
-from services.drug_interaction_service import check_drug_interactions, generate_counseling_points
+from schemas.intake import IntakeCreate, IntakeSummary
+from database import Intake, IntakeArchive, IntakeCounter, IntakeInteraction
+from services.drug_interaction_service import (
+    SEVERITIES, check_drug_interactions, generate_counseling_points, normalize_drug_name
+)
+from services import metrics, patient_service, response_cache, screening_queue, stats_service
+from services.event_bus import bus
 
 ALLOWED_STATUSES = [
     "new",
@@ -27,22 +34,108 @@ ALLOWED_TRANSITIONS = {
     "completed": []
 }
 
+# Statuses an intake never leaves; only these are ever archived
+TERMINAL_STATUSES = [status for status, targets in ALLOWED_TRANSITIONS.items() if not targets]
+
+
+def _write_interactions(db: Session, interactions_by_intake: dict, replace: bool = False):
+    """Mirror interaction lists into intake_interactions with one bulk INSERT"""
+    if replace and interactions_by_intake:
+        db.execute(delete(IntakeInteraction).where(
+            IntakeInteraction.intake_id.in_(list(interactions_by_intake))
+        ))
+    rows = [
+        {
+            "intake_id": intake_id,
+            "drug1": i["drug1"],
+            "drug2": i["drug2"],
+            "severity": i["severity"],
+            "description": i["description"],
+        }
+        for intake_id, interactions in interactions_by_intake.items()
+        for i in interactions or ()
+    ]
+    if rows:
+        # render_nulls keeps rows with and without a description in the same batch
+        db.execute(insert(IntakeInteraction), rows, execution_options={"render_nulls": True})
+
+
+def _after_commit(event_type: str, intake: Optional[Intake] = None, counters: Optional[dict] = None, **fields):
+    """
+    Drop cached list pages and tell event subscribers about a committed change
+
+    Events carry the intake's list card and the counter deltas that were applied,
+    so open queues can patch themselves instead of refetching.
+    """
+    response_cache.invalidate()
+    event = {"type": event_type, **fields}
+    if intake is not None:
+        card = {name: getattr(intake, name) for name in IntakeSummary.model_fields if hasattr(Intake, name)}
+        try:
+            card["interaction_severity"] = max_severity(json.loads(intake.drug_interactions or "null"))
+        except ValueError:
+            card["interaction_severity"] = None
+        event["intake"] = IntakeSummary.model_validate(card).model_dump(mode="json")
+    event["counters"] = {name: delta for name, delta in (counters or {}).items() if delta}
+    bus.publish(event)
+
 
 def create_intake(db: Session, data: IntakeCreate) -> Intake:
-    # Check for drug interactions
-    interactions = check_drug_interactions(
-        data.medications,
-        data.current_medications
-    )
-    
+    patient, queued = prepare_intake(db, data)
+    screening = None if queued else screen_intake(data, patient.profile)
+    return persist_intake(db, data, patient, screening)
+
+
+def prepare_intake(db: Session, data: IntakeCreate) -> Tuple[patient_service.StoredPatient, bool]:
+    """
+    Read what creating an intake needs; returns the patient and whether screening is queued
+
+    Read only: screening runs before anything takes the database's write lock.
+    Raises ValueError when data names a patient_id that does not exist.
+    """
+    with metrics.stage("patient_profile"):
+        patient = patient_service.find_patient(db, data.patient_id, data.patient_name, data.patient_date_of_birth)
+
+    # In background mode the screening worker fills in interactions and counseling
+    # points later; a full queue falls back to screening here
+    with metrics.stage("screening_queue"):
+        queued = screening_queue.SCREENING_MODE == "background" and screening_queue.has_room(db)
+    return patient, queued
+
+
+def screen_intake(data: IntakeCreate, profile: List[patient_service.ProfileEntry]) -> Tuple[List[dict], str]:
+    """Interactions and counseling points of a new intake; no database access, so it can run off the event loop"""
+    # Check for drug interactions, within this intake and against the rest of the patient's profile
+    with metrics.stage("interaction_check"):
+        interactions = check_drug_interactions(
+            data.medications,
+            data.current_medications
+        )
+        interactions += patient_service.check_profile(data.medications, data.current_medications, profile)
+
     # Generate counseling points
-    counseling = generate_counseling_points(data.medications, interactions)
-    
+    with metrics.stage("counseling"):
+        counseling = generate_counseling_points(data.medications, interactions)
+    return interactions, counseling
+
+
+def persist_intake(
+    db: Session,
+    data: IntakeCreate,
+    patient: patient_service.StoredPatient,
+    screening: Optional[Tuple[List[dict], str]],
+) -> Intake:
+    """Insert an intake read by prepare_intake; screening is None when it was queued for the worker"""
+    queued = screening is None
+    interactions, counseling = screening or ([], None)
+
     # Store interactions as JSON string
     interactions_json = json.dumps(interactions) if interactions else None
     
+    now = datetime.now(timezone.utc)
     intake = Intake(
         patient_name=data.patient_name,
+        patient_date_of_birth=data.patient_date_of_birth,
         patient_age=data.patient_age,
         patient_allergies=data.patient_allergies,
         medications=data.medications,
@@ -50,136 +143,866 @@ def create_intake(db: Session, data: IntakeCreate) -> Intake:
         notes=data.notes,
         counseling_points=counseling,
         drug_interactions=interactions_json,
-        status="new"
+        status="new",
+        screening_status="pending" if queued else "screened",
+        created_at=now,
+        updated_at=now,
     )
-    db.add(intake)
-    db.commit()
-    db.refresh(intake)
+    counters = {
+        stats_service.TOTAL: 1,
+        stats_service.status_key("new"): 1,
+        stats_service.day_key(now): 1,
+    }
+    with metrics.stage("persist"):
+        intake.patient_id = patient_service.ensure_patient(
+            db, patient, data.patient_name, data.patient_date_of_birth, data.patient_allergies
+        )
+        db.add(intake)
+        db.flush()
+        _write_interactions(db, {intake.id: interactions})
+        patient_service.record_intakes(db, [(
+            intake.patient_id,
+            patient_service.intake_entries(intake.id, data.medications, data.current_medications),
+            now,
+        )])
+        if queued:
+            screening_queue.enqueue(db, [intake.id])
+        stats_service.record_change(db, counters)
+        db.commit()
+    if queued:
+        screening_queue.notify()
+    _after_commit("created", intake, counters)
     return intake
 
 
-def list_intakes(db: Session, status: Optional[str] = None, assigned_to: Optional[str] = None) -> List[Intake]:
-    query = db.query(Intake)
+def claim_screening_jobs(
+    db: Session, limit: int = screening_queue.SCREENING_BATCH_SIZE
+) -> Tuple[List[screening_queue.ClaimedJob], List[Tuple[str, Optional[str]]]]:
+    """
+    Lease a batch of queued screenings and read what they need
+
+    Returns the claimed jobs and, for each, the intake's (medications,
+    current_medications) to screen. Jobs abandoned with no attempts left are
+    marked failed on the way.
+    """
+    if not screening_queue.has_claimable(db):
+        return [], []
+    failed = screening_queue.expire_exhausted(db)
+    _mark_screening_failed(db, failed)
+    jobs = screening_queue.claim(db, limit)
+    db.commit()
+    if failed:
+        _after_commit("screening_failed", ids=failed)
+    if not jobs:
+        return [], []
+    rows = db.execute(
+        select(Intake.id, Intake.medications, Intake.current_medications)
+        .where(Intake.id.in_([job.intake_id for job in jobs]))
+    ).all()
+    inputs = {row.id: (row.medications, row.current_medications) for row in rows}
+    gone = [job for job in jobs if job.intake_id not in inputs]
+    if gone:
+        screening_queue.complete(db, gone)
+        db.commit()
+        jobs = [job for job in jobs if job.intake_id in inputs]
+    return jobs, [inputs[job.intake_id] for job in jobs]
+
+
+def save_screenings(db: Session, jobs: List[screening_queue.ClaimedJob], screenings: List[Tuple[List[dict], str]]) -> int:
+    """
+    Write back background screenings with one bulk UPDATE and one commit, and drop their jobs
+
+    screenings[i] is screen_intakes' (interactions, counseling_points) for
+    jobs[i]; interactions with the rest of the patient's profile are added here.
+    Only jobs whose lease this claim still holds are written. Counseling points
+    a pharmacist has written meanwhile are kept: they are only replaced while
+    unset or still what the screening generated. Returns the number of
+    intakes updated.
+    """
+    if not jobs:
+        return 0
+    generated = {job.id: screening for job, screening in zip(jobs, screenings)}
+    # Dropping the jobs first takes the write lock, so nothing can claim them again before the commit
+    held = screening_queue.complete_leased(db, jobs)
+    rows = db.execute(
+        select(Intake.id, Intake.medications, Intake.current_medications, Intake.patient_id)
+        .where(Intake.id.in_([job.intake_id for job in held]))
+    ).all() if held else []
+    intakes = {row.id: row for row in rows}
+    profiles = patient_service.load_profiles(db, {row.patient_id for row in rows})
+    now = datetime.now(timezone.utc)
+    changes = []
+    interactions_by_intake = {}
+    for job in held:
+        row = intakes.get(job.intake_id)
+        if row is None:
+            continue
+        interactions, counseling = screened = generated[job.id]
+        if row.patient_id is not None:
+            extra = patient_service.check_profile(
+                row.medications, row.current_medications, profiles[row.patient_id], row.id
+            )
+            if extra:
+                interactions = list(interactions) + extra
+                counseling = generate_counseling_points(row.medications, interactions)
+        changes.append({
+            "intake_id": row.id,
+            "interactions_json": json.dumps(interactions) if interactions else None,
+            "counseling": counseling,
+            "screened_counseling": screened[1],
+            "screened_at": now,
+        })
+        interactions_by_intake[row.id] = interactions
+    if changes:
+        table = Intake.__table__
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("intake_id"))
+            .values(
+                drug_interactions=bindparam("interactions_json"),
+                counseling_points=case(
+                    (
+                        or_(
+                            table.c.counseling_points.is_(None),
+                            table.c.counseling_points == bindparam("counseling"),
+                            table.c.counseling_points == bindparam("screened_counseling"),
+                        ),
+                        bindparam("counseling"),
+                    ),
+                    else_=table.c.counseling_points,
+                ),
+                screening_status="screened",
+                updated_at=bindparam("screened_at"),
+            ),
+            changes,
+        )
+        _write_interactions(db, interactions_by_intake, replace=True)
+        stats_service.record_change(db)
+    db.commit()
+    if changes:
+        _after_commit("screened_bulk", ids=[change["intake_id"] for change in changes])
+    return len(changes)
+
+
+def release_screening_jobs(db: Session, jobs: List[screening_queue.ClaimedJob], error: str) -> List[int]:
+    """Put back jobs whose screening raised, failing those out of attempts; returns the failed intake ids"""
+    failed = screening_queue.release(db, jobs, error)
+    _mark_screening_failed(db, failed)
+    db.commit()
+    if failed:
+        _after_commit("screening_failed", ids=failed)
+    return failed
+
+
+def _mark_screening_failed(db: Session, intake_ids: List[int]):
+    if intake_ids:
+        db.execute(
+            update(Intake).where(Intake.id.in_(intake_ids))
+            .values(screening_status="failed", updated_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)
+        )
+        stats_service.record_change(db)
+
+
+def get_screening_status(db: Session, intake_id: int) -> Optional[dict]:
+    """Where an intake's screening stands, with its queue job while it has one"""
+    screening_status = db.scalar(select(Intake.screening_status).where(Intake.id == intake_id))
+    if screening_status is None:
+        return None
+    job = screening_queue.job_for_intake(db, intake_id)
+    return {
+        "intake_id": intake_id,
+        "screening_status": screening_status,
+        "job_status": job.status if job else None,
+        "attempts": job.attempts if job else 0,
+        "last_error": job.last_error if job else None,
+        "queued_at": job.created_at if job else None,
+    }
+
+
+def get_screening_queue_statistics(db: Session) -> dict:
+    return screening_queue.queue_statistics(db)
+
+
+# Columns that tell bulk-inserted rows apart; the rest are derived from them or shared
+_ROW_KEY = (
+    "patient_name", "patient_id", "patient_date_of_birth", "patient_age", "patient_allergies",
+    "medications", "current_medications", "notes",
+)
+
+
+def _insert_returning_ids(db: Session, rows: List[dict]) -> List[int]:
+    """
+    Multi-row INSERT returning the new ids in the order of rows
+
+    sort_by_parameter_order would make SQLAlchemy fall back to one INSERT per
+    row on SQLite, which has no way to correlate RETURNING rows with parameters.
+    Instead the rows are matched back on their inserted values; rows identical in
+    all of them are interchangeable, so which of their ids each gets is immaterial.
+    """
+    positions = {}
+    for position, row in enumerate(rows):
+        positions.setdefault(tuple(row[name] for name in _ROW_KEY), deque()).append(position)
+    key_columns = [getattr(Intake, name) for name in _ROW_KEY]
+    ids = [None] * len(rows)
+    returned = db.execute(
+        insert(Intake).returning(Intake.id, *key_columns), rows, execution_options={"render_nulls": True}
+    )
+    for intake_id, *key in returned:
+        ids[positions[tuple(key)].popleft()] = intake_id
+    return ids
+
+
+def create_intakes(db: Session, items: List[IntakeCreate], screenings: List[Tuple[List[dict], str]]) -> List[int]:
+    """
+    Insert already-screened intakes with one executemany INSERT and commit once
+
+    screenings[i] is the (interactions, counseling_points) pair for items[i],
+    screened within the intake alone; screening against patient profiles,
+    including earlier intakes of the same batch, happens here. Returns the new
+    ids in the same order as items.
+    """
+    if not items:
+        return []
+    now = datetime.now(timezone.utc)
+    patient_ids = patient_service.resolve_patients(db, [
+        (data.patient_id, data.patient_name, data.patient_date_of_birth, data.patient_allergies) for data in items
+    ])
+    rows = [
+        {
+            "patient_name": data.patient_name,
+            "patient_id": patient_id,
+            "patient_date_of_birth": data.patient_date_of_birth,
+            "patient_age": data.patient_age,
+            "patient_allergies": data.patient_allergies,
+            "medications": data.medications,
+            "current_medications": data.current_medications,
+            "notes": data.notes,
+            "counseling_points": counseling,
+            "drug_interactions": json.dumps(interactions) if interactions else None,
+            "status": "new",
+            "created_at": now,
+            "updated_at": now,
+        }
+        for data, patient_id, (interactions, counseling) in zip(items, patient_ids, screenings)
+    ]
+    ids = _insert_returning_ids(db, rows)
+    entries = [
+        patient_service.intake_entries(intake_id, data.medications, data.current_medications)
+        for data, intake_id in zip(items, ids)
+    ]
+    screenings = _screen_profiles(db, items, ids, patient_ids, entries, screenings, now)
+    _write_interactions(db, {
+        intake_id: interactions for intake_id, (interactions, _) in zip(ids, screenings)
+    })
+    patient_service.record_intakes(db, [(patient_id, intake_entries, now) for patient_id, intake_entries in zip(patient_ids, entries)])
+    counters = {
+        stats_service.TOTAL: len(ids),
+        stats_service.status_key("new"): len(ids),
+        stats_service.day_key(now): len(ids),
+    }
+    stats_service.record_change(db, counters)
+    db.commit()
+    # One event per chunk; subscribers reload rather than receive thousands of cards
+    _after_commit("created_bulk", counters=counters, ids=ids)
+    return ids
+
+
+def _screen_profiles(
+    db: Session,
+    items: List[IntakeCreate],
+    ids: List[int],
+    patient_ids: List[Optional[int]],
+    entries: List[List[patient_service.ProfileEntry]],
+    screenings: List[Tuple[List[dict], str]],
+    now: datetime,
+) -> List[Tuple[List[dict], str]]:
+    """
+    Add profile interactions to just-inserted intakes, each screened as if created alone in order
+
+    Intakes that gain warnings get their JSON and counseling points rewritten
+    with one bulk UPDATE. Returns the screenings with the additions.
+    """
+    profiles = patient_service.load_profiles(db, patient_ids)
+    screenings = list(screenings)
+    changes = []
+    for position, (data, intake_id, patient_id, intake_entries) in enumerate(zip(items, ids, patient_ids, entries)):
+        if patient_id is None:
+            continue
+        profile = profiles[patient_id]
+        extra = patient_service.check_profile(data.medications, data.current_medications, profile)
+        if extra:
+            interactions = list(screenings[position][0]) + extra
+            counseling = generate_counseling_points(data.medications, interactions)
+            screenings[position] = (interactions, counseling)
+            changes.append({
+                "id": intake_id,
+                "drug_interactions": json.dumps(interactions),
+                "counseling_points": counseling,
+                "updated_at": now,
+            })
+        profiles[patient_id] = patient_service.add_to_profile(profile, intake_entries)
+    if changes:
+        db.execute(update(Intake), changes)
+    return screenings
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def _interaction_severity(model):
+    """
+    Highest interaction severity of each row of model, read from the indexed side table
+
+    One correlated MIN over "<rank><severity>" keys ("0Major" sorts before "1Moderate"),
+    with the rank digit cut off afterwards, so the lookup runs once per row.
+    """
+    ranked = case(
+        *((IntakeInteraction.severity == severity, f"{rank}{severity}") for rank, severity in enumerate(SEVERITIES)),
+    )
+    worst = (
+        select(func.min(ranked))
+        .where(IntakeInteraction.intake_id == model.id)
+        .correlate(model)
+        .scalar_subquery()
+    )
+    return func.substr(worst, 2).label("interaction_severity")
+
+
+def _summary_columns(model) -> tuple:
+    return (
+        model.id,
+        model.patient_name,
+        model.patient_age,
+        model.patient_allergies,
+        model.medications,
+        model.current_medications,
+        _interaction_severity(model),
+        model.screening_status,
+        model.status,
+        model.assigned_to,
+        model.dispensed,
+        model.dispensed_at,
+        model.created_at,
+        model.updated_at,
+    )
+
+
+# Columns needed by the queue list cards; heavy text is served by get_intake_by_id
+SUMMARY_COLUMNS = _summary_columns(Intake)
+# The same for archived intakes, whose list card columns are stored uncompressed
+ARCHIVE_SUMMARY_COLUMNS = _summary_columns(IntakeArchive)
+
+
+def encode_cursor(created_at: datetime, intake_id: int) -> str:
+    """Encode a (created_at, id) keyset position as an opaque token"""
+    raw = json.dumps([created_at.isoformat(), intake_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a token produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, intake_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(intake_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _list_filters(model, status, assigned_to, severity, drug, cursor) -> list:
+    """WHERE clauses of a list_intakes page, for intakes or intakes_archive"""
+    clauses = []
     if status:
-        query = query.filter(Intake.status == status)
+        clauses.append(model.status == status)
     if assigned_to:
-        query = query.filter(Intake.assigned_to == assigned_to)
-    return query.order_by(Intake.created_at.desc()).all()
+        clauses.append(model.assigned_to == assigned_to)
+    if severity or drug:
+        matching = select(IntakeInteraction.intake_id)
+        if severity:
+            matching = matching.where(IntakeInteraction.severity == severity)
+        if drug:
+            matching = matching.where(or_(IntakeInteraction.drug1 == drug, IntakeInteraction.drug2 == drug))
+        clauses.append(model.id.in_(matching))
+    if cursor:
+        created_at, intake_id = cursor
+        clauses.append(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < intake_id),
+        ))
+    return clauses
 
 
-def get_intake_by_id(db: Session, intake_id: int) -> Optional[Intake]:
-    return db.query(Intake).filter(Intake.id == intake_id).first()
+def list_intakes(
+    db: Session,
+    status: Optional[str] = None,
+    assigned_to: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    severity: Optional[str] = None,
+    drug: Optional[str] = None,
+    include_archived: bool = False,
+) -> Tuple[list, Optional[str]]:
+    """
+    Return one page of intake summaries, newest first, plus the cursor for the next page
 
+    Pages are keyset-paginated on (created_at, id) so deep pages cost the same as the first.
+    include_archived merges in intakes moved to intakes_archive.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if drug:
+        drug = normalize_drug_name(drug)
+    position = decode_cursor(cursor) if cursor else None
+    filters = (status, assigned_to, severity, drug, position)
+
+    # Fetch one extra row to learn whether another page exists
+    page = (
+        select(*SUMMARY_COLUMNS)
+        .where(*_list_filters(Intake, *filters))
+        .order_by(Intake.created_at.desc(), Intake.id.desc())
+        .limit(limit + 1)
+    )
+    # Only terminal statuses are ever archived
+    if include_archived and (not status or status in TERMINAL_STATUSES):
+        archived = (
+            select(*ARCHIVE_SUMMARY_COLUMNS)
+            .where(*_list_filters(IntakeArchive, *filters))
+            .order_by(IntakeArchive.created_at.desc(), IntakeArchive.id.desc())
+            .limit(limit + 1)
+        )
+        # Each side is cut to a page on its own indexes before the merge
+        live_page, archived_page = page.subquery(), archived.subquery()
+        merged = union_all(select(*live_page.c), select(*archived_page.c)).subquery()
+        page = select(*merged.c).order_by(merged.c.created_at.desc(), merged.c.id.desc()).limit(limit + 1)
+    rows = db.execute(page).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def get_intake_by_id(db: Session, intake_id: int) -> Union[Intake, IntakeArchive, None]:
+    """The intake with this id, read from intakes_archive once it has been archived"""
+    intake = db.query(Intake).filter(Intake.id == intake_id).first()
+    if intake is None:
+        intake = db.get(IntakeArchive, intake_id)
+    return intake
+
+
+def _update_intake(db: Session, where, **values) -> Optional[Intake]:
+    """
+    Apply values to the intake matching where in one UPDATE ... RETURNING
+
+    Returns the updated intake, or None when no row matched. The caller commits.
+    """
+    values.setdefault("updated_at", datetime.now(timezone.utc))
+    stmt = (
+        update(Intake)
+        .where(where)
+        .values(**values)
+        .returning(Intake)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    return db.scalars(stmt).first()
 
-def update_status(db: Session, intake_id: int, new_status: str) -> Optional[Intake]:
-    intake = get_intake_by_id(db, intake_id)
-    if not intake:
-        return None
-    
-    current_status = intake.status
 
-    if new_status not in ALLOWED_TRANSITIONS.get(current_status, []):
+def _transition_sources(new_status: str) -> List[str]:
+    return [status for status, targets in ALLOWED_TRANSITIONS.items() if new_status in targets]
+
+
+def update_status(db: Session, intake_id: int, new_status: str) -> Optional[Intake]:
+    # The transition check is part of the UPDATE, so two concurrent moves of
+    # the same intake cannot both succeed
+    matches = and_(Intake.id == intake_id, Intake.status.in_(_transition_sources(new_status)))
+    previous = stats_service.shift_counter(db, stats_service.status_name(Intake.status), matches, -1)
+    intake = _update_intake(db, matches, status=new_status)
+    if intake is None:
+        db.rollback()
+        current_status = db.scalar(select(Intake.status).where(Intake.id == intake_id))
+        if current_status is None:
+            return None
         raise ValueError(
             f"Invalid transition from '{current_status}' to '{new_status}'. "
             f"Allowed transitions: {ALLOWED_TRANSITIONS.get(current_status, [])}"
         )
-    
-    intake.status = new_status
-    intake.updated_at = datetime.now(timezone.utc)
+
+    if new_status == "completed":
+        # Prescriptions never dispensed no longer count against the patient's next intakes
+        patient_service.retire_intakes(db, [intake_id], pending_only=True)
+    stats_service.record_change(db, {stats_service.status_key(new_status): 1})
     db.commit()
-    db.refresh(intake)
+    _after_commit("status_changed", intake, {previous: -1, stats_service.status_key(new_status): 1})
     return intake
 
 
 def assign_intake(db: Session, intake_id: int, user: str) -> Optional[Intake]:
-    intake = get_intake_by_id(db, intake_id)
-    if not intake:
+    matches = Intake.id == intake_id
+    previous = stats_service.shift_counter(db, stats_service.assignee_name(Intake.assigned_to), matches, -1)
+    intake = _update_intake(db, matches, assigned_to=user)
+    if intake is None:
+        db.rollback()
         return None
-    
-    intake.assigned_to = user
-    intake.updated_at = datetime.now(timezone.utc)
+
+    counters = {stats_service.assignee_key(user): 1}
+    stats_service.record_change(db, counters)
     db.commit()
-    db.refresh(intake)
+    if previous:
+        counters[previous] = counters.get(previous, 0) - 1
+    _after_commit("assigned", intake, counters)
     return intake
 
 
+def _unique(intake_ids: List[int]) -> List[int]:
+    return list(dict.fromkeys(intake_ids))
+
+
+def update_status_bulk(db: Session, intake_ids: List[int], new_status: str) -> List[dict]:
+    """
+    Move every listed intake whose status allows it to new_status, in one UPDATE and one transaction
+
+    Returns one outcome per distinct id, in the order given: "updated",
+    "invalid_transition" (with the intake's current status) or "not_found".
+    The number of statements does not depend on how many ids are listed.
+    """
+    if new_status not in ALLOWED_STATUSES:
+        raise ValueError(f"Unknown status '{new_status}'. Allowed statuses: {ALLOWED_STATUSES}")
+    intake_ids = _unique(intake_ids)
+    matches = and_(Intake.id.in_(intake_ids), Intake.status.in_(_transition_sources(new_status)))
+    counters = stats_service.shift_counters_per_intake(db, stats_service.status_name(Intake.status), matches, -1)
+    moved = set(db.scalars(
+        update(Intake)
+        .where(matches)
+        .values(status=new_status, updated_at=datetime.now(timezone.utc))
+        .returning(Intake.id)
+        .execution_options(synchronize_session=False)
+    ))
+    rejected = [intake_id for intake_id in intake_ids if intake_id not in moved]
+    current = {}
+    if rejected:
+        current = dict(db.execute(select(Intake.id, Intake.status).where(Intake.id.in_(rejected))).all())
+    if moved:
+        if new_status == "completed":
+            patient_service.retire_intakes(db, list(moved), pending_only=True)
+        counters[stats_service.status_key(new_status)] = len(moved)
+        stats_service.record_change(db, {stats_service.status_key(new_status): len(moved)})
+    db.commit()
+    if moved:
+        _after_commit("status_changed_bulk", counters=counters, ids=[i for i in intake_ids if i in moved])
+
+    results = []
+    for intake_id in intake_ids:
+        if intake_id in moved:
+            results.append({"id": intake_id, "outcome": "updated", "status": new_status})
+        elif intake_id in current:
+            results.append({
+                "id": intake_id,
+                "outcome": "invalid_transition",
+                "status": current[intake_id],
+                "detail": f"Invalid transition from '{current[intake_id]}' to '{new_status}'. "
+                          f"Allowed transitions: {ALLOWED_TRANSITIONS.get(current[intake_id], [])}",
+            })
+        else:
+            results.append({"id": intake_id, "outcome": "not_found"})
+    return results
+
+
+def assign_intakes(db: Session, intake_ids: List[int], user: str) -> List[dict]:
+    """
+    Assign every listed intake to user with one UPDATE and one transaction
+
+    Returns one outcome per distinct id, in the order given: "updated" or "not_found".
+    """
+    intake_ids = _unique(intake_ids)
+    matches = Intake.id.in_(intake_ids)
+    counters = stats_service.shift_counters_per_intake(db, stats_service.assignee_name(Intake.assigned_to), matches, -1)
+    assigned = set(db.scalars(
+        update(Intake)
+        .where(matches)
+        .values(assigned_to=user, updated_at=datetime.now(timezone.utc))
+        .returning(Intake.id)
+        .execution_options(synchronize_session=False)
+    ))
+    if assigned:
+        stats_service.record_change(db, {stats_service.assignee_key(user): len(assigned)})
+        key = stats_service.assignee_key(user)
+        counters[key] = counters.get(key, 0) + len(assigned)
+    db.commit()
+    if assigned:
+        _after_commit("assigned_bulk", counters=counters, ids=[i for i in intake_ids if i in assigned])
+    return [
+        {"id": intake_id, "outcome": "updated", "assigned_to": user} if intake_id in assigned
+        else {"id": intake_id, "outcome": "not_found"}
+        for intake_id in intake_ids
+    ]
+
+
 def update_counseling_points(db: Session, intake_id: int, counseling_points: str) -> Optional[Intake]:
-    intake = get_intake_by_id(db, intake_id)
-    if not intake:
+    intake = _update_intake(db, Intake.id == intake_id, counseling_points=counseling_points)
+    if intake is None:
         return None
-    
-    intake.counseling_points = counseling_points
-    intake.updated_at = datetime.now(timezone.utc)
+    stats_service.record_change(db)
     db.commit()
-    db.refresh(intake)
+    _after_commit("updated", intake)
     return intake
 
 
 def update_pharmacist_notes(db: Session, intake_id: int, pharmacist_notes: str) -> Optional[Intake]:
-    intake = get_intake_by_id(db, intake_id)
-    if not intake:
+    intake = _update_intake(db, Intake.id == intake_id, pharmacist_notes=pharmacist_notes)
+    if intake is None:
         return None
-    
-    intake.pharmacist_notes = pharmacist_notes
-    intake.updated_at = datetime.now(timezone.utc)
+    stats_service.record_change(db)
     db.commit()
-    db.refresh(intake)
+    _after_commit("updated", intake)
     return intake
 
 
 def dispense_medication(db: Session, intake_id: int, dispensed: str) -> Optional[Intake]:
-    intake = get_intake_by_id(db, intake_id)
-    if not intake:
-        return None
-    
-    intake.dispensed = dispensed
+    matches = Intake.id == intake_id
+    was_dispensed = Intake.dispensed == "yes"
+    values = {"dispensed": dispensed}
     if dispensed == "yes":
-        intake.dispensed_at = datetime.now(timezone.utc)
+        not_dispensed = or_(Intake.dispensed.is_(None), ~was_dispensed)
+        counters = stats_service.shift_counters(db, {stats_service.DISPENSED: 1}, and_(matches, not_dispensed))
         # Auto-update status to dispensed if currently filled
-        if intake.status == "filled":
-            intake.status = "dispensed"
-    intake.updated_at = datetime.now(timezone.utc)
+        counters.update(stats_service.shift_counters(db, {
+            stats_service.status_key("filled"): -1,
+            stats_service.status_key("dispensed"): 1,
+        }, and_(matches, Intake.status == "filled")))
+        values["dispensed_at"] = datetime.now(timezone.utc)
+        values["status"] = case((Intake.status == "filled", "dispensed"), else_=Intake.status)
+    else:
+        counters = stats_service.shift_counters(db, {stats_service.DISPENSED: -1}, and_(matches, was_dispensed))
+
+    intake = _update_intake(db, matches, **values)
+    if intake is None:
+        db.rollback()
+        return None
+    patient_service.mark_dispensed(db, intake_id, dispensed == "yes")
+    stats_service.record_change(db)
     db.commit()
-    db.refresh(intake)
+    _after_commit("dispensed", intake, counters)
     return intake
 
 
 def check_interactions_for_intake(db: Session, intake_id: int) -> dict:
     """Re-check drug interactions for an existing intake"""
-    intake = get_intake_by_id(db, intake_id)
-    if not intake:
+    inputs = read_screening_inputs(db, intake_id)
+    if inputs is None:
         return None
-    
-    interactions = check_drug_interactions(
-        intake.medications,
-        intake.current_medications
+    interactions, counseling_points = rescreen(*inputs, intake_id)
+    return write_rescreen(db, intake_id, interactions, counseling_points)
+
+
+def read_screening_inputs(
+    db: Session, intake_id: int
+) -> Optional[Tuple[str, Optional[str], List[patient_service.ProfileEntry]]]:
+    """An intake's (medications, current_medications, patient profile), or None if there is no such intake"""
+    row = db.execute(
+        select(Intake.medications, Intake.current_medications, Intake.patient_id).where(Intake.id == intake_id)
+    ).first()
+    if not row:
+        return None
+    return row.medications, row.current_medications, patient_service.load_profile(db, row.patient_id)
+
+
+def rescreen(
+    medications: str,
+    current_medications: Optional[str],
+    profile: List[patient_service.ProfileEntry],
+    intake_id: Optional[int] = None,
+) -> Tuple[List[dict], str]:
+    """Interactions and counseling points of a stored intake; no database access"""
+    interactions = check_drug_interactions(medications, current_medications)
+    interactions += patient_service.check_profile(medications, current_medications, profile, intake_id)
+    return interactions, generate_counseling_points(medications, interactions)
+
+
+def write_rescreen(db: Session, intake_id: int, interactions: List[dict], counseling_points: str) -> dict:
+    """Store a rescreen's results and drop the intake's queued screening"""
+    intake = _update_intake(
+        db,
+        Intake.id == intake_id,
+        drug_interactions=json.dumps(interactions) if interactions else None,
+        counseling_points=counseling_points,
+        screening_status="screened",
     )
-    
-    # Update interactions and counseling points
-    intake.drug_interactions = json.dumps(interactions) if interactions else None
-    intake.counseling_points = generate_counseling_points(intake.medications, interactions)
-    intake.updated_at = datetime.now(timezone.utc)
+    _write_interactions(db, {intake_id: interactions}, replace=True)
+    screening_queue.discard(db, [intake_id])
+    stats_service.record_change(db)
     db.commit()
-    db.refresh(intake)
+    _after_commit("screened", intake)
     
     return {
         "interactions": interactions,
-        "counseling_points": intake.counseling_points
+        "counseling_points": counseling_points
     }
 
 
+def backfill_interactions(db: Session, batch_size: int = 500) -> int:
+    """
+    Populate intake_interactions for intakes that only have the JSON column
+
+    Works through intakes in id order, batch_size at a time, committing each batch.
+    Returns the number of intakes backfilled.
+    """
+    mirrored = select(IntakeInteraction.intake_id).where(IntakeInteraction.intake_id == Intake.id).exists()
+    query = db.query(Intake.id, Intake.drug_interactions).filter(
+        Intake.drug_interactions.isnot(None), ~mirrored
+    )
+    backfilled = 0
+    last_id = 0
+    while True:
+        rows = query.filter(Intake.id > last_id).order_by(Intake.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        batch = {}
+        for row in rows:
+            try:
+                batch[row.id] = json.loads(row.drug_interactions)
+            except ValueError:
+                continue
+        _write_interactions(db, batch)
+        if batch:
+            # Severity filters and badges read the side table
+            stats_service.record_change(db)
+        db.commit()
+        backfilled += len(batch)
+    return backfilled
+
+
+def get_data_version(db: Session) -> int:
+    """Counter advanced by every write to intakes, for ETags"""
+    return stats_service.read_version(db)
+
+
+def ensure_statistics(db: Session):
+    """Seed the statistics counters if this database has never had them"""
+    stats_service.ensure_counters(db, ALLOWED_STATUSES)
+
+
+def max_severity(interactions: Optional[List[dict]]) -> Optional[str]:
+    """Most severe level in a list of interaction warnings"""
+    if not interactions:
+        return None
+    return min((i["severity"] for i in interactions), key=_severity_rank)
+
+
+def _severity_rank(severity: str) -> int:
+    return SEVERITIES.index(severity) if severity in SEVERITIES else len(SEVERITIES)
+
+
+def check_interactions_batch(
+    db: Session,
+    status: Optional[str] = None,
+    ids: Optional[List[int]] = None,
+    created_after: Optional[datetime] = None,
+    chunk_size: int = 500,
+) -> dict:
+    """
+    Re-screen every matching intake against the current interaction tables and its patient's profile
+
+    Intakes are streamed in id order, chunk_size at a time. Only intakes whose
+    interactions changed, or whose background screening is pending or failed,
+    are written, with one bulk UPDATE and one commit per chunk.
+    """
+    result = {"scanned": 0, "updated": 0, "severity_changed": []}
+    last_id = 0
+    while True:
+        rows, profiles = read_batch_chunk(db, status, ids, created_after, last_id, chunk_size)
+        if not rows:
+            break
+        last_id = rows[-1].id
+        changes = rescreen_chunk(rows, profiles)
+        write_batch_chunk(db, rows, changes)
+        add_batch_chunk(result, rows, changes)
+    return result
+
+
+class ChunkChanges(NamedTuple):
+    """What rescreen_chunk found for one chunk of check_interactions_batch"""
+    updates: List[dict]
+    interactions: dict
+    severity_changed: List[dict]
+
+
+def read_batch_chunk(
+    db: Session,
+    status: Optional[str],
+    ids: Optional[List[int]],
+    created_after: Optional[datetime],
+    after_id: int,
+    chunk_size: int,
+) -> Tuple[list, dict]:
+    """The next chunk_size matching intakes after after_id, in id order, and their patients' profiles"""
+    query = db.query(
+        Intake.id, Intake.medications, Intake.current_medications, Intake.drug_interactions, Intake.patient_id,
+        Intake.screening_status,
+    )
+    if status:
+        query = query.filter(Intake.status == status)
+    if ids is not None:
+        query = query.filter(Intake.id.in_(ids))
+    if created_after:
+        query = query.filter(Intake.created_at > created_after)
+    rows = query.filter(Intake.id > after_id).order_by(Intake.id).limit(chunk_size).all()
+    return rows, patient_service.load_profiles(db, {row.patient_id for row in rows})
+
+
+def rescreen_chunk(rows: list, profiles: dict) -> ChunkChanges:
+    """Screen a chunk read by read_batch_chunk and collect the changes; no database access"""
+    now = datetime.now(timezone.utc)
+    changes = ChunkChanges([], {}, [])
+    for row in rows:
+        interactions = check_drug_interactions(row.medications, row.current_medications)
+        if row.patient_id is not None:
+            interactions += patient_service.check_profile(
+                row.medications, row.current_medications, profiles[row.patient_id], row.id
+            )
+        interactions_json = json.dumps(interactions) if interactions else None
+        # Intakes still waiting for background screening are written even when nothing was found
+        if interactions_json == row.drug_interactions and row.screening_status == "screened":
+            continue
+        changes.updates.append({
+            "id": row.id,
+            "drug_interactions": interactions_json,
+            "counseling_points": generate_counseling_points(row.medications, interactions),
+            "screening_status": "screened",
+            "updated_at": now,
+        })
+        changes.interactions[row.id] = interactions
+        previous = max_severity(json.loads(row.drug_interactions)) if row.drug_interactions else None
+        current = max_severity(interactions)
+        if previous != current:
+            changes.severity_changed.append({"id": row.id, "previous_severity": previous, "severity": current})
+    return changes
+
+
+def write_batch_chunk(db: Session, rows: list, changes: ChunkChanges):
+    """Store one chunk's changes with one bulk UPDATE and one commit"""
+    if changes.updates:
+        db.execute(update(Intake), changes.updates)
+        _write_interactions(db, changes.interactions, replace=True)
+        screening_queue.discard(db, [row.id for row in rows if row.screening_status != "screened"])
+        stats_service.record_change(db)
+    db.commit()
+    if changes.updates:
+        _after_commit("screened_bulk", ids=[change["id"] for change in changes.updates])
+
+
+def add_batch_chunk(result: dict, rows: list, changes: ChunkChanges):
+    """Add one chunk to check_interactions_batch's running totals"""
+    result["scanned"] += len(rows)
+    result["updated"] += len(changes.updates)
+    result["severity_changed"].extend(changes.severity_changed)
+
+
 def get_statistics(db: Session) -> dict:
-    total = db.query(Intake).count()
-    by_status = {}
-    for status in ALLOWED_STATUSES:
-        count = db.query(Intake).filter(Intake.status == status).count()
-        by_status[status] = count
-    
-    # Count dispensed medications
-    dispensed_count = db.query(Intake).filter(Intake.dispensed == "yes").count()
-    
-    return {
-        "total": total,
-        "by_status": by_status,
-        "dispensed_count": dispensed_count
-    }
+    """Dashboard summary, read from the maintained counters in one query"""
+    stats = stats_service.read_statistics(db, ALLOWED_STATUSES)
+    if not stats["total"] and db.get(IntakeCounter, stats_service.TOTAL) is None:
+        # Counters were never seeded for this database
+        stats_service.rebuild_counters(db, ALLOWED_STATUSES)
+        stats = stats_service.read_statistics(db, ALLOWED_STATUSES)
+    return stats
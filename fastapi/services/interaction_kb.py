@@ -0,0 +1,275 @@
+"""
+Interaction Knowledge Base
+Compiled on-disk format for large interaction tables, opened read-only via mmap
+
+Layout (little endian), all sections 8-byte aligned:
+
+    header       magic, version, section counts and offsets
+    string index n_strings x (blob offset u32, byte length u32)
+    string blob  UTF-8 drug names and descriptions
+    drugs        n_drugs x (name string u32, pad, category bits u64), sorted by name;
+                 a drug's id is its position in this array
+    pairs        n_pairs x (key u64 = id1 << 32 | id2, severity u32, description string u32),
+                 sorted by key; both orders of every pair are stored
+    rules        n_rules x (category mask u64, severity u32, description string u32)
+
+Because the file is mapped rather than parsed, every worker process shares the
+same page-cache copy and opening it costs the same regardless of its size.
+"""
+import csv
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.drug_interaction_service import SEVERITIES, normalize_drug_name, parse_severity
+
+MAGIC = b"PHKB"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIIIII4xQQQQQ")
+STRING_REF = struct.Struct("<II")
+DRUG = struct.Struct("<I4xQ")
+PAIR = struct.Struct("<QII")
+RULE = struct.Struct("<QII")
+KEY = struct.Struct("<Q")
+
+MAX_CATEGORIES = 64
+
+
+class KnowledgeBaseError(ValueError):
+    """Raised when a knowledge base source or compiled file is malformed"""
+
+
+def load_source(path: str) -> Tuple[Dict[str, Dict[str, str]], Dict[str, List[str]], Dict[str, str]]:
+    """
+    Read an interaction source file
+
+    JSON sources look like {"interactions": ..., "categories": {...}, "category_interactions": {...}},
+    where interactions is either a list of {"drug1", "drug2", "description", "severity"?} records or
+    the nested {drug1: {drug2: description}} form used by DRUG_INTERACTIONS.
+    CSV sources have a drug1,drug2,description[,severity] header and carry pairs only.
+    """
+    interactions: Dict[str, Dict[str, str]] = {}
+
+    def add(drug1, drug2, description, severity=None):
+        if severity and not description.startswith(f"{severity}:"):
+            description = f"{severity}: {description}"
+        interactions.setdefault(normalize_drug_name(drug1), {})[normalize_drug_name(drug2)] = description
+
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                add(row["drug1"], row["drug2"], row["description"], row.get("severity"))
+        return interactions, {}, {}
+
+    with open(path, encoding="utf-8") as f:
+        source = json.load(f)
+    records = source.get("interactions", {})
+    if isinstance(records, dict):
+        for drug1, others in records.items():
+            for drug2, description in others.items():
+                add(drug1, drug2, description)
+    else:
+        for record in records:
+            add(record["drug1"], record["drug2"], record["description"], record.get("severity"))
+    return interactions, source.get("categories", {}), source.get("category_interactions", {})
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def compile_knowledge_base(interactions: Dict[str, Dict[str, str]], categories: Dict[str, List[str]],
+                           category_interactions: Dict[str, str], out_path: str) -> dict:
+    """Write the compiled file atomically so readers only ever see a complete one"""
+    if len(categories) > MAX_CATEGORIES:
+        raise KnowledgeBaseError(f"At most {MAX_CATEGORIES} categories are supported")
+
+    names = set()
+    for drug1, others in interactions.items():
+        names.add(normalize_drug_name(drug1))
+        names.update(normalize_drug_name(d) for d in others)
+    for drugs in categories.values():
+        names.update(normalize_drug_name(d) for d in drugs)
+    names = sorted(names, key=lambda n: n.encode("utf-8"))
+    ids = {name: i for i, name in enumerate(names)}
+
+    strings: List[bytes] = []
+    string_ids: Dict[str, int] = {}
+
+    def intern(text: str) -> int:
+        if text not in string_ids:
+            string_ids[text] = len(strings)
+            strings.append(text.encode("utf-8"))
+        return string_ids[text]
+
+    category_bits = {category: 1 << bit for bit, category in enumerate(categories)}
+    drug_bits = [0] * len(names)
+    for category, drugs in categories.items():
+        for drug in drugs:
+            drug_bits[ids[normalize_drug_name(drug)]] |= category_bits[category]
+    drug_records = [(intern(name), bits) for name, bits in zip(names, drug_bits)]
+
+    # Forward entries win over reverse ones, as in InteractionIndex
+    pairs: Dict[int, str] = {}
+    for drug1, others in interactions.items():
+        for drug2, description in others.items():
+            pairs[ids[normalize_drug_name(drug1)] << 32 | ids[normalize_drug_name(drug2)]] = description
+    for drug1, others in interactions.items():
+        for drug2, description in others.items():
+            pairs.setdefault(ids[normalize_drug_name(drug2)] << 32 | ids[normalize_drug_name(drug1)], description)
+    pair_records = [
+        (key, SEVERITIES.index(parse_severity(description)), intern(description))
+        for key, description in sorted(pairs.items())
+    ]
+
+    rule_records = [
+        (category_bits[category], SEVERITIES.index(parse_severity(description)), intern(description))
+        for category, description in category_interactions.items()
+        if category in category_bits
+    ]
+
+    blob = b"".join(strings)
+    string_index_off = _align(HEADER.size)
+    blob_off = string_index_off + STRING_REF.size * len(strings)
+    drugs_off = _align(blob_off + len(blob))
+    pairs_off = drugs_off + DRUG.size * len(drug_records)
+    rules_off = pairs_off + PAIR.size * len(pair_records)
+    total = rules_off + RULE.size * len(rule_records)
+
+    buf = bytearray(total)
+    HEADER.pack_into(buf, 0, MAGIC, VERSION, len(strings), len(drug_records), len(pair_records),
+                     len(rule_records), string_index_off, blob_off, drugs_off, pairs_off, rules_off)
+    position = 0
+    for i, data in enumerate(strings):
+        STRING_REF.pack_into(buf, string_index_off + i * STRING_REF.size, position, len(data))
+        position += len(data)
+    buf[blob_off:blob_off + len(blob)] = blob
+    for i, record in enumerate(drug_records):
+        DRUG.pack_into(buf, drugs_off + i * DRUG.size, *record)
+    for i, record in enumerate(pair_records):
+        PAIR.pack_into(buf, pairs_off + i * PAIR.size, *record)
+    for i, record in enumerate(rule_records):
+        RULE.pack_into(buf, rules_off + i * RULE.size, *record)
+
+    directory = os.path.dirname(os.path.abspath(out_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".kb-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    return {"drugs": len(drug_records), "pairs": len(pair_records), "rules": len(rule_records), "bytes": total}
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """Identity of the file currently at path, used to notice replacements"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class MappedInteractionIndex:
+    """
+    Read-only view over a compiled knowledge base
+
+    Offers the same lookup interface as drug_interaction_service.InteractionIndex.
+    Drug names are resolved by binary search over the sorted drug array and pairs
+    by binary search over the sorted 64-bit pair keys, straight out of the mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.signature = file_signature(path)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER.size:
+            raise KnowledgeBaseError(f"{path} is too small to be a knowledge base")
+        (magic, version, self._n_strings, self._n_drugs, self._n_pairs, self._n_rules,
+         self._string_index_off, self._blob_off, self._drugs_off, self._pairs_off,
+         self._rules_off) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise KnowledgeBaseError(f"{path} is not a version {VERSION} knowledge base")
+        self._rules = [RULE.unpack_from(self._mm, self._rules_off + i * RULE.size) for i in range(self._n_rules)]
+
+    def _string(self, string_id: int) -> str:
+        offset, length = STRING_REF.unpack_from(self._mm, self._string_index_off + string_id * STRING_REF.size)
+        start = self._blob_off + offset
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _drug_name_bytes(self, drug_id: int) -> bytes:
+        string_id, _ = DRUG.unpack_from(self._mm, self._drugs_off + drug_id * DRUG.size)
+        offset, length = STRING_REF.unpack_from(self._mm, self._string_index_off + string_id * STRING_REF.size)
+        start = self._blob_off + offset
+        return self._mm[start:start + length]
+
+    def _category_bits(self, drug_id: int) -> int:
+        return DRUG.unpack_from(self._mm, self._drugs_off + drug_id * DRUG.size)[1]
+
+    def __len__(self) -> int:
+        return self._n_pairs
+
+    def drug_names(self) -> Iterable[str]:
+        for drug_id in range(self._n_drugs):
+            yield self._drug_name_bytes(drug_id).decode("utf-8")
+
+    def drug_id(self, drug: str) -> Optional[int]:
+        """Interned id for a normalized drug name, or None if it is not in the file"""
+        target = drug.encode("utf-8")
+        lo, hi = 0, self._n_drugs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self._drug_name_bytes(mid)
+            if name < target:
+                lo = mid + 1
+            elif name > target:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def lookup_ids(self, id1: int, id2: int) -> Optional[Tuple[str, str]]:
+        """(severity, description) for two interned drugs, or None"""
+        if id1 == id2:
+            return None
+        key = id1 << 32 | id2
+        lo, hi = 0, self._n_pairs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = KEY.unpack_from(self._mm, self._pairs_off + mid * PAIR.size)[0]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                _, severity, description = PAIR.unpack_from(self._mm, self._pairs_off + mid * PAIR.size)
+                return SEVERITIES[severity], self._string(description)
+
+        shared = self._category_bits(id1) & self._category_bits(id2)
+        if shared:
+            for mask, severity, description in self._rules:
+                if shared & mask:
+                    return SEVERITIES[severity], self._string(description)
+        return None
+
+    def lookup(self, drug1: str, drug2: str) -> Optional[Tuple[str, str]]:
+        """(severity, description) for two normalized drug names, or None"""
+        id1 = self.drug_id(drug1)
+        if id1 is None:
+            return None
+        id2 = self.drug_id(drug2)
+        if id2 is None:
+            return None
+        return self.lookup_ids(id1, id2)
@@ -0,0 +1,152 @@
+"""
+Medication Parser
+Tokenizes free-text medication lists into structured (drug, dose, frequency) entries
+"""
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+import re
+
+# Medication lists are separated by comma, semicolon, or newline
+MEDICATION_SEPARATORS = re.compile(r"[,;\n]")
+
+DOSE_PATTERN = re.compile(
+    r"\b\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|units?|iu|%)(?![a-z])"
+)
+FREQUENCY_PATTERN = re.compile(
+    r"\b(?:(?:once|twice|three times|four times)(?:\s+a)?\s+(?:day|daily|week|weekly)"
+    r"|every\s+\d+\s+hours?|q\d+h|as needed|at bedtime"
+    r"|daily|weekly|nightly|bid|tid|qid|qd|qhs|qam|qpm|prn)\b"
+)
+WHITESPACE = re.compile(r"\s+")
+
+
+class MedicationToken(NamedTuple):
+    drug: str
+    dose: Optional[str] = None
+    frequency: Optional[str] = None
+
+
+class AhoCorasick:
+    """
+    Multi-pattern string matcher
+
+    Builds a trie of all patterns with failure links once; scanning a text is then
+    linear in its length no matter how many patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[str, ...]] = [()]
+
+        for pattern in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            if pattern not in self._out[state]:
+                self._out[state] += (pattern,)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, pattern) for every occurrence of every pattern"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern in out[state]:
+                yield i + 1 - len(pattern), i + 1, pattern
+
+
+def _is_word_boundary(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+class MedicationMatcher:
+    """Finds known drug and drug-class names in medication text, on word boundaries only"""
+
+    def __init__(self, vocabulary: Iterable[str]):
+        self._automaton = AhoCorasick({term.lower().strip() for term in vocabulary})
+
+    def find_terms(self, text: str) -> List[Tuple[int, int, str]]:
+        """Whole-word matches in text (already lower-cased), leftmost-longest and non-overlapping"""
+        matches = sorted(
+            (m for m in self._automaton.iter_matches(text) if _is_word_boundary(text, m[0], m[1])),
+            key=lambda m: (m[0], -m[1]),
+        )
+        selected = []
+        last_end = 0
+        for start, end, term in matches:
+            if start >= last_end:
+                selected.append((start, end, term))
+                last_end = end
+        return selected
+
+    def find_substrings(self, text: str, whole_word_below: int = 0) -> Set[str]:
+        """
+        Terms occurring anywhere in text (already lower-cased), also inside longer words
+
+        Terms shorter than whole_word_below characters only count as whole words,
+        since short names turn up inside unrelated ones.
+        """
+        return {
+            term for start, end, term in self._automaton.iter_matches(text)
+            if len(term) >= whole_word_below or _is_word_boundary(text, start, end)
+        }
+
+    def tokenize(self, medications: Optional[str]) -> List[MedicationToken]:
+        """
+        Split a medication list into tokens
+
+        Each entry gives one token per known name found in it, so "aspirin and
+        warfarin" yields two; a dose or frequency belongs to the name it follows.
+        Entries with no known name keep their text with the dose and frequency
+        removed.
+        """
+        tokens = []
+        if not medications:
+            return tokens
+        for entry in MEDICATION_SEPARATORS.split(medications.lower()):
+            entry = WHITESPACE.sub(" ", entry).strip()
+            if not entry:
+                continue
+            terms = self.find_terms(entry)
+            if not terms:
+                drug = WHITESPACE.sub(" ", FREQUENCY_PATTERN.sub(" ", DOSE_PATTERN.sub(" ", entry))).strip() or entry
+                tokens.append(_token(drug, entry))
+                continue
+            # Each name owns the text up to the next one; the first also owns what precedes it
+            bounds = [0] + [start for start, _, _ in terms[1:]] + [len(entry)]
+            for i, (_, _, term) in enumerate(terms):
+                tokens.append(_token(term, entry[bounds[i]:bounds[i + 1]]))
+        return tokens
+
+
+def _token(drug: str, text: str) -> MedicationToken:
+    dose = DOSE_PATTERN.search(text)
+    frequency = FREQUENCY_PATTERN.search(text)
+    return MedicationToken(
+        drug=drug,
+        dose=dose.group(0) if dose else None,
+        frequency=frequency.group(0) if frequency else None,
+    )
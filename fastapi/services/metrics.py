@@ -0,0 +1,296 @@
+"""
+Metrics
+Request latency, per-request database work and stage timings, in Prometheus text format
+
+MetricsMiddleware times every request and, through SQLAlchemy cursor events,
+counts the queries it ran and the time spent in them. Code paths mark their own
+stages with `with metrics.stage("name"):`. Everything is exposed by render() at
+GET /metrics.
+
+With PROFILE_SLOW_REQUEST_MS set, a sampling profiler records the stacks of all
+threads, and the samples taken during any slower request are written to
+PROFILE_DIR in collapsed-stack format (flamegraph.pl, speedscope, inferno).
+Samples cover everything the process did in that window, including concurrent
+requests.
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+import bisect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this have their profile samples dumped; 0 disables the profiler
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Seconds of samples kept in memory
+PROFILE_WINDOW_SECONDS = float(os.getenv("PROFILE_WINDOW_SECONDS", "60"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label combination"""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (plus +Inf), then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in sorted(self._series.items())]
+        for labels, series in snapshot:
+            pairs = list(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(pairs + [('le', _format_number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(pairs)} {series[-1]!r}"
+            yield f"{self.name}_count{_format_labels(pairs)} {cumulative}"
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from request start to the end of the response body",
+    ("method", "route", "status"), LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request", ("route",), QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Time per request spent executing SQL statements", ("route",), LATENCY_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds", "Time spent in instrumented stages of request handling", ("stage",), LATENCY_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_TIME, STAGE_DURATION)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(line for histogram in HISTOGRAMS for line in histogram.render()) + "\n"
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Database work of the request being handled; None outside requests
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+# Registered on the Engine class so both the sync engine and the async engine's
+# underlying sync engine are covered
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats.get() is not None:
+        conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats.get()
+    started = conn.info.pop("query_started", None)
+    if stats is not None and started is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of request handling"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, name)
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency and database work per route
+
+    Written against ASGI directly rather than BaseHTTPMiddleware so streamed
+    request and response bodies pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = "500"
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                streaming = (b"content-type", b"text/event-stream") in (
+                    (name.lower(), value.split(b";")[0]) for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            route = _route_label(scope)
+            REQUEST_DURATION.observe(elapsed, scope["method"], route, status)
+            REQUEST_QUERIES.observe(stats.queries, route)
+            REQUEST_DB_TIME.observe(stats.db_seconds, route)
+            # Event streams are long by design
+            if profiler.running and not streaming and elapsed * 1000 >= PROFILE_SLOW_REQUEST_MS:
+                profiler.dump_window(started_at, started_at + elapsed, f"{scope['method']} {route}")
+
+
+class SamplingProfiler:
+    """Samples every thread's stack on a timer and keeps the last few seconds of samples"""
+
+    def __init__(self, interval: float, window: float):
+        self.interval = interval
+        self._samples = deque(maxlen=max(1, int(window / interval)))
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.time()
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stacks.append(tuple(reversed(stack)))
+            self._samples.append((now, stacks))
+
+    def collapsed(self, start: float, end: float) -> Dict[str, int]:
+        """Samples taken between start and end as collapsed stacks ("a;b;c" -> count)"""
+        counts: Dict[str, int] = {}
+        for taken_at, stacks in list(self._samples):
+            if start <= taken_at <= end:
+                for stack in stacks:
+                    key = ";".join(f"{name} ({os.path.basename(path)}:{line})" for name, path, line in stack)
+                    counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def dump_window(self, start: float, end: float, label: str) -> Optional[str]:
+        """Write the samples of a time window to PROFILE_DIR; returns the file path"""
+        counts = self.collapsed(start, end)
+        if not counts:
+            return None
+        name = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(start))}-"
+                                         f"{int((end - start) * 1000)}ms-{name}.folded")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in sorted(counts.items()):
+                    f.write(f"{stack} {count}\n")
+        except OSError:
+            logger.exception("Could not write profile %s", path)
+            return None
+        logger.warning("Slow request %s took %.0f ms; profile written to %s", label, (end - start) * 1000, path)
+        return path
+
+
+profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000, PROFILE_WINDOW_SECONDS)
+
+
+def start_profiler():
+    """Start sampling when PROFILE_SLOW_REQUEST_MS is set (called on application startup)"""
+    if PROFILE_SLOW_REQUEST_MS > 0:
+        profiler.start()
+
+
+def stop_profiler():
+    profiler.stop()
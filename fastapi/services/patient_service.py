@@ -0,0 +1,473 @@
+"""
+Patient Service
+Patients across intakes and their materialized medication profiles
+
+An intake is linked to a patient explicitly, by patient_id, or matched on
+the normalized patient name together with the date of birth; a name alone is
+not enough, since different patients share names. Intakes with neither have
+no patient and are screened on their own.
+
+A patient's profile is their patient_medications rows: the current
+medications listed on their latest intake that listed any ("reported"), and
+the medications prescribed on each of their intakes ("pending" until
+dispensed, then "dispensed"). intake_service keeps the rows in step as intakes
+are created, dispensed, completed and archived, so screening a new intake
+against everything else the patient takes reads already-parsed drug names
+instead of every earlier intake's text, and the (drug, patient_id) index
+answers drug recalls.
+
+Screening only counts active rows: rows of archived intakes, and pending rows
+of intakes completed without being dispensed, are retired, and pending rows
+older than PROFILE_PENDING_DAYS are ignored. Recalls still see them all.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import base64
+import json
+import os
+
+from sqlalchemy import and_, bindparam, delete, func, insert, literal, or_, select, union_all, update
+from sqlalchemy.orm import Session
+
+from database import Intake, IntakeArchive, Patient, PatientMedication
+from services import stats_service
+from services.drug_interaction_service import check_profile_interactions, medication_drugs, normalize_drug_name
+
+PROFILE_STATES = ("reported", "pending", "dispensed")
+
+# Prescriptions not dispensed within this many days stop counting for screening
+PROFILE_PENDING_DAYS = float(os.getenv("PROFILE_PENDING_DAYS", "30"))
+
+RECALL_PAGE_SIZE = 100
+MAX_RECALL_PAGE_SIZE = 1000
+
+# One drug on a profile: (drug, intake_id, state)
+ProfileEntry = Tuple[str, int, str]
+# Who an intake is for: (patient_id, patient_name, date_of_birth, allergies)
+PatientRef = Tuple[Optional[int], str, Optional[date], Optional[str]]
+
+
+class StoredPatient(NamedTuple):
+    """A patient as read before creating an intake for them; id is None for a new patient"""
+    id: Optional[int]
+    allergies: Optional[str]
+    profile: List[ProfileEntry]
+
+
+def patient_key(name: Optional[str], date_of_birth: Optional[date]) -> Optional[str]:
+    """
+    The key patients are matched on: the name lower-cased with whitespace
+    collapsed, plus the date of birth (None unless both are given)
+    """
+    name = " ".join((name or "").lower().split())
+    if not name or date_of_birth is None:
+        return None
+    return f"{name}|{date_of_birth.isoformat()}"
+
+
+def resolve_patients(db: Session, intakes: Sequence[PatientRef]) -> List[Optional[int]]:
+    """
+    Patient ids for (patient_id, patient_name, date_of_birth, allergies) tuples, creating patients not seen before
+
+    A given patient_id must exist (ValueError otherwise). The rest are matched
+    on name and date of birth with one upsert; those without a date of birth
+    get no patient. A non-empty allergies value replaces the one stored for the
+    patient, later tuples winning.
+    """
+    now = datetime.now(timezone.utc)
+    linked = {patient_id for patient_id, _, _, _ in intakes if patient_id is not None}
+    if linked:
+        unknown = linked - set(db.scalars(select(Patient.id).where(Patient.id.in_(linked))))
+        if unknown:
+            raise ValueError(f"Unknown patient id {min(unknown)}")
+    rows: Dict[str, dict] = {}
+    allergies_by_id: Dict[int, str] = {}
+    for patient_id, name, date_of_birth, allergies in intakes:
+        if patient_id is not None:
+            if allergies:
+                allergies_by_id[patient_id] = allergies
+            continue
+        key = patient_key(name, date_of_birth)
+        if key is None:
+            continue
+        row = rows.get(key)
+        if row is None:
+            rows[key] = {
+                "name_key": key, "name": name.strip(), "date_of_birth": date_of_birth,
+                "allergies": allergies or None, "created_at": now, "updated_at": now,
+            }
+        elif allergies:
+            row["allergies"] = allergies
+    if allergies_by_id:
+        db.execute(update(Patient), [
+            {"id": patient_id, "allergies": allergies, "updated_at": now}
+            for patient_id, allergies in allergies_by_id.items()
+        ])
+    ids = _upsert_patients(db, list(rows.values())) if rows else {}
+    return [
+        patient_id if patient_id is not None else ids.get(patient_key(name, date_of_birth))
+        for patient_id, name, date_of_birth, _ in intakes
+    ]
+
+
+def _upsert_patients(db: Session, rows: List[dict]) -> Dict[str, int]:
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        ids = {}
+        for row in rows:
+            patient = db.scalars(select(Patient).where(Patient.name_key == row["name_key"])).first()
+            if patient is None:
+                patient = Patient(**row)
+                db.add(patient)
+                db.flush()
+            elif row["allergies"]:
+                patient.allergies = row["allergies"]
+            ids[row["name_key"]] = patient.id
+        return ids
+
+    # Core executemany, which SQLAlchemy batches into multi-row statements far
+    # faster than it compiles one large VALUES list (the ORM bulk path would
+    # run an upsert with RETURNING row by row)
+    patients = Patient.__table__
+    stmt = upsert(patients)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[patients.c.name_key],
+        set_={
+            "allergies": func.coalesce(stmt.excluded.allergies, patients.c.allergies),
+            "updated_at": stmt.excluded.updated_at,
+        },
+    ).returning(patients.c.id, patients.c.name_key)
+    return {key: patient_id for patient_id, key in db.execute(stmt, rows)}
+
+
+def _screened():
+    """Profile rows screening counts: not retired, and not a prescription left undispensed too long"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=PROFILE_PENDING_DAYS)
+    return and_(
+        PatientMedication.retired_at.is_(None),
+        or_(PatientMedication.state != "pending", PatientMedication.recorded_at >= cutoff),
+    )
+
+
+def load_profiles(db: Session, patient_ids: Iterable[Optional[int]]) -> Dict[int, List[ProfileEntry]]:
+    """Screened profile entries of each patient, read in one query"""
+    profiles: Dict[int, List[ProfileEntry]] = {
+        patient_id: [] for patient_id in patient_ids if patient_id is not None
+    }
+    if profiles:
+        rows = db.execute(
+            select(
+                PatientMedication.patient_id, PatientMedication.drug,
+                PatientMedication.intake_id, PatientMedication.state,
+            ).where(PatientMedication.patient_id.in_(list(profiles)), _screened())
+        )
+        for patient_id, drug, intake_id, state in rows:
+            profiles[patient_id].append((drug, intake_id, state))
+    return profiles
+
+
+def load_profile(db: Session, patient_id: Optional[int]) -> List[ProfileEntry]:
+    return load_profiles(db, [patient_id]).get(patient_id, [])
+
+
+def find_patient(
+    db: Session, patient_id: Optional[int], patient_name: str, date_of_birth: Optional[date]
+) -> StoredPatient:
+    """
+    The intake's patient and their screened profile, in one read that takes no write lock
+
+    Raises ValueError for an unknown patient_id.
+    """
+    if patient_id is not None:
+        match = Patient.id == patient_id
+    else:
+        key = patient_key(patient_name, date_of_birth)
+        if key is None:
+            return StoredPatient(None, None, [])
+        match = Patient.name_key == key
+    rows = db.execute(
+        select(Patient.id, Patient.allergies, PatientMedication.drug, PatientMedication.intake_id, PatientMedication.state)
+        .outerjoin(PatientMedication, and_(PatientMedication.patient_id == Patient.id, _screened()))
+        .where(match)
+    ).all()
+    if not rows:
+        if patient_id is not None:
+            raise ValueError(f"Unknown patient id {patient_id}")
+        return StoredPatient(None, None, [])
+    profile = [(row.drug, row.intake_id, row.state) for row in rows if row.drug is not None]
+    return StoredPatient(rows[0].id, rows[0].allergies, profile)
+
+
+def ensure_patient(
+    db: Session, stored: StoredPatient, patient_name: str, date_of_birth: Optional[date], allergies: Optional[str]
+) -> Optional[int]:
+    """The id of a patient read by find_patient, writing only when new or their allergies changed"""
+    if stored.id is not None and (not allergies or allergies == stored.allergies):
+        return stored.id
+    (patient_id,) = resolve_patients(db, [(stored.id, patient_name, date_of_birth, allergies)])
+    return patient_id
+
+
+def intake_entries(
+    intake_id: int, medications: str, current_medications: Optional[str], dispensed: bool = False
+) -> List[ProfileEntry]:
+    """What an intake adds to its patient's profile"""
+    state = "dispensed" if dispensed else "pending"
+    entries = [(drug, intake_id, state) for drug in dict.fromkeys(medication_drugs(medications))]
+    entries.extend((drug, intake_id, "reported") for drug in dict.fromkeys(medication_drugs(current_medications)))
+    return entries
+
+
+def add_to_profile(profile: List[ProfileEntry], entries: List[ProfileEntry]) -> List[ProfileEntry]:
+    """profile with an intake's entries added; its reported medications replace those reported before"""
+    if any(state == "reported" for _, _, state in entries):
+        profile = [entry for entry in profile if entry[2] != "reported"]
+    return profile + entries
+
+
+def check_profile(
+    medications: str,
+    current_medications: Optional[str],
+    profile: Sequence[ProfileEntry],
+    intake_id: Optional[int] = None,
+) -> List[dict]:
+    """
+    Interactions between an intake's medications and the rest of its patient's profile
+
+    Drugs the intake lists itself are left to check_drug_interactions, as are
+    the patient's reported medications when the intake lists current ones.
+    """
+    if not profile:
+        return []
+    own = set(medication_drugs(medications))
+    current = set(medication_drugs(current_medications))
+    others: Dict[str, int] = {}
+    for drug, source_id, state in profile:
+        if source_id == intake_id or drug in own or drug in current or (current and state == "reported"):
+            continue
+        others.setdefault(drug, source_id)
+    return check_profile_interactions(medications, others) if others else []
+
+
+def record_intakes(db: Session, intakes: Sequence[Tuple[Optional[int], List[ProfileEntry], datetime]]):
+    """
+    Add intakes' entries to their patients' profiles, in intake order
+
+    intakes holds (patient_id, intake_entries(...), created_at) triples. The last intake of
+    each patient that reports current medications replaces the reported rows
+    stored for that patient. The replacement is decided by the DELETE itself,
+    inside the caller's write transaction, so concurrent intakes of one patient
+    cannot both keep their reported rows.
+    """
+    rows = []
+    reported: Dict[int, List[dict]] = {}
+    for patient_id, entries, recorded_at in intakes:
+        if patient_id is None:
+            continue
+        intake_reported = []
+        for drug, intake_id, state in entries:
+            row = {
+                "patient_id": patient_id, "intake_id": intake_id, "drug": drug, "state": state,
+                "recorded_at": recorded_at, "retired_at": None,
+            }
+            (intake_reported if state == "reported" else rows).append(row)
+        if intake_reported:
+            reported[patient_id] = intake_reported
+    if reported:
+        db.execute(delete(PatientMedication).where(
+            PatientMedication.state == "reported", PatientMedication.patient_id.in_(list(reported))
+        ))
+        rows.extend(row for patient_rows in reported.values() for row in patient_rows)
+    if rows:
+        # Core insert: these rows are never loaded as objects, and it is twice as fast as the ORM bulk path
+        db.execute(insert(PatientMedication.__table__), rows)
+
+
+def mark_dispensed(db: Session, intake_id: int, dispensed: bool):
+    """Move an intake's prescribed drugs between pending and dispensed"""
+    old, new = ("pending", "dispensed") if dispensed else ("dispensed", "pending")
+    db.execute(
+        update(PatientMedication)
+        .where(PatientMedication.intake_id == intake_id, PatientMedication.state == old)
+        .values(state=new)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def retire_intakes(db: Session, intake_ids: List[int], pending_only: bool = False):
+    """
+    Stop screening against intakes' profile rows, e.g. when they are archived
+
+    pending_only retires just the prescriptions never dispensed, for intakes
+    completed without dispensing.
+    """
+    if not intake_ids:
+        return
+    matches = and_(PatientMedication.intake_id.in_(intake_ids), PatientMedication.retired_at.is_(None))
+    if pending_only:
+        matches = and_(matches, PatientMedication.state == "pending")
+    db.execute(
+        update(PatientMedication)
+        .where(matches)
+        .values(retired_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def get_patient(db: Session, patient_id: int) -> Optional[dict]:
+    """A patient with their medication profile and intake ids (newest first)"""
+    patient = db.get(Patient, patient_id)
+    if patient is None:
+        return None
+    medications = db.execute(
+        select(
+            PatientMedication.drug, PatientMedication.state, PatientMedication.intake_id,
+            PatientMedication.retired_at.isnot(None).label("retired"),
+        )
+        .where(PatientMedication.patient_id == patient_id)
+        .order_by(PatientMedication.drug, PatientMedication.intake_id)
+    ).all()
+    # Archived intakes are part of the patient's history too
+    every_intake = union_all(
+        select(Intake.id).where(Intake.patient_id == patient_id),
+        select(IntakeArchive.id).where(IntakeArchive.patient_id == patient_id),
+    ).subquery()
+    intake_ids = db.scalars(select(every_intake.c.id).order_by(every_intake.c.id.desc())).all()
+    return {
+        "id": patient.id,
+        "name": patient.name,
+        "date_of_birth": patient.date_of_birth,
+        "allergies": patient.allergies,
+        "created_at": patient.created_at,
+        "updated_at": patient.updated_at,
+        "medications": [row._asdict() for row in medications],
+        "intake_ids": list(intake_ids),
+    }
+
+
+def encode_patient_cursor(patient_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": patient_id}).encode()).decode().rstrip("=")
+
+
+def decode_patient_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["after"])
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def patients_on_drug(
+    db: Session,
+    drug: str,
+    state: Optional[str] = None,
+    limit: int = RECALL_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[list, Optional[str]]:
+    """
+    One page of patients with drug on their profile, in patient id order, plus the next cursor
+
+    Each patient comes with the intakes that put the drug there and their
+    states. state restricts the page to one of PROFILE_STATES.
+    """
+    if state is not None and state not in PROFILE_STATES:
+        raise ValueError(f"Unknown state '{state}'. Allowed states: {list(PROFILE_STATES)}")
+    limit = max(1, min(limit, MAX_RECALL_PAGE_SIZE))
+    after = decode_patient_cursor(cursor) if cursor else 0
+    drug = normalize_drug_name(drug)
+
+    matches = PatientMedication.drug == drug
+    if state:
+        matches = matches & (PatientMedication.state == state)
+    # Served from the (drug, patient_id, state) index alone
+    patient_ids = db.scalars(
+        select(PatientMedication.patient_id)
+        .where(matches, PatientMedication.patient_id > after)
+        .distinct()
+        .order_by(PatientMedication.patient_id)
+        .limit(limit + 1)
+    ).all()
+    next_cursor = None
+    if len(patient_ids) > limit:
+        patient_ids = patient_ids[:limit]
+        next_cursor = encode_patient_cursor(patient_ids[-1])
+    if not patient_ids:
+        return [], None
+
+    items = {
+        patient.id: {"id": patient.id, "name": patient.name, "allergies": patient.allergies, "intakes": []}
+        for patient in db.scalars(select(Patient).where(Patient.id.in_(patient_ids)))
+    }
+    sources = db.execute(
+        select(PatientMedication.patient_id, PatientMedication.intake_id, PatientMedication.state)
+        .where(matches, PatientMedication.patient_id.in_(patient_ids))
+        .order_by(PatientMedication.intake_id)
+    )
+    for patient_id, intake_id, source_state in sources:
+        items[patient_id]["intakes"].append({"intake_id": intake_id, "state": source_state})
+    return [items[patient_id] for patient_id in patient_ids], next_cursor
+
+
+def rebuild_profiles(db: Session, batch_size: int = 1000) -> int:
+    """
+    Re-derive all profiles from every intake, archived or not, in intake id order
+
+    Intakes already linked to a patient keep the link; unlinked ones with a
+    date of birth are matched on name and date of birth. Commits once per
+    batch; returns the number of intakes processed.
+    """
+    db.execute(delete(PatientMedication))
+    # Assigning updated_at to itself keeps its onupdate default from firing
+    links = {
+        archived: (
+            update(table)
+            .where(table.c.id == bindparam("intake_id"))
+            .values(patient_id=bindparam("linked_patient_id"), updated_at=table.c.updated_at)
+        )
+        for archived, table in ((False, Intake.__table__), (True, IntakeArchive.__table__))
+    }
+    columns = (
+        "id", "patient_id", "patient_name", "patient_date_of_birth", "patient_allergies",
+        "medications", "current_medications", "dispensed", "status", "created_at",
+    )
+    every_intake = union_all(
+        select(*(getattr(Intake, name) for name in columns), literal(False).label("archived")),
+        select(*(getattr(IntakeArchive, name) for name in columns), literal(True).label("archived")),
+    ).subquery()
+    processed = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(every_intake).where(every_intake.c.id > last_id).order_by(every_intake.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        patient_ids = resolve_patients(db, [
+            (row.patient_id, row.patient_name, row.patient_date_of_birth, row.patient_allergies) for row in rows
+        ])
+        for archived, link in links.items():
+            params = [
+                {"intake_id": row.id, "linked_patient_id": patient_id}
+                for row, patient_id in zip(rows, patient_ids)
+                if bool(row.archived) == archived and patient_id != row.patient_id
+            ]
+            if params:
+                db.execute(link, params)
+        record_intakes(db, [
+            (patient_id, intake_entries(row.id, row.medications, row.current_medications, row.dispensed == "yes"),
+             row.created_at)
+            for row, patient_id in zip(rows, patient_ids)
+        ])
+        retire_intakes(db, [row.id for row in rows if row.archived])
+        retire_intakes(db, [row.id for row in rows if not row.archived and row.status == "completed"], pending_only=True)
+        # Intakes now carry their patient_id
+        stats_service.record_change(db)
+        db.commit()
+        processed += len(rows)
+    db.commit()
+    return processed
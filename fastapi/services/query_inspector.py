@@ -0,0 +1,204 @@
+"""
+Query Inspector
+Development and test aid that watches the SQL each request runs
+
+With QUERY_INSPECTOR=1, QueryInspectorMiddleware records every statement a
+request executes. It logs a warning when the same statement shape runs
+N_PLUS_ONE_THRESHOLD or more times (the signature of an N+1 loop), and sends
+the statement count in an X-Query-Count response header. Independently of the
+middleware, any statement slower than SLOW_QUERY_MS is logged together with its
+query plan while something is recording.
+
+In tests, capture_queries() records everything the process runs, whichever
+thread runs it (TestClient serves the app from its own thread), and
+query_budget() fails a block that runs more statements than allowed. The
+query_budget fixture in tests/conftest.py hands it to tests:
+
+    def test_list_stays_cheap(client, query_budget):
+        with query_budget(2):
+            client.get("/intakes")
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+QUERY_INSPECTOR = os.getenv("QUERY_INSPECTOR", "0").lower() in ("1", "true", "yes")
+# Statements slower than this are logged with their query plan
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# A statement shape repeated this many times in one request is reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "3"))
+
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)"
+_EXPANDED_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Statement text with literals and expanded IN lists collapsed, so repeats compare equal"""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _EXPANDED_LIST.sub("(?...)", shape)
+    shape = _STRING_LITERAL.sub("'?'", shape)
+    return _NUMBER_LITERAL.sub("?", shape)
+
+
+class QueryLog:
+    """Statements executed while the log was active, with their durations in seconds"""
+
+    def __init__(self):
+        self.queries: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, statement: str, duration: float):
+        with self._lock:
+            self.queries.append((statement, duration))
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    def repeated_shapes(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        """Shapes run at least threshold times, with their counts"""
+        counts: Dict[str, int] = {}
+        for statement, _ in self.queries:
+            shape = statement_shape(statement)
+            counts[shape] = counts.get(shape, 0) + 1
+        return {shape: count for shape, count in counts.items() if count >= threshold}
+
+    def report(self) -> str:
+        lines = [f"{self.count} statements:"]
+        lines.extend(f"  {duration * 1000:8.2f} ms  {_WHITESPACE.sub(' ', statement)}" for statement, duration in self.queries)
+        return "\n".join(lines)
+
+
+# Log of the request being handled by QueryInspectorMiddleware
+_request_log: ContextVar[Optional[QueryLog]] = ContextVar("query_log", default=None)
+# Process-wide logs opened by capture_queries()
+_capture_logs: List[QueryLog] = []
+_capture_lock = threading.Lock()
+_installed = threading.Event()
+
+
+def _active_logs() -> List[QueryLog]:
+    logs = list(_capture_logs)
+    request_log = _request_log.get()
+    if request_log is not None:
+        logs.append(request_log)
+    return logs
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    """The query plan of a statement, run on the same connection without going through SQLAlchemy"""
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join("  " + " | ".join(str(value) for value in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _capture_logs or _request_log.get() is not None:
+        conn.info["inspector_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("inspector_started", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    for log in _active_logs():
+        log.add(statement, duration)
+    if duration * 1000 >= SLOW_QUERY_MS:
+        plan = "  (not available for executemany)"
+        if not executemany:
+            try:
+                plan = _explain(conn, statement, parameters)
+            except Exception as e:
+                plan = f"  (EXPLAIN failed: {e})"
+        logger.warning("Slow query (%.1f ms): %s\n%s", duration * 1000, _WHITESPACE.sub(" ", statement), plan)
+
+
+def install():
+    """Register the cursor listeners (idempotent; done on first use)"""
+    if not _installed.is_set():
+        with _capture_lock:
+            if not _installed.is_set():
+                event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+                event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+                _installed.set()
+
+
+@contextmanager
+def capture_queries() -> Iterator[QueryLog]:
+    """Record every statement the process executes inside the block"""
+    install()
+    log = QueryLog()
+    with _capture_lock:
+        _capture_logs.append(log)
+    try:
+        yield log
+    finally:
+        with _capture_lock:
+            _capture_logs.remove(log)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(limit: int) -> Iterator[QueryLog]:
+    """Fail with QueryBudgetExceeded if the block executes more than limit statements"""
+    with capture_queries() as log:
+        yield log
+    if log.count > limit:
+        raise QueryBudgetExceeded(f"Query budget of {limit} exceeded; {log.report()}")
+
+
+class QueryInspectorMiddleware:
+    """Pure ASGI middleware reporting each request's statement count and repeated statement shapes"""
+
+    def __init__(self, app, threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.app = app
+        self.threshold = threshold
+        install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        log = QueryLog()
+        token = _request_log.set(log)
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-query-count", str(log.count).encode("ascii")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            _request_log.reset(token)
+            repeated = log.repeated_shapes(self.threshold)
+            if repeated:
+                details = "\n".join(f"  {count}x {shape}" for shape, count in repeated.items())
+                logger.warning(
+                    "Possible N+1 in %s %s (%d statements); repeated statements:\n%s",
+                    scope["method"], scope["path"], log.count, details,
+                )
+
@@ -0,0 +1,42 @@
+"""
+Response Cache
+ETag helpers and the in-process cache of serialized intake list pages
+
+List pages are cached under their query parameters and the data version
+(stats_service.VERSION), so a write from any worker makes older entries
+unreachable; intake_service also clears the cache after each commit so they
+do not linger.
+"""
+from typing import Hashable, Optional
+import hashlib
+import os
+
+from services.screening_cache import LRUCache
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+# Clients may keep responses but must revalidate them with If-None-Match
+CACHE_CONTROL = "private, no-cache"
+
+list_responses = LRUCache("intake_list_responses", RESPONSE_CACHE_SIZE)
+
+
+def make_etag(*parts: Hashable) -> str:
+    """Strong ETag identifying a representation built from parts"""
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value covers etag (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def invalidate():
+    """Drop every cached list page (called by intake_service after each commit)"""
+    list_responses.clear()
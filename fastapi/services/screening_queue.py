@@ -0,0 +1,215 @@
+"""
+Screening Queue
+Durable queue of intakes waiting for background interaction screening
+
+With SCREENING_MODE=background, create_intake stores the intake with a
+screening_status of "pending" and a screening_jobs row in the same transaction,
+and returns without screening. The screening worker (services/screening_worker.py)
+leases jobs in batches, screens them in a process pool and writes the results
+back. A worker that dies mid-batch leaves its jobs leased; once the lease
+expires any worker claims them again, and a job already claimed
+SCREENING_MAX_ATTEMPTS times is marked failed instead, so an intake that
+crashes the screener cannot loop forever. The queue is a table in the
+application database, so no broker is needed, and it survives restarts.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional
+import os
+
+from sqlalchemy import and_, delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from database import ScreeningJob
+
+SCREENING_MODES = ("inline", "background")
+SCREENING_MODE = os.getenv("SCREENING_MODE", "inline")
+if SCREENING_MODE not in SCREENING_MODES:
+    raise ValueError(f"SCREENING_MODE must be one of {', '.join(SCREENING_MODES)}")
+# Intakes queued or being screened beyond which new intakes are screened inline again
+SCREENING_QUEUE_MAX = int(os.getenv("SCREENING_QUEUE_MAX", "10000"))
+# Jobs claimed, screened and written back together
+SCREENING_BATCH_SIZE = int(os.getenv("SCREENING_BATCH_SIZE", "100"))
+# Wait after a wake-up so intakes arriving together are claimed, screened and saved together
+SCREENING_BATCH_DELAY_SECONDS = float(os.getenv("SCREENING_BATCH_DELAY_SECONDS", "0.05"))
+# How long a claimed batch may take before other workers may claim it again
+SCREENING_LEASE_SECONDS = float(os.getenv("SCREENING_LEASE_SECONDS", "60"))
+SCREENING_MAX_ATTEMPTS = int(os.getenv("SCREENING_MAX_ATTEMPTS", "3"))
+# Idle workers look for jobs queued by other processes this often
+SCREENING_POLL_SECONDS = float(os.getenv("SCREENING_POLL_SECONDS", "1"))
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    intake_id: int
+    attempts: int
+
+
+_wakeup: Dict[str, Optional[Callable[[], None]]] = {"callback": None}
+
+
+def set_wakeup(callback: Optional[Callable[[], None]]):
+    """Register the running worker's wake-up call, made after jobs are committed"""
+    _wakeup["callback"] = callback
+
+
+def notify():
+    callback = _wakeup["callback"]
+    if callback is not None:
+        callback()
+
+
+def queue_depth(db: Session, limit: Optional[int] = None) -> int:
+    """Jobs queued or running, counting no further than limit"""
+    pending = select(ScreeningJob.id).where(ScreeningJob.status != "failed")
+    if limit is not None:
+        pending = pending.limit(limit)
+    return db.scalar(select(func.count()).select_from(pending.subquery()))
+
+
+def has_room(db: Session) -> bool:
+    return queue_depth(db, SCREENING_QUEUE_MAX) < SCREENING_QUEUE_MAX
+
+
+def queue_statistics(db: Session) -> dict:
+    counts = dict(db.execute(select(ScreeningJob.status, func.count()).group_by(ScreeningJob.status)).all())
+    return {
+        "mode": SCREENING_MODE,
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "failed": counts.get("failed", 0),
+        "max_depth": SCREENING_QUEUE_MAX,
+    }
+
+
+def enqueue(db: Session, intake_ids: List[int]):
+    """Queue intakes for screening; the caller commits"""
+    now = datetime.now(timezone.utc)
+    db.execute(insert(ScreeningJob), [
+        {"intake_id": intake_id, "status": "queued", "attempts": 0, "created_at": now} for intake_id in intake_ids
+    ])
+
+
+def expire_exhausted(db: Session) -> List[int]:
+    """Mark failed the expired jobs that have no attempts left; returns their intake ids"""
+    now = datetime.now(timezone.utc)
+    return list(db.scalars(
+        update(ScreeningJob)
+        .where(
+            ScreeningJob.status == "running",
+            ScreeningJob.lease_expires_at < now,
+            ScreeningJob.attempts >= SCREENING_MAX_ATTEMPTS,
+        )
+        .values(
+            status="failed",
+            lease_expires_at=None,
+            last_error=func.coalesce(ScreeningJob.last_error, "Screening did not finish within its lease"),
+        )
+        .returning(ScreeningJob.intake_id)
+        .execution_options(synchronize_session=False)
+    ))
+
+
+def _claimable(now: datetime):
+    """Queued jobs and running ones whose lease expired"""
+    return or_(
+        ScreeningJob.status == "queued",
+        and_(ScreeningJob.status == "running", ScreeningJob.lease_expires_at < now),
+    )
+
+
+def has_claimable(db: Session) -> bool:
+    """Whether claim() would find work; a read, so idle polls never take the write lock"""
+    now = datetime.now(timezone.utc)
+    return db.scalar(select(ScreeningJob.id).where(_claimable(now)).limit(1)) is not None
+
+
+def claim(db: Session, limit: int = SCREENING_BATCH_SIZE) -> List[ClaimedJob]:
+    """
+    Lease up to limit jobs, oldest first: queued ones and running ones whose lease expired
+
+    The claim is one UPDATE ... RETURNING, so concurrent workers never share a
+    job. The caller commits.
+    """
+    now = datetime.now(timezone.utc)
+    claimable = (
+        select(ScreeningJob.id)
+        .where(_claimable(now))
+        .order_by(ScreeningJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.execute(
+        update(ScreeningJob)
+        .where(ScreeningJob.id.in_(claimable.scalar_subquery()))
+        .values(
+            status="running",
+            attempts=ScreeningJob.attempts + 1,
+            lease_expires_at=now + timedelta(seconds=SCREENING_LEASE_SECONDS),
+        )
+        .returning(ScreeningJob.id, ScreeningJob.intake_id, ScreeningJob.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    return sorted((ClaimedJob(*row) for row in rows), key=lambda job: job.id)
+
+
+def complete(db: Session, jobs: List[ClaimedJob]):
+    """Drop finished jobs; the caller commits"""
+    if jobs:
+        db.execute(delete(ScreeningJob).where(ScreeningJob.id.in_([job.id for job in jobs])))
+
+
+def complete_leased(db: Session, jobs: List[ClaimedJob]) -> List[ClaimedJob]:
+    """
+    Drop finished jobs whose lease this claim still holds; returns those jobs
+
+    A job whose lease ran out, or that another worker has claimed again since,
+    is left alone: its results belong to whoever holds it now. The caller
+    commits.
+    """
+    if not jobs:
+        return []
+    now = datetime.now(timezone.utc)
+    rows = db.execute(
+        delete(ScreeningJob)
+        .where(
+            tuple_(ScreeningJob.id, ScreeningJob.attempts).in_([(job.id, job.attempts) for job in jobs]),
+            ScreeningJob.status == "running",
+            ScreeningJob.lease_expires_at > now,
+        )
+        .returning(ScreeningJob.id, ScreeningJob.intake_id, ScreeningJob.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    return sorted((ClaimedJob(*row) for row in rows), key=lambda job: job.id)
+
+
+def discard(db: Session, intake_ids: List[int]):
+    """Drop any jobs for intakes screened by other means; the caller commits"""
+    if intake_ids:
+        db.execute(delete(ScreeningJob).where(ScreeningJob.intake_id.in_(intake_ids)))
+
+
+def release(db: Session, jobs: List[ClaimedJob], error: str) -> List[int]:
+    """
+    Hand jobs whose screening failed back to the queue, or mark them failed when out of attempts
+
+    Returns the intake ids of the jobs now failed. The caller commits.
+    """
+    retry = [job.id for job in jobs if job.attempts < SCREENING_MAX_ATTEMPTS]
+    exhausted = [job for job in jobs if job.attempts >= SCREENING_MAX_ATTEMPTS]
+    if retry:
+        db.execute(
+            update(ScreeningJob).where(ScreeningJob.id.in_(retry))
+            .values(status="queued", lease_expires_at=None, last_error=error)
+            .execution_options(synchronize_session=False)
+        )
+    if exhausted:
+        db.execute(
+            update(ScreeningJob).where(ScreeningJob.id.in_([job.id for job in exhausted]))
+            .values(status="failed", lease_expires_at=None, last_error=error)
+            .execution_options(synchronize_session=False)
+        )
+    return [job.intake_id for job in exhausted]
+
+
+def job_for_intake(db: Session, intake_id: int) -> Optional[ScreeningJob]:
+    return db.scalars(select(ScreeningJob).where(ScreeningJob.intake_id == intake_id)).first()
@@ -0,0 +1,128 @@
+"""
+Screening Worker
+Background task that drains the screening queue (see services/screening_queue.py)
+
+Runs on the application's event loop while SCREENING_MODE is background. It
+claims up to SCREENING_BATCH_SIZE jobs, screens them across the bulk screening
+process pool and writes the results back in one transaction. It wakes
+SCREENING_BATCH_DELAY_SECONDS after this process queues an intake, so intakes
+arriving together share a batch, and polls every SCREENING_POLL_SECONDS for
+jobs queued by other processes or left behind by a crashed one.
+
+When a batch fails, its intakes are screened one at a time, so a single
+intake that breaks the screener only costs its own attempts.
+"""
+from typing import List, Optional
+import asyncio
+import logging
+
+from database import AsyncSessionLocal
+from services import async_intake_service, bulk_intake_service, metrics, screening_queue
+
+logger = logging.getLogger(__name__)
+
+
+def _describe(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+class ScreeningWorker:
+    def __init__(
+        self,
+        batch_size: int = screening_queue.SCREENING_BATCH_SIZE,
+        poll_seconds: float = screening_queue.SCREENING_POLL_SECONDS,
+        batch_delay: float = screening_queue.SCREENING_BATCH_DELAY_SECONDS,
+    ):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.batch_delay = batch_delay
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        screening_queue.set_wakeup(self.wake)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        screening_queue.set_wakeup(None)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Start the next batch now; safe to call from any thread"""
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # The loop has closed
+            pass
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                saved = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Screening batch failed")
+                saved = 0
+            if saved >= self.batch_size:
+                # A full batch suggests a backlog; keep draining
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                continue
+            # Each batch costs two commits whatever its size; let this one fill up
+            await asyncio.sleep(self.batch_delay)
+
+    async def run_once(self) -> int:
+        """
+        Claim, screen and save one batch
+
+        Returns the number of jobs saved, or 0 if screening failed, so that
+        retries wait for the next poll instead of using up their attempts at once.
+        """
+        async with AsyncSessionLocal() as db:
+            jobs, inputs = await async_intake_service.claim_screening_jobs(db, self.batch_size)
+            if not jobs:
+                return 0
+            try:
+                with metrics.stage("background_screening"):
+                    screenings = await bulk_intake_service.screen_medication_lists(inputs)
+            except Exception as e:
+                if len(jobs) == 1:
+                    logger.warning("Screening intake %d failed: %s", jobs[0].intake_id, _describe(e))
+                    await async_intake_service.release_screening_jobs(db, jobs, _describe(e))
+                else:
+                    logger.warning("Screening %d queued intakes failed (%s); retrying one at a time", len(jobs), _describe(e))
+                    await self._screen_singly(db, jobs, inputs)
+                return 0
+            await async_intake_service.save_screenings(db, jobs, screenings)
+            return len(jobs)
+
+    async def _screen_singly(self, db, jobs: List[screening_queue.ClaimedJob], inputs: list):
+        done, screenings, broken = [], [], []
+        for job, medications in zip(jobs, inputs):
+            try:
+                (screening,) = await bulk_intake_service.screen_medication_lists([medications])
+            except Exception as e:
+                logger.exception("Screening intake %d failed", job.intake_id)
+                broken.append((job, _describe(e)))
+                continue
+            done.append(job)
+            screenings.append(screening)
+        await async_intake_service.save_screenings(db, done, screenings)
+        for job, message in broken:
+            await async_intake_service.release_screening_jobs(db, [job], message)
+
+
+worker = ScreeningWorker()
@@ -0,0 +1,205 @@
+"""
+Search Service
+Full-text search over intakes, backed by an SQLite FTS5 index
+
+intakes_fts is an external-content FTS5 table over the patient name,
+medications, notes and pharmacist notes. Triggers on intakes keep it in step
+with every insert, delete and change to those columns, whichever code path
+makes it, so the intake_service mutators need not know about it. Migrations
+create it (and index existing rows); `python manage.py rebuild-search-index`
+rebuilds it from scratch.
+
+Every match is ranked, however old, and pages are keyset-paginated on
+(rank, id), so a page boundary does not drift when intakes are added.
+
+Other databases fall back to a case-insensitive substring scan, unranked and
+newest first.
+"""
+from typing import List, Optional, Tuple
+import base64
+import json
+import re
+
+from sqlalchemy import Float, Integer, String, and_, func, null, or_, select, text
+from sqlalchemy.orm import Session
+
+from database import Intake
+from services.intake_service import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SUMMARY_COLUMNS, decode_cursor, encode_cursor
+)
+
+SEARCH_COLUMNS = ("patient_name", "medications", "current_medications", "notes", "pharmacist_notes")
+# bm25 weights, in SEARCH_COLUMNS order: a hit on the name outranks one in the notes
+SEARCH_WEIGHTS = (10.0, 4.0, 2.0, 1.0, 1.0)
+# Highlight markers placed around matched terms in snippets
+SNIPPET_START, SNIPPET_END = "<mark>", "</mark>"
+SNIPPET_TOKENS = 12
+
+_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+_old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+
+# Prefix indexes make the per-term prefix queries below cheap
+SEARCH_SCHEMA = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS intakes_fts USING fts5(
+        {_columns}, content='intakes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS intakes_fts_insert AFTER INSERT ON intakes BEGIN
+        INSERT INTO intakes_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS intakes_fts_delete AFTER DELETE ON intakes BEGIN
+        INSERT INTO intakes_fts(intakes_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS intakes_fts_update AFTER UPDATE OF {_columns} ON intakes BEGIN
+        INSERT INTO intakes_fts(intakes_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO intakes_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    # The rank column then scores with the column weights
+    f"INSERT INTO intakes_fts(intakes_fts, rank) VALUES ('rank', 'bm25({', '.join(map(str, SEARCH_WEIGHTS))})')",
+)
+
+
+def has_search_index(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def ensure_search_index(db: Session):
+    """Create the FTS table and its triggers if missing (SQLite only; no-op elsewhere)"""
+    if not has_search_index(db):
+        return
+    for statement in SEARCH_SCHEMA:
+        db.execute(text(statement))
+
+
+def rebuild_search_index(db: Session) -> int:
+    """Re-index every intake and merge the index segments; returns the number of intakes indexed"""
+    if not has_search_index(db):
+        return 0
+    ensure_search_index(db)
+    db.execute(text("INSERT INTO intakes_fts(intakes_fts) VALUES ('rebuild')"))
+    db.execute(text("INSERT INTO intakes_fts(intakes_fts) VALUES ('optimize')"))
+    db.commit()
+    return db.scalar(select(func.count()).select_from(Intake))
+
+
+def search_terms(query: str) -> List[str]:
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        raise ValueError("Search query has no searchable terms")
+    return terms
+
+
+def match_expression(query: str) -> str:
+    """
+    FTS5 query matching intakes containing every term of query
+
+    The last term matches as a word prefix, as when typing; earlier ones are
+    complete words, which FTS5 reads far faster than prefixes of common words.
+    """
+    # Quoting each term keeps FTS5 operators and column filters typed by users inert
+    *words, last = search_terms(query)
+    return " ".join([f'"{word}"' for word in words] + [f'"{last}"*'])
+
+
+def encode_search_cursor(rank: float, intake_id: int) -> str:
+    """Encode a (rank, id) keyset position in the ranking as an opaque token"""
+    return base64.urlsafe_b64encode(json.dumps([rank, intake_id]).encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    """Decode a token produced by encode_search_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, intake_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(rank), int(intake_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def search_intakes(
+    db: Session,
+    query: str,
+    status: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[list, Optional[str]]:
+    """
+    One page of intake summaries matching query, best match first, plus the cursor for the next page
+
+    Each row also has rank (bm25, lower is better) and snippet, the best-matching
+    fragment with matched terms between SNIPPET_START and SNIPPET_END. Without
+    the FTS index rank and snippet are None and pages are ordered newest first,
+    with list_intakes' (created_at, id) cursor.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if has_search_index(db):
+        position = decode_search_cursor(cursor) if cursor else None
+        rows = _search_fts(db, match_expression(query), status, limit + 1, position)
+    else:
+        position = decode_cursor(cursor) if cursor else None
+        rows = _search_scan(db, search_terms(query), status, limit + 1, position)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if last.rank is None:
+            next_cursor = encode_cursor(last.created_at, last.id)
+        else:
+            next_cursor = encode_search_cursor(last.rank, last.id)
+    return rows, next_cursor
+
+
+def _search_fts(db: Session, match: str, status: Optional[str], limit: int, position) -> list:
+    # Every match is scored to find the best ones; snippets are only built for the page
+    status_join = "JOIN intakes ON intakes.id = intakes_fts.rowid AND intakes.status = :status" if status else ""
+    # The cursor's hit is re-scored: bm25 depends on corpus statistics, so ranks
+    # shift as intakes are added, but the order of existing hits does not. The
+    # stored rank is only used once the hit no longer matches.
+    after = """
+        AND (rank, intakes_fts.rowid) > (coalesce((
+            SELECT rank FROM intakes_fts WHERE intakes_fts MATCH :match AND intakes_fts.rowid = :id
+        ), :rank), :id)
+    """ if position else ""
+    hits = text(f"""
+        SELECT id, rank, (
+            SELECT snippet(intakes_fts, -1, :start, :end, '…', {SNIPPET_TOKENS})
+            FROM intakes_fts WHERE intakes_fts MATCH :match AND intakes_fts.rowid = page.id
+        ) AS snippet
+        FROM (
+            SELECT intakes_fts.rowid AS id, rank
+            FROM intakes_fts {status_join}
+            WHERE intakes_fts MATCH :match {after}
+            ORDER BY rank, intakes_fts.rowid
+            LIMIT :limit
+        ) AS page
+    """).columns(id=Integer, rank=Float, snippet=String).subquery("hits")
+    params = {"match": match, "start": SNIPPET_START, "end": SNIPPET_END, "limit": limit}
+    if status:
+        params["status"] = status
+    if position:
+        params["rank"], params["id"] = position
+    statement = (
+        select(*SUMMARY_COLUMNS, hits.c.rank, hits.c.snippet)
+        .join_from(Intake, hits, hits.c.id == Intake.id)
+        .order_by(hits.c.rank, Intake.id)
+    )
+    return db.execute(statement, params).all()
+
+
+def _search_scan(db: Session, terms: List[str], status: Optional[str], limit: int, position) -> list:
+    columns = [getattr(Intake, column) for column in SEARCH_COLUMNS]
+    statement = select(*SUMMARY_COLUMNS, null().label("rank"), null().label("snippet"))
+    for term in terms:
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        statement = statement.where(or_(*(column.ilike(pattern, escape="\\") for column in columns)))
+    if status:
+        statement = statement.where(Intake.status == status)
+    if position:
+        created_at, intake_id = position
+        statement = statement.where(or_(
+            Intake.created_at < created_at,
+            and_(Intake.created_at == created_at, Intake.id < intake_id),
+        ))
+    statement = statement.order_by(Intake.created_at.desc(), Intake.id.desc()).limit(limit)
+    return db.execute(statement).all()
@@ -0,0 +1,70 @@
+"""
+Serialization
+Encoders turning intake list rows into IntakePage JSON bodies
+
+LIST_SERIALIZER picks how list pages are encoded:
+  model    build IntakeSummary models and dump them (the reference behaviour)
+  adapter  validate the whole page at once with a TypeAdapter, skipping model instances
+  trusted  skip validation: rows come straight from SUMMARY_COLUMNS, so their
+           types already match IntakeSummary; encoded with orjson when installed
+
+All three produce the same bytes for the same rows.
+"""
+from datetime import date, datetime
+from typing import List, Optional, Sequence
+import json
+import os
+
+from pydantic import TypeAdapter
+
+from schemas.intake import IntakePage, IntakeSummary
+from services.intake_service import SUMMARY_COLUMNS
+
+try:
+    import orjson
+except ImportError:  # optional; the json fallback is slower but equivalent
+    orjson = None
+
+SERIALIZERS = ("model", "adapter", "trusted")
+LIST_SERIALIZER = os.getenv("LIST_SERIALIZER", "model")
+if LIST_SERIALIZER not in SERIALIZERS:
+    raise ValueError(f"LIST_SERIALIZER must be one of {', '.join(SERIALIZERS)}")
+
+# Names of the row fields, in SUMMARY_COLUMNS order
+FIELDS = tuple(column.key for column in SUMMARY_COLUMNS)
+
+_page_adapter = TypeAdapter(List[IntakeSummary])
+
+
+def _encode_model(rows: Sequence, next_cursor: Optional[str]) -> bytes:
+    return IntakePage(items=rows, next_cursor=next_cursor).model_dump_json().encode("utf-8")
+
+
+def _encode_adapter(rows: Sequence, next_cursor: Optional[str]) -> bytes:
+    items = _page_adapter.dump_json(_page_adapter.validate_python([dict(zip(FIELDS, row)) for row in rows]))
+    cursor = json.dumps(next_cursor).encode("utf-8")
+    return b'{"items":' + items + b',"next_cursor":' + cursor + b"}"
+
+
+def _json_default(value):
+    if isinstance(value, datetime) and value.utcoffset() is not None and not value.utcoffset():
+        return value.replace(tzinfo=None).isoformat() + "Z"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _encode_trusted(rows: Sequence, next_cursor: Optional[str]) -> bytes:
+    page = {"items": [dict(zip(FIELDS, row)) for row in rows], "next_cursor": next_cursor}
+    if orjson is not None:
+        # Aware datetimes as "Z", as pydantic writes them
+        return orjson.dumps(page, option=orjson.OPT_UTC_Z)
+    return json.dumps(page, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+_ENCODERS = {"model": _encode_model, "adapter": _encode_adapter, "trusted": _encode_trusted}
+
+
+def encode_intake_page(rows: Sequence, next_cursor: Optional[str], mode: str = LIST_SERIALIZER) -> bytes:
+    """IntakePage JSON for rows selected with intake_service.SUMMARY_COLUMNS"""
+    return _ENCODERS[mode](rows, next_cursor)
@@ -0,0 +1,234 @@
+"""
+Statistics Counter Service
+Maintains the intake_counters table so the dashboard summary is a single read
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+from sqlalchemy import case, exists, func, literal, or_, select, union_all, update
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.orm import Session
+
+from database import Intake, IntakeArchive, IntakeCounter
+
+TOTAL = "total"
+DISPENSED = "dispensed"
+STATUS_PREFIX = "status:"
+ASSIGNEE_PREFIX = "assignee:"
+DAY_PREFIX = "day:"
+# Advanced by every write to intakes; list and summary ETags are derived from it
+VERSION = "version"
+
+# How many days of per-day counts the summary returns
+STATS_DAYS = 30
+
+
+def status_key(status: str) -> str:
+    return f"{STATUS_PREFIX}{status}"
+
+
+def assignee_key(user: str) -> str:
+    return f"{ASSIGNEE_PREFIX}{user}"
+
+
+def day_key(day) -> str:
+    """Counter name for the day an intake was created (accepts a date, datetime or 'YYYY-MM-DD')"""
+    if isinstance(day, datetime):
+        day = day.date()
+    if isinstance(day, date):
+        day = day.isoformat()
+    return f"{DAY_PREFIX}{day}"
+
+
+def _upsert(db: Session, deltas: Dict[str, int]):
+    """Apply all counter deltas in one INSERT ... ON CONFLICT statement where the dialect has it"""
+    dialect = db.get_bind().dialect.name
+    rows = [{"name": name, "value": delta} for name, delta in deltas.items()]
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        for row in rows:
+            updated = db.query(IntakeCounter).filter(IntakeCounter.name == row["name"]).update(
+                {IntakeCounter.value: IntakeCounter.value + row["value"]}, synchronize_session=False
+            )
+            if not updated:
+                db.add(IntakeCounter(**row))
+        return
+
+    stmt = insert(IntakeCounter).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IntakeCounter.name],
+        set_={"value": IntakeCounter.value + stmt.excluded.value},
+    )
+    db.execute(stmt)
+
+
+def bump_counters(db: Session, deltas: Dict[str, int]):
+    """
+    Add deltas to the named counters
+
+    Must be called inside the caller's transaction, before it commits, so the
+    counters can never drift from the rows they describe.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if deltas:
+        _upsert(db, deltas)
+
+
+def record_change(db: Session, deltas: Optional[Dict[str, int]] = None):
+    """bump_counters for a write to intakes: also advances VERSION, in the same statement"""
+    bump_counters(db, {**(deltas or {}), VERSION: 1})
+
+
+def read_version(db: Session) -> int:
+    """Current data version (0 before the first recorded change)"""
+    return db.scalar(select(IntakeCounter.value).where(IntakeCounter.name == VERSION)) or 0
+
+
+def shift_counter(db: Session, name: ColumnElement, where: ColumnElement, delta: int) -> Optional[str]:
+    """
+    Add delta to the counter whose name is computed from the intake matching where
+
+    name is evaluated against the row as it is now, so call this before the
+    statement that changes it. Nothing happens when no intake matches or the
+    name comes out NULL. The row is locked first on databases that support it.
+    Returns the name of the counter that was changed, if any.
+    """
+    name_query = select(name).where(where).with_for_update().scalar_subquery()
+    return db.scalar(
+        update(IntakeCounter)
+        .where(IntakeCounter.name == name_query)
+        .values(value=IntakeCounter.value + delta)
+        .returning(IntakeCounter.name)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def shift_counters(db: Session, deltas: Dict[str, int], where: ColumnElement) -> Dict[str, int]:
+    """
+    Add deltas to existing counters, but only if some intake matches where (see shift_counter)
+
+    Returns the deltas that were applied.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return {}
+    matched = exists(select(Intake.id).where(where).with_for_update())
+    names = db.scalars(
+        update(IntakeCounter)
+        .where(IntakeCounter.name.in_(list(deltas)), matched)
+        .values(value=IntakeCounter.value + case(deltas, value=IntakeCounter.name, else_=0))
+        .returning(IntakeCounter.name)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return {name: deltas[name] for name in names}
+
+
+def shift_counters_per_intake(db: Session, name: ColumnElement, where: ColumnElement, delta: int) -> Dict[str, int]:
+    """
+    shift_counter for many intakes at once: each counter named by a matching intake moves by delta per intake
+
+    One statement whatever the number of intakes. Returns the deltas that were applied.
+    """
+    per_counter = (
+        select(func.count())
+        .select_from(Intake)
+        .where(where, name == IntakeCounter.name)
+        .correlate(IntakeCounter)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        update(IntakeCounter)
+        .where(IntakeCounter.name.in_(select(name).where(where).with_for_update()))
+        .values(value=IntakeCounter.value + delta * per_counter)
+        .returning(IntakeCounter.name, per_counter)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return {counter: delta * count for counter, count in rows if count}
+
+
+def status_name(status_column: ColumnElement) -> ColumnElement:
+    """SQL expression for status_key()"""
+    return literal(STATUS_PREFIX) + status_column
+
+
+def assignee_name(assignee_column: ColumnElement) -> ColumnElement:
+    """SQL expression for assignee_key(); NULL when nobody is assigned"""
+    return literal(ASSIGNEE_PREFIX) + assignee_column
+
+
+def rebuild_counters(db: Session, statuses: Iterable[str]):
+    """Recompute every counter from intakes and intakes_archive with grouped aggregates"""
+    counters = {TOTAL: 0, DISPENSED: 0}
+    counters.update({status_key(s): 0 for s in statuses})
+
+    # Archived intakes still count towards the totals
+    columns = ("status", "dispensed", "assigned_to", "created_at")
+    every_intake = union_all(
+        select(*(getattr(Intake, name) for name in columns)),
+        select(*(getattr(IntakeArchive, name) for name in columns)),
+    ).subquery()
+
+    is_dispensed = every_intake.c.dispensed == "yes"
+    by_status = db.execute(
+        select(every_intake.c.status, is_dispensed, func.count())
+        .group_by(every_intake.c.status, is_dispensed)
+    )
+    for status, dispensed, count in by_status:
+        counters[TOTAL] += count
+        counters[status_key(status)] = counters.get(status_key(status), 0) + count
+        if dispensed:
+            counters[DISPENSED] += count
+
+    by_assignee = db.execute(
+        select(every_intake.c.assigned_to, func.count())
+        .where(every_intake.c.assigned_to.isnot(None))
+        .group_by(every_intake.c.assigned_to)
+    )
+    for user, count in by_assignee:
+        counters[assignee_key(user)] = count
+
+    created_day = func.date(every_intake.c.created_at)
+    for day, count in db.execute(select(created_day, func.count()).group_by(created_day)):
+        counters[day_key(day)] = count
+
+    # The version only ever moves forward, or ETags issued before the rebuild could match again
+    counters[VERSION] = read_version(db) + 1
+
+    db.query(IntakeCounter).delete(synchronize_session=False)
+    db.add_all(IntakeCounter(name=name, value=value) for name, value in counters.items())
+    db.commit()
+
+
+def ensure_counters(db: Session, statuses: Iterable[str]):
+    """Seed the counters on first start against an existing database"""
+    if db.get(IntakeCounter, TOTAL) is None:
+        rebuild_counters(db, statuses)
+
+
+def read_statistics(db: Session, statuses: Iterable[str], days: int = STATS_DAYS, today: Optional[date] = None) -> dict:
+    """Build the summary from the counters in a single query"""
+    today = today or datetime.now(timezone.utc).date()
+    first_day = day_key(today - timedelta(days=days - 1))
+    rows = db.query(IntakeCounter.name, IntakeCounter.value).filter(or_(
+        ~IntakeCounter.name.startswith(DAY_PREFIX),
+        IntakeCounter.name >= first_day,
+    )).all()
+    counters = dict(rows)
+
+    return {
+        "total": counters.get(TOTAL, 0),
+        "by_status": {s: counters.get(status_key(s), 0) for s in statuses},
+        "dispensed_count": counters.get(DISPENSED, 0),
+        "by_assignee": {
+            name[len(ASSIGNEE_PREFIX):]: value
+            for name, value in sorted(counters.items())
+            if name.startswith(ASSIGNEE_PREFIX) and value
+        },
+        "by_day": {
+            name[len(DAY_PREFIX):]: value
+            for name, value in sorted(counters.items())
+            if name.startswith(DAY_PREFIX) and value
+        },
+    }
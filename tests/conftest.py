@@ -0,0 +1,56 @@
+"""
+Shared fixtures
+
+The API modules import each other from the fastapi directory, as uvicorn runs
+them, so it goes on sys.path first. Every test session gets its own SQLite
+file, configured before database.py reads DATABASE_URL.
+"""
+import os
+import sys
+import tempfile
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fastapi")
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='pharmacy-tests-'), 'test.db')}"
+# Screen in a thread of the test process rather than a process pool
+os.environ.setdefault("BULK_SCREENING_WORKERS", "0")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services import query_inspector
+
+
+@pytest.fixture(scope="session")
+def client():
+    import myapi
+
+    with TestClient(myapi.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db(client):
+    from database import SessionLocal
+
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture(name="query_budget")
+def query_budget_fixture():
+    """Context manager factory: `with query_budget(2): ...` fails the test above 2 statements"""
+    return query_inspector.query_budget
+
+
+@pytest.fixture
+def create_intake(client):
+    """POST /intakes with defaults for the fields a test does not care about; returns the intake"""
+    def create(**fields):
+        payload = {"patient_name": "Test Patient", "medications": "lisinopril", **fields}
+        response = client.post("/intakes", json=payload)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return create
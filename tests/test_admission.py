@@ -0,0 +1,123 @@
+"""Admission control sheds with 503 and Retry-After, and hands freed slots to the highest class waiting"""
+import asyncio
+import collections
+import json
+
+from services.admission import AdmissionController, AdmissionMiddleware
+
+ONE_EACH = "critical=1,read=1,bulk=1,dashboard=1"
+
+
+class HeldApp:
+    """ASGI app that answers each path only once the test lets it go"""
+
+    def __init__(self):
+        self.started = []
+        self.gates = collections.defaultdict(asyncio.Event)
+
+    def let_go(self, path: str):
+        self.gates[path].set()
+
+    async def __call__(self, scope, receive, send):
+        self.started.append(scope["path"])
+        await self.gates[scope["path"]].wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def request(app, method: str, path: str):
+    """(status, headers, parsed body) of one request sent straight to the ASGI app"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": [], "query_string": b""}
+    await app(scope, receive, send)
+    start, body = messages
+    return start["status"], dict(start["headers"]), json.loads(body["body"])
+
+
+async def until(condition):
+    """Let the other tasks run until condition() holds"""
+    for _ in range(1000):
+        if condition():
+            return
+        await asyncio.sleep(0)
+    raise AssertionError("condition never held")
+
+
+def admission_app(max_wait_ms: str = "critical=5000,read=5000,bulk=5000,dashboard=5000"):
+    admission = AdmissionController(
+        max_concurrency=1, limits=ONE_EACH, queue_sizes=ONE_EACH, max_wait_ms=max_wait_ms,
+    )
+    app = HeldApp()
+    return admission, app, AdmissionMiddleware(app, admission)
+
+
+def test_full_queue_is_shed_at_once():
+    async def scenario():
+        admission, app, middleware = admission_app()
+        running = asyncio.create_task(request(middleware, "GET", "/intakes/stats/summary"))
+        queued = asyncio.create_task(request(middleware, "GET", "/intakes/stats/daily"))
+        await until(lambda: len(admission.classes["dashboard"].waiting) == 1)
+
+        status, headers, body = await request(middleware, "GET", "/intakes")
+        assert status == 503
+        assert headers[b"retry-after"] == b"1"
+        assert body["route_class"] == "dashboard" and body["reason"] == "queue_full"
+
+        app.let_go("/intakes/stats/summary")
+        app.let_go("/intakes/stats/daily")
+        assert [result[0] for result in await asyncio.gather(running, queued)] == [200, 200]
+        assert admission.classes["dashboard"].shed == {"queue_full": 1, "timeout": 0}
+        assert admission.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_long_wait_is_shed():
+    async def scenario():
+        admission, app, middleware = admission_app("critical=5000,read=5000,bulk=5000,dashboard=20")
+        running = asyncio.create_task(request(middleware, "GET", "/intakes/stats/summary"))
+        await until(lambda: app.started)
+
+        status, headers, body = await request(middleware, "GET", "/intakes")
+        assert status == 503
+        assert headers[b"retry-after"] == b"1"
+        assert body["reason"] == "timeout"
+        assert not admission.classes["dashboard"].waiting
+
+        app.let_go("/intakes/stats/summary")
+        assert (await running)[0] == 200
+        assert admission.classes["dashboard"].shed == {"queue_full": 0, "timeout": 1}
+
+    asyncio.run(scenario())
+
+
+def test_freed_slot_goes_to_critical_before_dashboard():
+    async def scenario():
+        admission, app, middleware = admission_app()
+        read = asyncio.create_task(request(middleware, "GET", "/intakes/1"))
+        await until(lambda: app.started)
+        # The dashboard request queues first, the critical write after it
+        dashboard = asyncio.create_task(request(middleware, "GET", "/intakes/stats/summary"))
+        await until(lambda: admission.classes["dashboard"].waiting)
+        critical = asyncio.create_task(request(middleware, "POST", "/intakes/2/status"))
+        await until(lambda: admission.classes["critical"].waiting)
+
+        app.let_go("/intakes/1")
+        await read
+        await until(lambda: len(app.started) == 2)
+        assert app.started == ["/intakes/1", "/intakes/2/status"]
+        assert len(admission.classes["dashboard"].waiting) == 1
+
+        app.let_go("/intakes/2/status")
+        app.let_go("/intakes/stats/summary")
+        assert [result[0] for result in await asyncio.gather(critical, dashboard)] == [200, 200]
+        assert app.started[-1] == "/intakes/stats/summary"
+
+    asyncio.run(scenario())
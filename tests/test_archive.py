@@ -0,0 +1,81 @@
+"""Archiving moves terminal intakes to intakes_archive, whatever is left of their screening jobs"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+
+from database import IntakeArchive, ScreeningJob, create_db_engine, engine
+from services import archive_service
+
+COMPLETE_WITHOUT_DISPENSING = ["triage", "ready_to_fill", "filled", "dispensed", "completed"]
+
+
+@pytest.fixture
+def enforcing_db(client):
+    """A session whose connections enforce foreign keys, as PostgreSQL always does"""
+    enforcing = create_db_engine(str(engine.url))
+
+    @event.listens_for(enforcing, "connect")
+    def _enforce_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+    with Session(enforcing) as session:
+        yield session
+    enforcing.dispose()
+
+
+def complete(client, intake_id: int):
+    for status in COMPLETE_WITHOUT_DISPENSING:
+        response = client.post(f"/intakes/{intake_id}/status", json={"status": status})
+        assert response.status_code == 200, response.text
+
+
+def archive_all(db: Session, create_intake) -> int:
+    """Archive every terminal intake; another intake is created first, as the newest one always stays"""
+    create_intake(patient_name="Newer Intake")
+    return archive_service.archive_batch(db, datetime.now(timezone.utc) + timedelta(seconds=1))
+
+
+def test_intake_with_a_failed_job_is_archived(client, create_intake, enforcing_db):
+    intake = create_intake(patient_name="Failed Job", medications="warfarin")
+    complete(client, intake["id"])
+    enforcing_db.execute(insert(ScreeningJob).values(
+        intake_id=intake["id"], status="failed", attempts=3, last_error="Screener crashed",
+        created_at=datetime.now(timezone.utc),
+    ))
+    enforcing_db.commit()
+
+    assert archive_all(enforcing_db, create_intake) >= 1
+    assert enforcing_db.get(IntakeArchive, intake["id"]) is not None
+    assert enforcing_db.scalar(select(ScreeningJob.id).where(ScreeningJob.intake_id == intake["id"])) is None
+    assert client.get(f"/intakes/{intake['id']}").json()["archived_at"] is not None
+
+
+
+def test_new_intakes_never_reuse_archived_ids(client, create_intake, db):
+    intake = create_intake(patient_name="Newest Intake", medications="lisinopril")
+    complete(client, intake["id"])
+    archive_service.archive_batch(db, datetime.now(timezone.utc) + timedelta(seconds=1))
+    assert db.get(IntakeArchive, intake["id"]) is None
+
+    newer = create_intake(patient_name="Newer Intake")
+    assert newer["id"] > intake["id"]
+    assert archive_all(db, create_intake) >= 1
+    assert db.get(IntakeArchive, intake["id"]) is not None
+    assert create_intake(patient_name="After Archiving")["id"] > newer["id"]
+
+
+def test_archived_intake_gets_a_new_etag(client, create_intake, db):
+    intake = create_intake(patient_name="Etag Check", medications="lisinopril")
+    complete(client, intake["id"])
+    live = client.get(f"/intakes/{intake['id']}")
+    assert live.json()["archived_at"] is None
+    etag = live.headers["etag"]
+    assert client.get(f"/intakes/{intake['id']}", headers={"If-None-Match": etag}).status_code == 304
+
+    assert archive_all(db, create_intake) >= 1
+    archived = client.get(f"/intakes/{intake['id']}", headers={"If-None-Match": etag})
+    assert archived.status_code == 200
+    assert archived.json()["archived_at"] is not None
+    assert archived.headers["etag"] != etag
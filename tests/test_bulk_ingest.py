@@ -0,0 +1,57 @@
+"""NDJSON round trip of POST /intakes:bulk, including lines that fail"""
+import json
+
+import pytest
+
+from services import intake_service
+
+
+def post_ndjson(client, lines, chunk_size=10):
+    body = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines) + "\n"
+    response = client.post(
+        "/intakes:bulk", params={"chunk_size": chunk_size}, content=body,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200, response.text
+    results = [json.loads(line) for line in response.text.splitlines()]
+    return {result["line"]: result for result in results}
+
+
+def test_every_line_gets_a_result(client):
+    results = post_ndjson(client, [
+        {"patient_name": "Bulk One", "medications": "warfarin, aspirin"},
+        "{not json",
+        {"patient_name": "Bulk Two"},
+        "",
+        {"patient_name": "Bulk Three", "medications": "lisinopril"},
+    ])
+    assert sorted(results) == [1, 2, 3, 5]
+    assert "error" in results[2] and "error" in results[3]
+    stored = client.get(f"/intakes/{results[1]['id']}").json()
+    assert stored["patient_name"] == "Bulk One"
+    assert stored["drug_interactions"]
+    assert client.get(f"/intakes/{results[5]['id']}").json()["patient_name"] == "Bulk Three"
+
+
+@pytest.fixture
+def failing_insert(monkeypatch):
+    """Make storing any chunk that contains a "Broken" patient fail like a database error would"""
+    create_intakes = intake_service.create_intakes
+
+    def create_or_fail(db, items, screenings):
+        if any(item.patient_name.startswith("Broken") for item in items):
+            raise RuntimeError("UNIQUE constraint failed: secret_table.secret_column")
+        return create_intakes(db, items, screenings)
+
+    monkeypatch.setattr(intake_service, "create_intakes", create_or_fail)
+
+
+def test_failed_chunk_is_retried_row_by_row(client, failing_insert):
+    results = post_ndjson(client, [
+        {"patient_name": "Retry One", "medications": "lisinopril"},
+        {"patient_name": "Broken Row", "medications": "aspirin"},
+        {"patient_name": "Retry Two", "medications": "warfarin"},
+    ])
+    assert results[2] == {"line": 2, "error": "Error creating intake"}
+    for line, name in ((1, "Retry One"), (3, "Retry Two")):
+        assert client.get(f"/intakes/{results[line]['id']}").json()["patient_name"] == name
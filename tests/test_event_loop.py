@@ -0,0 +1,57 @@
+"""Screening work runs off the event loop, so other requests are served during a batch re-screen"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from services import drug_interaction_service, intake_service
+
+PROBE_INTERVAL = 0.005
+
+
+@pytest.fixture
+def screened_backlog(db):
+    """Intakes with long, distinct medication lists, so re-screening them takes real CPU time"""
+    drugs = ["warfarin", "aspirin", "ibuprofen", "naproxen", "lisinopril", "atorvastatin", "amoxicillin"]
+    items = [
+        intake_service.IntakeCreate(
+            patient_name=f"Loop Probe {i}",
+            medications=", ".join([*drugs, *(f"supplement {i}-{j} 10 mg daily" for j in range(40))]),
+            current_medications="acetaminophen, potassium, spironolactone",
+        )
+        for i in range(400)
+    ]
+    ids = intake_service.create_intakes(db, items, [([], None)] * len(items))
+    yield ids
+    drug_interaction_service.invalidate_screening_caches()
+
+
+async def _max_loop_lag(done: asyncio.Event) -> float:
+    """Longest overshoot of a short sleep while done is unset"""
+    worst = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        worst = max(worst, time.perf_counter() - start - PROBE_INTERVAL)
+    return worst
+
+
+def test_loop_stays_responsive_during_batch_check(client, screened_backlog):
+    drug_interaction_service.invalidate_screening_caches()
+
+    async def run():
+        transport = httpx.ASGITransport(app=client.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            done = asyncio.Event()
+            probe = asyncio.create_task(_max_loop_lag(done))
+            start = time.perf_counter()
+            response = await http.post("/intakes/check-interactions:batch", json={"ids": screened_backlog})
+            elapsed = time.perf_counter() - start
+            done.set()
+            return response, elapsed, await probe
+
+    response, elapsed, lag = client.portal.call(run)
+    assert response.status_code == 200, response.text
+    assert response.json()["scanned"] == len(screened_backlog)
+    assert lag < max(0.1, elapsed / 4), (elapsed, lag)
@@ -0,0 +1,83 @@
+"""The queue's filters are answered from the composite indexes, checked with EXPLAIN QUERY PLAN"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, func, select
+
+from database import Intake, engine
+from services import intake_service
+
+
+@contextmanager
+def captured_selects():
+    """(statement, parameters) of every SELECT the sync engine runs inside the block"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def query_plan(db, statement: str, parameters) -> str:
+    rows = db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def list_plan(db, **filters) -> str:
+    with captured_selects() as statements:
+        intake_service.list_intakes(db, **filters)
+    (statement, parameters), = statements
+    return query_plan(db, statement, parameters)
+
+
+@pytest.fixture(autouse=True)
+def some_intakes(create_intake):
+    create_intake(patient_name="Index Check", medications="warfarin, aspirin")
+
+
+def uses_index(plan: str, index: str) -> bool:
+    return f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan
+
+
+@pytest.mark.parametrize("filters, index", [
+    ({}, "ix_intakes_created_at_id"),
+    ({"status": "new"}, "ix_intakes_status_created_at"),
+    ({"assigned_to": "alice", "status": "new"}, "ix_intakes_assigned_to_status_created_at"),
+])
+def test_list_pages_are_read_in_index_order(db, filters, index):
+    plan = list_plan(db, **filters)
+    assert uses_index(plan, index), plan
+    assert "USE TEMP B-TREE FOR ORDER BY" not in plan, plan
+
+
+def test_assignee_filter_uses_its_index(db):
+    # Without a status the assignee's intakes are found through the index and then sorted
+    assert uses_index(list_plan(db, assigned_to="alice"), "ix_intakes_assigned_to_status_created_at")
+
+
+def test_severity_filter_uses_interaction_index(db):
+    plan = list_plan(db, severity="major")
+    assert "ix_intake_interactions_severity" in plan, plan
+
+
+def test_dispensed_count_uses_partial_index(db):
+    statement = select(func.count()).select_from(Intake).where(Intake.dispensed == "yes")
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    plan = query_plan(db, str(compiled), ())
+    assert "ix_intakes_dispensed_yes" in plan, plan
+
+
+def test_interaction_severity_is_one_lookup_per_intake(db, create_intake):
+    intake = create_intake(patient_name="Severity Check", medications="warfarin, aspirin, ibuprofen")
+    plan = list_plan(db)
+    assert plan.count("CORRELATED SCALAR SUBQUERY") == 1, plan
+    assert "ix_intake_interactions_intake_id" in plan, plan
+    rows, _ = intake_service.list_intakes(db, limit=500)
+    severities = {row.id: row.interaction_severity for row in rows}
+    assert severities[intake["id"]] == "Major"
@@ -0,0 +1,69 @@
+"""Medication lists name every drug they mention, and counseling finds drug names inside longer ones"""
+import pytest
+
+from services import drug_interaction_service
+from services.drug_interaction_service import (
+    CATEGORY_INTERACTIONS, DEFAULT_COUNSELING_POINTS, DRUG_CATEGORIES, DRUG_INTERACTIONS,
+    check_drug_interactions, generate_counseling_points, invalidate_screening_caches, parse_medications,
+)
+from services.interaction_kb import compile_knowledge_base
+from services.medication_parser import MedicationToken
+
+
+def test_every_drug_in_an_entry_is_a_token():
+    assert [token.drug for token in parse_medications("aspirin and warfarin")] == ["aspirin", "warfarin"]
+    assert parse_medications("warfarin 5mg w/ ibuprofen 200 mg prn") == [
+        MedicationToken("warfarin", "5mg", None),
+        MedicationToken("ibuprofen", "200 mg", "prn"),
+    ]
+
+
+def test_dose_before_the_only_drug_still_belongs_to_it():
+    assert parse_medications("5 mg warfarin daily") == [MedicationToken("warfarin", "5 mg", "daily")]
+
+
+def test_unknown_entries_keep_their_text():
+    assert parse_medications("vitamin d 1000 iu; lisinopril") == [
+        MedicationToken("vitamin d", "1000 iu", None),
+        MedicationToken("lisinopril", None, None),
+    ]
+
+
+def test_drugs_sharing_an_entry_are_screened_against_each_other():
+    interactions = check_drug_interactions("warfarin 5mg w/ ibuprofen")
+    assert [(i["drug1"], i["drug2"]) for i in interactions] == [("warfarin", "ibuprofen")]
+
+
+def test_counseling_matches_names_inside_longer_words():
+    points = generate_counseling_points("pravastatin 20mg")
+    assert "• Report any muscle pain or weakness" in points
+    points = generate_counseling_points("amoxicillin-clavulanate")
+    assert "• Complete the full course even if you feel better" in points
+
+
+def test_short_counseling_names_only_match_whole_words():
+    assert generate_counseling_points("acetaminophen") == "\n".join(DEFAULT_COUNSELING_POINTS)
+    assert "• May cause dry cough (usually harmless)" in generate_counseling_points("ace inhibitor")
+
+
+@pytest.fixture
+def knowledge_base(tmp_path, monkeypatch):
+    """A compiled knowledge base knowing a drug the built-in tables do not, switched on for the test"""
+    path = str(tmp_path / "interactions.kb")
+    interactions = {**DRUG_INTERACTIONS, "zelbrafen": {"warfarin": "Major: Kb-only bleeding risk."}}
+    compile_knowledge_base(interactions, DRUG_CATEGORIES, CATEGORY_INTERACTIONS, path)
+    monkeypatch.setattr(drug_interaction_service, "INTERACTION_KB_PATH", path)
+    monkeypatch.setitem(drug_interaction_service._kb_state, "index", None)
+    monkeypatch.setitem(drug_interaction_service._kb_state, "matcher", None)
+    invalidate_screening_caches()
+    yield path
+    invalidate_screening_caches()
+
+
+def test_knowledge_base_drug_sharing_an_entry_with_a_built_in_one(knowledge_base):
+    assert parse_medications("warfarin + zelbrafen 5mg") == [
+        MedicationToken("warfarin", None, None),
+        MedicationToken("zelbrafen", "5mg", None),
+    ]
+    interactions = check_drug_interactions("warfarin + zelbrafen 5mg")
+    assert [(i["drug1"], i["drug2"], i["severity"]) for i in interactions] == [("warfarin", "zelbrafen", "Major")]
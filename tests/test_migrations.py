@@ -0,0 +1,88 @@
+"""Databases created before the migration runner existed upgrade to the current schema"""
+import json
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from database import Base, create_db_engine
+from migrations import MIGRATIONS, run_migrations
+from services import intake_service
+
+# The intakes table as the first release created it
+BASELINE_SCHEMA = """
+CREATE TABLE intakes (
+    id INTEGER NOT NULL,
+    patient_name VARCHAR,
+    patient_age INTEGER,
+    patient_allergies TEXT,
+    medications TEXT,
+    current_medications TEXT,
+    notes TEXT,
+    counseling_points TEXT,
+    pharmacist_notes TEXT,
+    drug_interactions TEXT,
+    status VARCHAR,
+    assigned_to VARCHAR,
+    dispensed VARCHAR,
+    dispensed_at DATETIME,
+    created_at DATETIME,
+    updated_at DATETIME,
+    PRIMARY KEY (id)
+);
+CREATE INDEX ix_intakes_patient_name ON intakes (patient_name);
+CREATE INDEX ix_intakes_id ON intakes (id);
+"""
+
+WARFARIN_ASPIRIN = [{
+    "drug1": "warfarin", "drug2": "aspirin", "severity": "Major",
+    "description": "Major: Increased bleeding risk. Monitor closely.",
+}]
+
+
+@pytest.fixture
+def baseline_engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA.split(";"):
+            if statement.strip():
+                conn.exec_driver_sql(statement)
+        conn.execute(text(
+            "INSERT INTO intakes (id, patient_name, medications, current_medications, drug_interactions, status,"
+            " created_at, updated_at) VALUES (:id, :name, :medications, :current, :interactions, :status,"
+            " '2024-01-02 10:00:00', '2024-01-02 10:00:00')"
+        ), [
+            {"id": 1, "name": "Maria Garcia", "medications": "warfarin", "current": "aspirin",
+             "interactions": json.dumps(WARFARIN_ASPIRIN), "status": "triage"},
+            {"id": 2, "name": "James Smith", "medications": "lisinopril", "current": None,
+             "interactions": None, "status": "new"},
+        ])
+    yield engine
+    engine.dispose()
+
+
+def upgrade(engine):
+    Base.metadata.create_all(bind=engine)
+    return run_migrations(engine)
+
+
+def test_baseline_database_upgrades(baseline_engine):
+    applied = upgrade(baseline_engine)
+    assert applied == [name for _, name, _ in MIGRATIONS]
+
+    columns = {column["name"] for column in inspect(baseline_engine).get_columns("intakes")}
+    assert {"patient_id", "screening_status"} <= columns
+    indexes = {index["name"] for index in inspect(baseline_engine).get_indexes("intakes")}
+    assert {"ix_intakes_created_at_id", "ix_intakes_status_created_at", "ix_intakes_patient_id"} <= indexes
+
+    with Session(baseline_engine) as db:
+        rows, _ = intake_service.list_intakes(db)
+        assert {row.id: row.interaction_severity for row in rows} == {1: "Major", 2: None}
+        assert {row.screening_status for row in rows} == {"screened"}
+        # The interaction JSON was mirrored into the side table
+        assert [row.id for row in intake_service.list_intakes(db, drug="warfarin")[0]] == [1]
+
+
+def test_migrations_run_once(baseline_engine):
+    upgrade(baseline_engine)
+    assert upgrade(baseline_engine) == []
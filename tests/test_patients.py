@@ -0,0 +1,96 @@
+"""Intakes are linked to patients by id or by name and date of birth, and screened against active profile entries only"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from database import PatientMedication
+from services import archive_service
+
+COMPLETE_WITHOUT_DISPENSING = ("triage", "ready_to_fill", "filled", "dispensed", "completed")
+
+
+def profile_warnings(intake):
+    return [i for i in intake["interactions"] if i["source_intake_id"] is not None]
+
+
+def test_same_name_without_date_of_birth_is_not_linked(create_intake):
+    first = create_intake(patient_name="Jordan Lee", medications="warfarin")
+    second = create_intake(patient_name="Jordan Lee", medications="aspirin")
+    assert first["patient_id"] is None and second["patient_id"] is None
+    assert profile_warnings(second) == []
+
+
+def test_same_name_different_birth_dates_are_different_patients(create_intake):
+    first = create_intake(patient_name="Sam Ortiz", patient_date_of_birth="1950-02-03", medications="warfarin")
+    second = create_intake(patient_name="sam  ortiz", patient_date_of_birth="1988-11-30", medications="aspirin")
+    assert first["patient_id"] != second["patient_id"]
+    assert profile_warnings(second) == []
+
+
+def test_name_and_birth_date_share_a_profile(create_intake, client):
+    first = create_intake(patient_name="Ada Byrne", patient_date_of_birth="1947-05-06", medications="warfarin")
+    second = create_intake(patient_name="ADA BYRNE", patient_date_of_birth="1947-05-06", medications="aspirin")
+    assert first["patient_id"] == second["patient_id"] is not None
+    assert [w["source_intake_id"] for w in profile_warnings(second)] == [first["id"]]
+    patient = client.get(f"/patients/{first['patient_id']}").json()
+    assert patient["date_of_birth"] == "1947-05-06"
+
+
+def test_explicit_patient_link(create_intake, client):
+    first = create_intake(patient_name="Robin Hale", patient_date_of_birth="1960-01-01", medications="warfarin")
+    linked = create_intake(patient_name="R. Hale", patient_id=first["patient_id"], medications="ibuprofen")
+    assert linked["patient_id"] == first["patient_id"]
+    assert profile_warnings(linked)
+    response = client.post("/intakes", json={"patient_name": "Nobody", "patient_id": 999999, "medications": "aspirin"})
+    assert response.status_code == 400
+    assert "Unknown patient id" in response.json()["detail"]
+
+
+def test_completed_without_dispensing_no_longer_screened(create_intake, client):
+    first = create_intake(patient_name="Kim Park", patient_date_of_birth="1972-07-07", medications="warfarin")
+    for status in COMPLETE_WITHOUT_DISPENSING:
+        assert client.post(f"/intakes/{first['id']}/status", json={"status": status}).status_code == 200
+    second = create_intake(patient_name="Kim Park", patient_date_of_birth="1972-07-07", medications="aspirin")
+    assert profile_warnings(second) == []
+    medications = client.get(f"/patients/{first['patient_id']}").json()["medications"]
+    assert {m["drug"]: m["retired"] for m in medications} == {"warfarin": True, "aspirin": False}
+
+
+def test_stale_pending_prescriptions_are_ignored(create_intake, db):
+    first = create_intake(patient_name="Lee Chan", patient_date_of_birth="1955-03-03", medications="warfarin")
+    long_ago = datetime.now(timezone.utc) - timedelta(days=365)
+    db.execute(update(PatientMedication).where(PatientMedication.intake_id == first["id"]).values(recorded_at=long_ago))
+    db.commit()
+    second = create_intake(patient_name="Lee Chan", patient_date_of_birth="1955-03-03", medications="aspirin")
+    assert profile_warnings(second) == []
+
+
+def test_archived_intakes_are_retired(create_intake, client, db):
+    first = create_intake(
+        patient_name="Max Roy", patient_date_of_birth="1980-08-08", medications="lisinopril",
+        current_medications="warfarin",
+    )
+    for status in COMPLETE_WITHOUT_DISPENSING:
+        client.post(f"/intakes/{first['id']}/status", json={"status": status})
+    # The newest intake is never archived
+    create_intake(patient_name="Someone Else")
+    assert archive_service.archive_batch(db, datetime.now(timezone.utc) + timedelta(seconds=1)) >= 1
+    second = create_intake(patient_name="Max Roy", patient_date_of_birth="1980-08-08", medications="aspirin")
+    assert profile_warnings(second) == []
+    recall = client.get("/patients", params={"drug": "warfarin"}).json()["items"]
+    assert first["patient_id"] in {patient["id"] for patient in recall}
+
+
+@pytest.mark.parametrize("current", ["ibuprofen", None])
+def test_reported_medications_are_replaced_by_the_latest_report(create_intake, client, current):
+    dob = "1990-09-09" if current else "1991-09-09"
+    first = create_intake(patient_name="Ari Moss", patient_date_of_birth=dob, medications="lisinopril",
+                          current_medications="naproxen")
+    create_intake(patient_name="Ari Moss", patient_date_of_birth=dob, medications="atorvastatin",
+                  current_medications=current)
+    reported = {
+        m["drug"] for m in client.get(f"/patients/{first['patient_id']}").json()["medications"]
+        if m["state"] == "reported"
+    }
+    assert reported == ({"ibuprofen"} if current else {"naproxen"})
@@ -0,0 +1,40 @@
+"""Statement budgets per endpoint, so an N+1 loop fails here instead of in production"""
+
+
+def test_create_intake_budget(client, query_budget):
+    with query_budget(6):  # patient and profile, patient upsert, intake, interactions, profile rows, counters
+        response = client.post("/intakes", json={
+            "patient_name": "Budget Create", "medications": "warfarin", "current_medications": "aspirin",
+        })
+    assert response.status_code == 200
+
+
+def test_list_intakes_budget_does_not_grow_with_page(client, create_intake, query_budget):
+    for number in range(5):
+        create_intake(patient_name=f"Budget List {number}", medications="warfarin, aspirin")
+    with query_budget(2):  # data version + page
+        response = client.get("/intakes", params={"limit": 50})
+    assert response.status_code == 200
+    assert len(response.json()["items"]) >= 5
+    with query_budget(1):  # served from the response cache
+        client.get("/intakes", params={"limit": 50})
+
+
+def test_get_intake_budget(client, create_intake, query_budget):
+    intake = create_intake(patient_name="Budget Get", medications="warfarin, aspirin")
+    with query_budget(1):
+        response = client.get(f"/intakes/{intake['id']}")
+    assert response.status_code == 200
+
+
+def test_status_change_budget(client, create_intake, query_budget):
+    intake = create_intake(patient_name="Budget Status")
+    with query_budget(3):  # counter shift, UPDATE ... RETURNING, counters
+        response = client.post(f"/intakes/{intake['id']}/status", json={"status": "triage"})
+    assert response.status_code == 200
+
+
+def test_statistics_budget(client, query_budget):
+    with query_budget(2):
+        response = client.get("/intakes/stats/summary")
+    assert response.status_code == 200
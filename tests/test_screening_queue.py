@@ -0,0 +1,66 @@
+"""Background screenings are only written back by the lease holder, and never over a pharmacist's counseling"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, update
+
+from database import Intake, ScreeningJob
+from services import intake_service, screening_queue
+
+SCREENING = ([{"drug1": "warfarin", "drug2": "aspirin", "severity": "Major", "description": "Bleeding risk"}], "Generated counseling")
+
+
+@pytest.fixture
+def queued(db, create_intake):
+    """An intake waiting for background screening, with no other jobs in the queue"""
+    db.execute(delete(ScreeningJob))
+    db.commit()
+    intake = create_intake(patient_name="Queued Patient", medications="warfarin, aspirin")
+    db.execute(update(Intake).where(Intake.id == intake["id"]).values(counseling_points=None, screening_status="pending"))
+    screening_queue.enqueue(db, [intake["id"]])
+    db.commit()
+    return intake
+
+
+def claim(db):
+    jobs = screening_queue.claim(db)
+    db.commit()
+    return jobs
+
+
+def test_screening_is_saved_by_the_lease_holder(client, db, queued):
+    jobs = claim(db)
+    assert intake_service.save_screenings(db, jobs, [SCREENING]) == 1
+    intake = client.get(f"/intakes/{queued['id']}").json()
+    assert intake["screening_status"] == "screened"
+    assert intake["counseling_points"] == "Generated counseling"
+    assert screening_queue.job_for_intake(db, queued["id"]) is None
+
+
+def test_pharmacist_counseling_survives_the_screening(client, db, queued):
+    jobs = claim(db)
+    response = client.post(f"/intakes/{queued['id']}/counseling", json={"counseling_points": "Take with food"})
+    assert response.status_code == 200, response.text
+    assert intake_service.save_screenings(db, jobs, [SCREENING]) == 1
+    intake = client.get(f"/intakes/{queued['id']}").json()
+    assert intake["screening_status"] == "screened"
+    assert intake["counseling_points"] == "Take with food"
+    assert intake["interactions"]
+
+
+def test_expired_lease_is_not_written(client, db, queued):
+    stale = claim(db)
+    db.execute(
+        update(ScreeningJob).where(ScreeningJob.id == stale[0].id)
+        .values(lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+    )
+    db.commit()
+    assert intake_service.save_screenings(db, stale, [SCREENING]) == 0
+    assert client.get(f"/intakes/{queued['id']}").json()["screening_status"] == "pending"
+
+    # The job went back to being claimable and the worker that takes it over writes it
+    current = claim(db)
+    assert [job.attempts for job in current] == [stale[0].attempts + 1]
+    assert intake_service.save_screenings(db, stale, [SCREENING]) == 0
+    assert intake_service.save_screenings(db, current, [SCREENING]) == 1
+    assert client.get(f"/intakes/{queued['id']}").json()["screening_status"] == "screened"
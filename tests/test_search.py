@@ -0,0 +1,60 @@
+"""GET /intakes/search ranks every match and pages on (rank, id)"""
+
+
+def search_all(client, q, limit):
+    """Follow next_cursor to the end; returns the pages' items"""
+    pages, cursor = [], None
+    while True:
+        params = {"q": q, "limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/intakes/search", params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        pages.append(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_best_match_first_regardless_of_age(create_intake, client):
+    oldest = create_intake(patient_name="Quillon Ashby", medications="lisinopril")
+    for i in range(5):
+        create_intake(patient_name=f"Search Filler {i}", medications="lisinopril", notes="asked about quillon")
+    (first, *rest), = search_all(client, "quillon", limit=50)
+    assert first["id"] == oldest["id"]
+    assert "<mark>" in first["snippet"]
+    assert len(rest) == 5
+
+
+def test_pages_do_not_shift_when_intakes_are_added(create_intake, client):
+    ids = {create_intake(patient_name=f"Pagina Keyset {i}")["id"] for i in range(7)}
+    response = client.get("/intakes/search", params={"q": "pagina", "limit": 3})
+    first_page = response.json()
+    # A better match added between pages lands before the cursor and is not repeated or skipped over
+    create_intake(patient_name="Pagina Pagina")
+    seen = [item["id"] for item in first_page["items"]]
+    cursor = first_page["next_cursor"]
+    while cursor:
+        page = client.get("/intakes/search", params={"q": "pagina", "limit": 3, "cursor": cursor}).json()
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+    assert len(seen) == len(set(seen))
+    assert ids <= set(seen)
+
+
+def test_bad_cursor_is_rejected(client):
+    response = client.get("/intakes/search", params={"q": "x", "cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_status_filter_pages(create_intake, client):
+    for i in range(4):
+        create_intake(patient_name=f"Statuta Filter {i}")
+    pages = search_all(client, "statuta", limit=3)
+    assert [len(items) for items in pages] == [3, 1]
+    response = client.get("/intakes/search", params={"q": "statuta", "status": "new", "limit": 3})
+    page = response.json()
+    rest = client.get(
+        "/intakes/search", params={"q": "statuta", "status": "new", "limit": 3, "cursor": page["next_cursor"]}
+    ).json()
+    assert len(page["items"]) + len(rest["items"]) == 4
+    assert client.get("/intakes/search", params={"q": "statuta", "status": "triage"}).json()["items"] == []